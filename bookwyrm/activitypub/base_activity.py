@@ -1,21 +1,49 @@
 """ basics for an activitypub serializer """
 from dataclasses import dataclass, fields, MISSING
+from functools import lru_cache
 from json import JSONEncoder
 import logging
+import time
 import requests
 
 from django.apps import apps
+from django.core.cache import cache
 from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.utils.http import http_date
 
 from bookwyrm import models
-from bookwyrm.connectors import ConnectorException, get_data
+from bookwyrm.connectors import ConnectorException, get_data, get_all_data
 from bookwyrm.signatures import make_signature
 from bookwyrm.settings import DOMAIN, INSTANCE_ACTOR_USERNAME
 from bookwyrm.tasks import app, MEDIUM
 
 logger = logging.getLogger(__name__)
 
+# the model for each activity type, filled in when the app is ready
+model_registry = {}
+
+# how many related objects (editions, attachments) to load in one task
+RELATED_BATCH_SIZE = 50
+
+# how long to remember which local object a remote id was resolved to
+RESOLVED_TIMEOUT = 60 * 60
+# how long to remember that a remote id couldn't be loaded
+UNRESOLVED_TIMEOUT = 60 * 10
+# responses that mean a remote id isn't there, which is remembered. A remote id
+# that can't be connected to at all is also remembered
+UNRESOLVED_STATUSES = [404, 410]
+# how long one worker can spend loading a remote id before another tries
+RESOLVE_LOCK_TIMEOUT = 30
+# how long to wait for another worker that's loading a remote id, and how often
+# to check whether it's done, in seconds
+RESOLVE_WAIT_TIMEOUT = 10
+RESOLVE_POLL_INTERVAL = 0.2
+# hits and misses are lookups of the cache, unresolved hits are lookups of
+# remote ids that couldn't be loaded, and shared fetches are loads that
+# were left to another worker
+RESOLUTION_STATS = ["hits", "misses", "unresolved_hits", "fetches", "shared_fetches"]
+
 
 class ActivitySerializerError(ValueError):
     """routine problems serializing activitypub json"""
@@ -58,6 +86,24 @@ def naive_parse(activity_objects, activity_json, serializer=None):
     return serializer(activity_objects=activity_objects, **activity_json)
 
 
+@lru_cache(maxsize=None)
+def get_field_info(activity_class):
+    """the name, type, whether it's an activity, default, and whether it's
+    required, for each field of an activity dataclass, which doesn't change
+    so it only has to be worked out once"""
+    field_info = []
+    for field in fields(activity_class):
+        try:
+            is_subclass = issubclass(field.type, ActivityObject)
+        except TypeError:
+            is_subclass = False
+        required = field.default == MISSING and field.default_factory == MISSING
+        field_info.append(
+            (field.name, field.type, is_subclass, field.default, required)
+        )
+    return field_info
+
+
 @dataclass(init=False)
 class ActivityObject:
     """actor activitypub json"""
@@ -69,15 +115,13 @@ class ActivityObject:
         """this lets you pass in an object with fields that aren't in the
         dataclass, which it ignores. Any field in the dataclass is required or
         has a default value"""
-        for field in fields(self):
+        for (name, field_type, is_subclass, default, required) in get_field_info(
+            type(self)
+        ):
             try:
-                value = kwargs[field.name]
+                value = kwargs[name]
                 if value in (None, MISSING, {}):
-                    raise KeyError("Missing required field", field.name)
-                try:
-                    is_subclass = issubclass(field.type, ActivityObject)
-                except TypeError:
-                    is_subclass = False
+                    raise KeyError("Missing required field", name)
                 # serialize a model obj
                 if hasattr(value, "to_activity"):
                     value = value.to_activity()
@@ -87,16 +131,14 @@ class ActivityObject:
                         value = naive_parse(activity_objects, value)
                     else:
                         value = naive_parse(
-                            activity_objects, value, serializer=field.type
+                            activity_objects, value, serializer=field_type
                         )
 
             except KeyError:
-                if field.default == MISSING and field.default_factory == MISSING:
-                    raise ActivitySerializerError(
-                        f"Missing required field: {field.name}"
-                    )
-                value = field.default
-            setattr(self, field.name, value)
+                if required:
+                    raise ActivitySerializerError(f"Missing required field: {name}")
+                value = default
+            setattr(self, name, value)
 
     # pylint: disable=too-many-locals,too-many-branches,too-many-arguments
     def to_model(
@@ -180,13 +222,13 @@ class ActivityObject:
             related_model = model_field.field.model
             related_field_name = model_field.field.name
 
-            for item in values:
-                set_related_field.delay(
+            for i in range(0, len(values), RELATED_BATCH_SIZE):
+                set_related_fields.delay(
                     related_model.__name__,
                     instance.__class__.__name__,
                     related_field_name,
                     instance.remote_id,
-                    item,
+                    values[i : i + RELATED_BATCH_SIZE],
                 )
         return instance
 
@@ -213,82 +255,236 @@ class ActivityObject:
 
 
 @app.task(queue=MEDIUM)
-@transaction.atomic
 def set_related_field(
     model_name, origin_model_name, related_field_name, related_remote_id, data
 ):
-    """load reverse related fields (editions, attachments) without blocking"""
+    """load one reverse related field, for tasks queued before they were batched"""
+    set_related_fields(
+        model_name, origin_model_name, related_field_name, related_remote_id, [data]
+    )
+
+
+@app.task(queue=MEDIUM)
+def set_related_fields(
+    model_name, origin_model_name, related_field_name, related_remote_id, items
+):
+    """load reverse related fields (editions, attachments) without blocking.
+    Items can be serialized objects or remote ids, which are loaded all at once"""
     model = apps.get_model(f"bookwyrm.{model_name}", require_ready=True)
     origin_model = apps.get_model(f"bookwyrm.{origin_model_name}", require_ready=True)
 
-    if isinstance(data, str):
-        existing = model.find_existing_by_remote_id(data)
-        if existing:
-            data = existing.to_activity()
-        else:
-            data = get_data(data)
-    activity = model.activity_serializer(**data)
-
     # this must exist because it's the object that triggered this function
     instance = origin_model.find_existing_by_remote_id(related_remote_id)
     if not instance:
         raise ValueError(f"Invalid related remote id: {related_remote_id}")
 
+    model_field = getattr(model, related_field_name)
+    new_items = []
+    # the remote data is loaded before any transaction is started
+    for item in load_related_items(model, related_field_name, instance, items):
+        # each item is saved on its own, so one bad item doesn't undo the rest
+        try:
+            with transaction.atomic():
+                saved = set_related_item(
+                    model, model_field, related_field_name, instance, item
+                )
+            if saved and not saved.id:
+                new_items.append(saved)
+        except ActivitySerializerError as err:
+            logger.info("Unable to load related %s: %s", model_name, err)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.exception("Unable to load related %s: %s", model_name, err)
+
+    if new_items:
+        create_related_items(model, new_items)
+
+
+def load_related_items(model, related_field_name, instance, items):
+    """link the objects that are already here to the origin, and get the data for
+    the rest"""
+    remote_ids = [item for item in items if isinstance(item, str)]
+    existing = find_existing_by_remote_ids(model, remote_ids)
+    # objects that are already here only need to be linked to the origin. They're
+    # saved, rather than updated in the database, so that their signals run
+    unlinked = {
+        item.id: item
+        for item in existing.values()
+        if getattr(item, f"{related_field_name}_id") != instance.id
+    }
+    for item in unlinked.values():
+        setattr(item, related_field_name, instance)
+        try:
+            item.save(broadcast=False, update_fields=[related_field_name])
+        except TypeError:
+            item.save(update_fields=[related_field_name])
+
+    missing = [remote_id for remote_id in remote_ids if remote_id not in existing]
+    loaded = get_all_data(missing) if missing else {}
+    data = [item for item in items if not isinstance(item, str)]
+    return data + [loaded[remote_id] for remote_id in missing if remote_id in loaded]
+
+
+def find_existing_by_remote_ids(model, remote_ids):
+    """look up many remote ids in one query, returns a dict by remote id"""
+    if not remote_ids:
+        return {}
+    filters = Q(remote_id__in=remote_ids)
+    if hasattr(model, "origin_id"):
+        filters |= Q(origin_id__in=remote_ids)
+    existing = {}
+    for item in model.objects.filter(filters):
+        existing[item.remote_id] = item
+        if getattr(item, "origin_id", None):
+            existing[item.origin_id] = item
+    return existing
+
+
+def set_related_item(model, model_field, related_field_name, instance, data):
+    """create or update one related object, linked to the origin"""
+    activity = model.activity_serializer(**data)
+
     # set the origin's remote id on the activity so it will be there when
     # the model instance is created
     # edition.parentWork = instance, for example
-    model_field = getattr(model, related_field_name)
     if hasattr(model_field, "activitypub_field"):
         setattr(activity, getattr(model_field, "activitypub_field"), instance.remote_id)
-    item = activity.to_model(model=model)
+        return activity.to_model(model=model)
 
-    # if the related field isn't serialized (attachments on Status), then
-    # we have to set it post-creation
-    if not hasattr(model_field, "activitypub_field"):
-        setattr(item, related_field_name, instance)
-        item.save()
+    # serialized related fields (editions on Work) are saved one at a time. Editions
+    # can't be bulk created, because they inherit from Book in another table, and
+    # saving them also sets their many to many fields and updates their identifiers
+
+    # if the related field isn't serialized (attachments on Status), then it's
+    # set before the object is saved, so that it's only saved once. New objects
+    # don't need anything from their save signals, so they're created together
+    item = model.find_existing(activity.serialize()) or model()
+    setattr(item, related_field_name, instance)
+    return activity.to_model(model=model, instance=item, save=bool(item.id))
+
+
+def create_related_items(model, items):
+    """insert new related objects all at once"""
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(items)
+            # objects that didn't come with a remote id are usually given one by a
+            # signal, once their id is known
+            unset = [item for item in items if not item.remote_id]
+            for item in unset:
+                item.remote_id = item.get_remote_id()
+            if unset:
+                model.objects.bulk_update(unset, ["remote_id"])
+    except Exception as err:  # pylint: disable=broad-except
+        logger.exception("Unable to load related %s: %s", model.__name__, err)
 
 
 def get_model_from_type(activity_type):
     """given the activity, what type of model"""
-    activity_models = apps.get_models()
-    model = [
-        m
-        for m in activity_models
-        if hasattr(m, "activity_serializer")
-        and hasattr(m.activity_serializer, "type")
-        and m.activity_serializer.type == activity_type
-    ]
-    if not model:
+    if not model_registry:
+        register_models()
+    try:
+        return model_registry[activity_type]
+    except KeyError:
         raise ActivitySerializerError(
             f'No model found for activity type "{activity_type}"'
         )
-    return model[0]
+
+
+def register_models():
+    """look up which model goes with each activity type, once the models are
+    loaded, so that parsing doesn't have to search through them"""
+    for model in apps.get_models():
+        activity_type = getattr(
+            getattr(model, "activity_serializer", None), "type", None
+        )
+        if activity_type:
+            # the first model for a type is the one that's used
+            model_registry.setdefault(activity_type, model)
 
 
 def resolve_remote_id(
-    remote_id, model=None, refresh=False, save=True, get_activity=False
+    remote_id, model=None, refresh=False, save=True, get_activity=False, wait=True
 ):
-    """take a remote_id and return an instance, creating if necessary"""
+    """take a remote_id and return an instance, creating if necessary. If another
+    worker is already loading it, its result is used, waiting a little while for
+    it unless this is a web request that shouldn't wait"""
+    if isinstance(model, str):
+        model = apps.get_model(f"bookwyrm.{model}", require_ready=True)
+
+    if not refresh:
+        result = get_resolved(remote_id, model)
+        count_resolution("hits" if result else "misses")
+        if result:
+            return result if not get_activity else result.to_activity_dataclass()
+
     if model:  # a bonus check we can do if we already know the model
-        if isinstance(model, str):
-            model = apps.get_model(f"bookwyrm.{model}", require_ready=True)
         result = model.find_existing_by_remote_id(remote_id)
         if result and not refresh:
+            set_resolved(remote_id, result)
             return result if not get_activity else result.to_activity_dataclass()
 
-    # load the data and create the object
+    if not refresh and cache.get(unresolved_cache_key(remote_id)):
+        # we tried to load this recently and couldn't
+        count_resolution("unresolved_hits")
+        return None
+
+    # only one worker loads a remote id at a time, and the others use its result
+    lock_key = f"resolve-lock-{remote_id}"
+    if not cache.add(lock_key, 1, RESOLVE_LOCK_TIMEOUT):
+        count_resolution("shared_fetches")
+        if wait:
+            result = wait_for_resolution(remote_id, model, lock_key)
+        else:
+            result = get_resolved(remote_id, model)
+        if result and get_activity:
+            return result.to_activity_dataclass()
+        return result
+    try:
+        return load_remote_id(
+            remote_id,
+            model=model,
+            refresh=refresh,
+            save=save,
+            get_activity=get_activity,
+        )
+    finally:
+        cache.delete(lock_key)
+
+
+def wait_for_resolution(remote_id, model, lock_key):
+    """the result of another worker loading a remote id, or None if it couldn't
+    load it, or hasn't finished in time"""
+    deadline = time.monotonic() + RESOLVE_WAIT_TIMEOUT
+    while True:
+        # a worker that's done has already saved its result
+        finished = not cache.get(lock_key)
+        result = get_resolved(remote_id, model)
+        if result or finished or cache.get(unresolved_cache_key(remote_id)):
+            return result
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(RESOLVE_POLL_INTERVAL)
+
+
+def load_remote_id(remote_id, model=None, refresh=False, save=True, get_activity=False):
+    """load the data for a remote_id and create or update an instance"""
+    count_resolution("fetches")
     try:
         data = get_data(remote_id)
     except ConnectionError:
         logger.info("Could not connect to host for remote_id: %s", remote_id)
+        set_unresolved(remote_id)
         return None
     except requests.HTTPError as e:
-        if (e.response is not None) and e.response.status_code == 401:
+        status_code = e.response.status_code if e.response is not None else None
+        if status_code == 401:
             # This most likely means it's a mastodon with secure fetch enabled.
             data = get_activitypub_data(remote_id)
         else:
             logger.info("Could not connect to host for remote_id: %s", remote_id)
+            # other errors, like rate limits and server errors, may not last
+            if status_code is None or status_code in UNRESOLVED_STATUSES:
+                set_unresolved(remote_id)
             return None
     # determine the model implicitly, if not provided
     # or if it's a model with subclasses like Status, check again
@@ -298,6 +494,7 @@ def resolve_remote_id(
     # check for existing items with shared unique identifiers
     result = model.find_existing(data)
     if result and not refresh:
+        set_resolved(remote_id, result)
         return result if not get_activity else result.to_activity_dataclass()
 
     item = model.activity_serializer(**data)
@@ -305,7 +502,64 @@ def resolve_remote_id(
         return item
 
     # if we're refreshing, "result" will be set and we'll update it
-    return item.to_model(model=model, instance=result, save=save)
+    result = item.to_model(model=model, instance=result, save=save)
+    set_resolved(remote_id, result)
+    return result
+
+
+def resolved_cache_key(remote_id):
+    """the cache key for the local object a remote id was resolved to"""
+    return f"resolved-{remote_id}"
+
+
+def unresolved_cache_key(remote_id):
+    """the cache key for a remote id that couldn't be loaded"""
+    return f"unresolved-{remote_id}"
+
+
+def get_resolved(remote_id, model=None):
+    """the local object a remote id was resolved to recently"""
+    resolved = cache.get(resolved_cache_key(remote_id))
+    if not resolved:
+        return None
+    (model_name, object_id) = resolved
+    resolved_model = apps.get_model(f"bookwyrm.{model_name}", require_ready=True)
+    if model and not issubclass(resolved_model, model):
+        return None
+    return resolved_model.objects.filter(id=object_id).first()
+
+
+def set_resolved(remote_id, result):
+    """remember which object a remote id belongs to"""
+    if not getattr(result, "id", None):
+        # it wasn't saved
+        return
+    cache.set(
+        resolved_cache_key(remote_id),
+        (result.__class__.__name__, result.id),
+        RESOLVED_TIMEOUT,
+    )
+
+
+def set_unresolved(remote_id):
+    """don't try to load a missing remote id again for a while"""
+    cache.set(unresolved_cache_key(remote_id), True, UNRESOLVED_TIMEOUT)
+
+
+def count_resolution(stat):
+    """keep track of how often loading remote ids is avoided"""
+    key = f"resolve-stats-{stat}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_resolution_stats():
+    """how many lookups and fetches there have been, by outcome"""
+    keys = {f"resolve-stats-{stat}": stat for stat in RESOLUTION_STATS}
+    values = cache.get_many(keys.keys())
+    return {stat: values.get(key, 0) for (key, stat) in keys.items()}
 
 
 def get_representative():
@@ -1,93 +1,838 @@
 """ access the activity streams stored in redis """
+# pylint: disable=too-many-lines
+from collections import Counter, defaultdict
 from datetime import timedelta
+from django.core.cache import cache
 from django.dispatch import receiver
 from django.db import transaction
 from django.db.models import signals, Q
 from django.utils import timezone
+import redis
 
-from bookwyrm import models
-from bookwyrm.redis_store import RedisStore, r
+from bookwyrm import models, settings
+from bookwyrm.models.user import get_feed_filter_choices
+from bookwyrm.redis_store import RedisStore, r, flush_pipeline
 from bookwyrm.tasks import app, LOW, MEDIUM, HIGH
 
+# how long to remember which chunks of a status's fan-out have run, in seconds
+FANOUT_EXPIRY = 60 * 60 * 24
+
+# how long hydrated statuses stay in the cache, in seconds. A status is cleared
+# from the cache when it's saved, but the user and book loaded with it are only
+# refreshed when it expires
+STATUS_CACHE_TIMEOUT = 60 * 15
+
+# how long a user's filtered feed is re-used after it's built, in seconds, so
+# it can take this long for new statuses to show up in it
+FILTERED_STREAM_EXPIRY = 60
+
+# how long to keep using the database for a stream that's being rebuilt, in
+# seconds, in case the task rebuilding it fails
+STREAM_REBUILD_TIMEOUT = 60 * 10
+
+# how long to remember which streams a status was added to, in seconds. Statuses
+# whose index has expired are removed by working out their audience again
+STREAM_INDEX_EXPIRY = 60 * 60 * 24 * 30
+
+# the most entries a sorted set can have and still be stored compactly as a
+# listpack, using redis's default zset-max-listpack-entries
+COMPACT_STREAM_LENGTH = 128
+
+# add a status to a stream and its status type substream, trim them both,
+# and optionally count it as unread, unless its fan-out chunk is already done. A
+# status trimmed out of its substream is in none of the user's streams, so the
+# user is dropped from that status's index
+# KEYS: stream, unread count, unread count by status type, substream (the stream
+# again if the status doesn't have one), fan-out
+# ARGV: rank, status id, max stream length, status type field, increment unread
+# (0 or 1), expiry (0 to keep the stream forever), unread count field (empty if the
+# unread count is its own key), index key suffix, user id, fan-out chunk
+ADD_STATUS_SCRIPT = """
+local max_length = tonumber(ARGV[3])
+local expiry = tonumber(ARGV[6])
+local keys = {KEYS[1]}
+if KEYS[4] ~= KEYS[1] then
+    table.insert(keys, KEYS[4])
+end
+for _, key in ipairs(keys) do
+    redis.call("ZADD", key, ARGV[1], ARGV[2])
+    if max_length > 0 then
+        if key ~= KEYS[1] then
+            local trimmed = redis.call("ZRANGE", key, 0, -1 * max_length)
+            for _, status_id in ipairs(trimmed) do
+                redis.call("SREM", status_id .. ARGV[8], ARGV[9])
+            end
+        end
+        redis.call("ZREMRANGEBYRANK", key, 0, -1 * max_length)
+    end
+end
+if ARGV[5] == "1" and redis.call("HEXISTS", KEYS[5], ARGV[10]) == 0 then
+    if ARGV[7] == "" then
+        redis.call("INCR", KEYS[2])
+    else
+        redis.call("HINCRBY", KEYS[2], ARGV[7], 1)
+    end
+    redis.call("HINCRBY", KEYS[3], ARGV[4], 1)
+    table.insert(keys, KEYS[2])
+    table.insert(keys, KEYS[3])
+end
+if expiry > 0 then
+    for _, key in ipairs(keys) do
+        redis.call("EXPIRE", key, expiry)
+    end
+end
+"""
+
+# trim a substream, dropping the user from the index of each status trimmed out
+# KEYS: substream
+# ARGV: max stream length, index key suffix, user id
+TRIM_SUBSTREAM_SCRIPT = """
+local max_length = tonumber(ARGV[1])
+local trimmed = redis.call("ZRANGE", KEYS[1], 0, -1 * max_length)
+for _, status_id in ipairs(trimmed) do
+    redis.call("SREM", status_id .. ARGV[2], ARGV[3])
+end
+redis.call("ZREMRANGEBYRANK", KEYS[1], 0, -1 * max_length)
+"""
+
+
+class AudienceSets:
+    """local followers and blocks for each user, kept in redis so that the
+    audience for a status can be worked out with set operations"""
+
+    ready_key = "audience-sets-ready"
+    local_users_key = "audience-local-users"
+
+    def followers_id(self, user_id):  # pylint: disable=no-self-use
+        """the redis key for the set of a user's local followers"""
+        return f"{user_id}-local-followers"
+
+    def blocks_id(self, user_id):  # pylint: disable=no-self-use
+        """the redis key for users who block or are blocked by a user"""
+        return f"{user_id}-blocks"
+
+    def is_ready(self):
+        """the sets are only used once they've been fully populated"""
+        return bool(r.exists(self.ready_key))
+
+    def populate(self):
+        """build every set from the database. The sets aren't used until they're
+        all built, so the pipeline is sent in batches as it goes"""
+        r.delete(self.ready_key)
+        pipeline = r.pipeline()
+        pipeline.delete(self.local_users_key)
+        for key in r.scan_iter(match=self.followers_id("*")):
+            pipeline.delete(key)
+            flush_pipeline(pipeline)
+        for key in r.scan_iter(match=self.blocks_id("*")):
+            pipeline.delete(key)
+            flush_pipeline(pipeline)
+
+        local_users = models.User.objects.filter(local=True, is_active=True)
+        for user_id in local_users.values_list("id", flat=True).iterator():
+            pipeline.sadd(self.local_users_key, user_id)
+            flush_pipeline(pipeline)
+
+        follows = models.UserFollows.objects.filter(user_subject__local=True)
+        for (subject_id, object_id) in follows.values_list(
+            "user_subject__id", "user_object__id"
+        ).iterator():
+            pipeline.sadd(self.followers_id(object_id), subject_id)
+            flush_pipeline(pipeline)
+
+        for (subject_id, object_id) in models.UserBlocks.objects.values_list(
+            "user_subject__id", "user_object__id"
+        ).iterator():
+            pipeline.sadd(self.blocks_id(subject_id), object_id)
+            pipeline.sadd(self.blocks_id(object_id), subject_id)
+            flush_pipeline(pipeline)
+
+        pipeline.set(self.ready_key, 1)
+        pipeline.execute()
+
+    def add_local_user(self, user_id):
+        """a local user who should get feeds"""
+        r.sadd(self.local_users_key, user_id)
+
+    def remove_local_user(self, user_id):
+        """a local user who is no longer active"""
+        r.srem(self.local_users_key, user_id)
+
+    def add_follower(self, user_id, follower_id):
+        """a local user followed someone"""
+        r.sadd(self.followers_id(user_id), follower_id)
+
+    def remove_follower(self, user_id, follower_id):
+        """a local user unfollowed someone"""
+        r.srem(self.followers_id(user_id), follower_id)
+
+    def add_block(self, user_id, blocked_id):
+        """blocks hide statuses in both directions"""
+        pipeline = r.pipeline()
+        pipeline.sadd(self.blocks_id(user_id), blocked_id)
+        pipeline.sadd(self.blocks_id(blocked_id), user_id)
+        pipeline.execute()
+
+    def remove_block(self, user_id, blocked_id):
+        """unblocking clears both directions"""
+        pipeline = r.pipeline()
+        pipeline.srem(self.blocks_id(user_id), blocked_id)
+        pipeline.srem(self.blocks_id(blocked_id), user_id)
+        pipeline.execute()
+
+    def get_visible_users(self, user_id):
+        """every local user who hasn't blocked (and isn't blocked by) the user"""
+        return to_ids(r.sdiff(self.local_users_key, self.blocks_id(user_id)))
+
+    def get_followers(self, user_id):
+        """local followers of a user, plus the user themself"""
+        pipeline = r.pipeline()
+        pipeline.sinter(self.followers_id(user_id), self.local_users_key)
+        pipeline.sismember(self.local_users_key, user_id)
+        pipeline.smembers(self.blocks_id(user_id))
+        results = pipeline.execute()
+        audience = to_ids(results[0]) - to_ids(results[2])
+        if results[1]:
+            audience.add(user_id)
+        return audience
+
+    def get_common_followers(self, user_id, other_user_id):
+        """local users who follow both users"""
+        return to_ids(
+            r.sinter(self.followers_id(user_id), self.followers_id(other_user_id))
+        )
+
+    def filter_visible(self, user_id, candidates):
+        """the subset of a small group of users who can see a user's statuses"""
+        candidates = list(candidates)
+        pipeline = r.pipeline()
+        for candidate in candidates:
+            pipeline.sismember(self.local_users_key, candidate)
+        pipeline.smembers(self.blocks_id(user_id))
+        results = pipeline.execute()
+        blocks = to_ids(results[-1])
+        return {
+            candidate
+            for (candidate, local) in zip(candidates, results)
+            if local and candidate not in blocks
+        }
+
+
+class StreamStatuses:
+    """the statuses in a redis stream, newest first, which can be paginated
+    without loading the whole stream from the database"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def count(self):
+        """the number of statuses in the stream"""
+        return r.zcard(self.store)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step:
+                raise ValueError("Stream slices can't have a step")
+            start = index.start or 0
+            if index.stop is None:
+                return get_statuses(r.zrevrange(self.store, start, -1))
+            if index.stop <= start:
+                return []
+            return get_statuses(r.zrevrange(self.store, start, index.stop - 1))
+        statuses = get_statuses(r.zrevrange(self.store, index, index))
+        if not statuses:
+            raise IndexError("Stream index out of range")
+        return statuses[0]
+
+    def filter(self, *args, **kwargs):
+        """the statuses in the stream that match a filter, as a queryset"""
+        return (
+            get_status_queryset()
+            .filter(id__in=to_ids(r.zrevrange(self.store, 0, -1)))
+            .filter(*args, **kwargs)
+            .order_by("-published_date")
+        )
+
+
+def get_status_queryset():
+    """statuses with everything needed to display them in a feed"""
+    return (
+        models.Status.objects.select_subclasses()
+        .select_related(
+            "user",
+            "reply_parent",
+            "comment__book",
+            "review__book",
+            "quotation__book",
+        )
+        .prefetch_related("mention_books", "mention_users")
+    )
+
+
+def status_cache_key(status_id):
+    """the cache key for a hydrated status"""
+    return f"stream-status-{status_id}"
 
+
+def get_statuses(status_ids):
+    """load statuses by id in the order given, from the cache if possible"""
+    keys = {
+        status_cache_key(int(status_id)): int(status_id) for status_id in status_ids
+    }
+    statuses = cache.get_many(keys.keys())
+
+    missing = [status_id for (key, status_id) in keys.items() if key not in statuses]
+    if missing:
+        loaded = {
+            status_cache_key(status.id): status
+            for status in get_status_queryset().filter(id__in=missing)
+        }
+        cache.set_many(loaded, timeout=STATUS_CACHE_TIMEOUT)
+        statuses.update(loaded)
+    return [statuses[key] for key in keys if key in statuses]
+
+
+def get_viewer_statuses(pairs):
+    """every recent status by users that might be in their viewers' feeds, for
+    (viewer id, user id) pairs, including ones the viewers can no longer see.
+    Each user's statuses are only loaded once, however many viewers they have"""
+    user_ids = {user_id for (_, user_id) in pairs}
+    queryset = models.Status.objects.select_subclasses().order_by("-published_date")
+    recent = {
+        user_id: list(queryset.filter(user__id=user_id)[: settings.MAX_STREAM_LENGTH])
+        for user_id in user_ids
+    }
+
+    viewer_statuses = defaultdict(list)
+    for (viewer_id, user_id) in pairs:
+        viewer_statuses[viewer_id].extend(recent[user_id])
+    return viewer_statuses
+
+
+def group_pairs_by_viewer(pairs):
+    """the user ids for each viewer id, for (viewer id, user id) pairs"""
+    viewers = defaultdict(set)
+    for (viewer_id, user_id) in pairs:
+        viewers[viewer_id].add(user_id)
+    return viewers
+
+
+def to_ids(values):
+    """redis gives back bytes, we want user ids"""
+    return {int(value) for value in values}
+
+
+audience_sets = AudienceSets()
+
+
+# pylint: disable=too-many-public-methods
 class ActivityStream(RedisStore):
     """a category of activity stream (like home, local, books)"""
 
+    # keep unread counts in one hash per user, and streams short enough for
+    # redis to encode them compactly
+    compact = settings.REDIS_COMPACT_STREAMS
+
+    @property
+    def max_length(self):
+        """compact streams are capped at the listpack size"""
+        if self.compact:
+            return min(settings.MAX_STREAM_LENGTH, COMPACT_STREAM_LENGTH)
+        return settings.MAX_STREAM_LENGTH
+
     def stream_id(self, user):
         """the redis key for this user's instance of this stream"""
+        if isinstance(user, int):
+            # allows the function to take an int or an obj
+            return f"{user}-{self.key}"
         return f"{user.id}-{self.key}"
 
     def unread_id(self, user):
         """the redis key for this user's unread count for this stream"""
+        if self.compact:
+            # one hash for all of the user's unread counts
+            user_id = user if isinstance(user, int) else user.id
+            return f"{user_id}-unread"
         stream_id = self.stream_id(user)
         return f"{stream_id}-unread"
 
     def unread_by_status_type_id(self, user):
         """the redis key for this user's unread count for this stream"""
+        if self.compact:
+            return self.unread_id(user)
         stream_id = self.stream_id(user)
         return f"{stream_id}-unread-by-type"
 
+    def unread_field(self):
+        """the hash field for the unread count, if it's in the unread hash"""
+        return self.key if self.compact else None
+
+    def unread_by_status_type_field(self, status_type):
+        """the hash field for the unread count of a status type"""
+        if self.compact:
+            return f"{self.key}-{status_type}"
+        return status_type
+
     def get_rank(self, obj):  # pylint: disable=no-self-use
         """statuses are sorted by date published"""
         return obj.published_date.timestamp()
 
+    def substream_id(self, user, filter_type):
+        """the redis key for the statuses of one type in this user's stream"""
+        return f"{self.stream_id(user)}-{filter_type}"
+
+    def get_substore_names(self, obj=None):
+        """each stream is split into a substream per feed filter type. Statuses
+        that the filters don't apply to are only in the stream itself"""
+        if obj is not None:
+            filter_type = get_feed_filter_type(obj)
+            return [] if filter_type == UNFILTERED_TYPE else [filter_type]
+        return get_feed_filter_choices()
+
+    @property
+    def expiry(self):
+        """streams expire once their user stops reading them, if configured to"""
+        if not settings.STREAM_INACTIVE_DAYS:
+            return None
+        # a day longer than fan-out carries on for, so stale streams are noticed
+        return (settings.STREAM_INACTIVE_DAYS + 1) * 60 * 60 * 24
+
+    def readers_id(self):
+        """the redis key for when each user last loaded this stream"""
+        return f"{self.key}-readers"
+
+    def get_inactive_cutoff(self):  # pylint: disable=no-self-use
+        """users who haven't loaded their stream since this time are inactive"""
+        cutoff = timezone.now() - timedelta(days=settings.STREAM_INACTIVE_DAYS)
+        return cutoff.timestamp()
+
+    def rebuilding_id(self, user):
+        """the redis key marking that a user's stream is being rebuilt"""
+        return f"{self.stream_id(user)}-rebuilding"
+
+    def built_id(self, user):
+        """the redis key marking that a user's stream has been built, which
+        expires along with the stream"""
+        return f"{self.stream_id(user)}-built"
+
+    def mark_built(self, pipeline, user_id):
+        """record that a user's stream has been built, and count it as read, so
+        that it gets new statuses"""
+        pipeline.zadd(self.readers_id(), {user_id: timezone.now().timestamp()})
+        pipeline.set(self.built_id(user_id), 1, ex=self.expiry)
+        # it's ready to be read from redis
+        pipeline.delete(self.rebuilding_id(user_id))
+
+    def filter_active_user_ids(self, user_ids):
+        """the users in a status's audience who have loaded this stream recently
+        enough to keep it updated. Only the audience's scores are looked up, so
+        this doesn't grow with the number of readers"""
+        user_ids = list(user_ids)
+        cutoff = self.get_inactive_cutoff()
+        active = set()
+        for i in range(0, len(user_ids), settings.REDIS_PIPELINE_SIZE):
+            batch = user_ids[i : i + settings.REDIS_PIPELINE_SIZE]
+            pipeline = r.pipeline()
+            for user_id in batch:
+                pipeline.zscore(self.readers_id(), user_id)
+            active.update(
+                user_id
+                for (user_id, last_read) in zip(batch, pipeline.execute())
+                if last_read is not None and last_read >= cutoff
+            )
+        return active
+
+    def touch_stream(self, user):
+        """record that the user is reading their stream and keep it from
+        expiring. Returns whether the stream was built and kept up to date while
+        they were away, and whether it's still being rebuilt"""
+        pipeline = r.pipeline()
+        pipeline.zscore(self.readers_id(), user.id)
+        pipeline.exists(self.rebuilding_id(user))
+        pipeline.exists(self.built_id(user))
+        pipeline.zadd(self.readers_id(), {user.id: timezone.now().timestamp()})
+        keys = self.get_keys(self.stream_id(user), self.get_substore_names())
+        for key in keys + [self.unread_id(user), self.built_id(user)]:
+            pipeline.expire(key, self.expiry)
+        results = pipeline.execute()
+        (last_read, rebuilding, built) = results[:3]
+        # a rebuild that failed never marks the stream as built, so it's retried
+        fresh = (
+            bool(built)
+            and last_read is not None
+            and last_read >= self.get_inactive_cutoff()
+        )
+        return (fresh, bool(rebuilding))
+
+    def fanout_id(self, status):
+        """the redis key recording which chunks of a status's fan-out are done"""
+        return f"{status.id}-{self.key}-fanout"
+
+    def index_id(self, status_id):
+        """the redis key for the users whose stream a status was added to"""
+        return f"{status_id}-{self.key}-streams"
+
+    def index_status(self, pipeline, status_id, user_ids, complete=True):
+        """record whose streams a status was added to. Only fan-out sees the
+        status's whole audience, so only it marks the index as complete"""
+        index_id = self.index_id(status_id)
+        # 0 isn't a user, it marks that the index is complete, even if the status
+        # was added to no streams
+        members = [0, *user_ids] if complete else list(user_ids)
+        if not members:
+            return
+        pipeline.sadd(index_id, *members)
+        # the index isn't needed after the streams it lists have expired
+        expiry = STREAM_INDEX_EXPIRY
+        if self.expiry:
+            expiry = min(expiry, self.expiry)
+        pipeline.expire(index_id, expiry)
+
+    def index_object(self, pipeline, obj, stores):
+        """statuses added to streams one user at a time are indexed too, by the
+        user id at the start of each stream's key. A status that wasn't indexed
+        when it was fanned out may be in other streams, so this doesn't make its
+        index complete"""
+        self.index_status(
+            pipeline,
+            obj.id,
+            [int(store.split("-")[0]) for store in stores],
+            complete=False,
+        )
+
+    def trim_stores(self, pipeline, keys):
+        """limit the length of streams, and drop users from the index of the
+        statuses that are trimmed out of their substreams"""
+        script = self.get_script(TRIM_SUBSTREAM_SCRIPT) if self.max_length else None
+        if not script:
+            super().trim_stores(pipeline, keys)
+            return
+
+        full_streams = set()
+        for key in keys:
+            user_id = int(key.split("-")[0])
+            if key == self.stream_id(user_id):
+                full_streams.add(key)
+                continue
+            script(
+                keys=[key],
+                # the index key, without the status id
+                args=[self.max_length, self.index_id(""), user_id],
+                client=pipeline,
+            )
+            if self.expiry:
+                pipeline.expire(key, self.expiry)
+            flush_pipeline(pipeline)
+        super().trim_stores(pipeline, full_streams)
+
     def add_status(self, status, increment_unread=False):
         """add a status to users' feeds"""
-        # the pipeline contains all the add-to-stream activities
-        pipeline = self.add_object_to_related_stores(status, execute=False)
-
-        if increment_unread:
-            for user in self.get_audience(status):
-                # add to the unread status count
-                pipeline.incr(self.unread_id(user))
-                # add to the unread status count for status type
-                pipeline.hincrby(
-                    self.unread_by_status_type_id(user), get_status_type(status), 1
-                )
+        audience = sorted(self.get_audience_ids(status))
+        if not audience:
+            # it's still indexed, so that removing it doesn't look for an audience
+            pipeline = r.pipeline()
+            self.index_status(pipeline, status.id, [])
+            pipeline.execute()
+            return
+
+        chunks = [
+            audience[i : i + settings.FANOUT_CHUNK_SIZE]
+            for i in range(0, len(audience), settings.FANOUT_CHUNK_SIZE)
+        ]
+        # most statuses only need one chunk, which isn't worth another task
+        if len(chunks) == 1:
+            self.add_status_to_users(status, chunks[0], increment_unread)
+            return
+
+        for (index, chunk) in enumerate(chunks):
+            add_status_chunk_task.apply_async(
+                args=(self.key, status.id, chunk, index),
+                kwargs={"increment_unread": increment_unread},
+                queue=HIGH,
+            )
+
+    def add_status_to_users(self, status, user_ids, increment_unread=False, chunk=0):
+        """add a status to the feeds of one chunk of its audience. The whole chunk
+        is written in one transaction, along with the record that it's done, so
+        running it again doesn't count the status as unread twice. That means
+        FANOUT_CHUNK_SIZE, not REDIS_PIPELINE_SIZE, limits the transaction's size"""
+        status_type = get_status_type(status) if increment_unread else ""
+        script = self.get_script(ADD_STATUS_SCRIPT)
+        if not script:
+            self.add_status_with_pipeline(
+                status, user_ids, status_type, increment_unread, chunk
+            )
+            return
 
+        fanout_id = self.fanout_id(status)
+        substores = self.get_substore_names(status)
+        # one command per user, instead of six. The pipeline isn't flushed part
+        # way through, so the chunk is all written or not written at all, and the
+        # chunk size is the only limit on how many commands it holds
+        pipeline = r.pipeline()
+        for user_id in user_ids:
+            script(
+                keys=[
+                    self.stream_id(user_id),
+                    self.unread_id(user_id),
+                    self.unread_by_status_type_id(user_id),
+                    # the last key is the stream itself if there's no substream
+                    self.get_keys(self.stream_id(user_id), substores)[-1],
+                    fanout_id,
+                ],
+                args=[
+                    self.get_rank(status),
+                    status.id,
+                    self.max_length or 0,
+                    self.unread_by_status_type_field(status_type),
+                    int(increment_unread),
+                    self.expiry or 0,
+                    self.unread_field() or "",
+                    # the index key, without the status id
+                    self.index_id(""),
+                    user_id,
+                    chunk,
+                ],
+                client=pipeline,
+            )
+        self.finish_chunk(pipeline, status, user_ids, chunk)
         # and go!
         pipeline.execute()
 
+    def finish_chunk(self, pipeline, status, user_ids, chunk):
+        """index a chunk of a status's fan-out and mark it as complete"""
+        self.index_status(pipeline, status.id, user_ids)
+        pipeline.hset(self.fanout_id(status), chunk, len(user_ids))
+        pipeline.expire(self.fanout_id(status), FANOUT_EXPIRY)
+
+    # pylint: disable=too-many-arguments
+    def add_status_with_pipeline(
+        self, status, user_ids, status_type, increment_unread, chunk
+    ):
+        """add a status to streams without the lua script. The fan-out record is
+        watched, so that if another worker finishes the chunk first, it's tried
+        again without counting the status as unread"""
+        fanout_id = self.fanout_id(status)
+        value = self.get_value(status)
+        substores = self.get_substore_names(status)
+        keys = [
+            key
+            for user_id in user_ids
+            for key in self.get_keys(self.stream_id(user_id), substores)
+        ]
+        with r.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(fanout_id)
+                    unread = increment_unread and not pipeline.hexists(fanout_id, chunk)
+                    pipeline.multi()
+                    for key in keys:
+                        pipeline.zadd(key, value)
+                        if self.max_length:
+                            pipeline.zremrangebyrank(key, 0, -1 * self.max_length)
+                        if self.expiry:
+                            pipeline.expire(key, self.expiry)
+                    if unread:
+                        self.count_unread(pipeline, user_ids, status_type)
+                    self.finish_chunk(pipeline, status, user_ids, chunk)
+                    pipeline.execute()
+                    return
+                except redis.WatchError:
+                    # a chunk finished while this one was being written, so check
+                    # again whether it was this one
+                    continue
+
+    def count_unread(self, pipeline, user_ids, status_type):
+        """count a status as unread in users' streams"""
+        for user_id in user_ids:
+            # add to the unread status count
+            if self.compact:
+                pipeline.hincrby(self.unread_id(user_id), self.unread_field(), 1)
+            else:
+                pipeline.incr(self.unread_id(user_id))
+            # add to the unread status count for status type
+            pipeline.hincrby(
+                self.unread_by_status_type_id(user_id),
+                self.unread_by_status_type_field(status_type),
+                1,
+            )
+            if self.expiry:
+                pipeline.expire(self.unread_id(user_id), self.expiry)
+                pipeline.expire(self.unread_by_status_type_id(user_id), self.expiry)
+
+    def bulk_add_statuses(self, statuses, skip_user_ids=frozenset()):
+        """add a batch of statuses to every stream they belong in, without
+        touching unread counts, except the streams of users who are skipped.
+        Returns how many statuses were added to each user's stream"""
+        pipeline = r.pipeline()
+        keys = set()
+        added = Counter()
+        audiences = self.get_batch_audience_ids(statuses)
+        load_boosted_statuses(statuses)
+        for status in statuses:
+            value = self.get_value(status)
+            substores = self.get_substore_names(status)
+            user_ids = audiences[status.id] - skip_user_ids
+            for user_id in user_ids:
+                for key in self.get_keys(self.stream_id(user_id), substores):
+                    pipeline.zadd(key, value)
+                    keys.add(key)
+                added[user_id] += 1
+                flush_pipeline(pipeline)
+            self.index_status(pipeline, status.id, user_ids)
+
+        # trim once per stream, rather than after every status
+        self.trim_stores(pipeline, keys)
+        pipeline.execute()
+        return added
+
+    def get_batch_audience_ids(self, statuses):
+        """the audience of each status in a batch, by status id"""
+        return {status.id: self.get_audience_ids(status) for status in statuses}
+
+    def remove_statuses(self, status_ids):
+        """remove statuses from every stream they were added to, using the
+        index. Returns the ids of statuses whose index isn't complete, which
+        also need to be removed from the streams of their audience"""
+        status_ids = list(status_ids)
+        substores = self.get_substore_names()
+        incomplete = []
+        for i in range(0, len(status_ids), settings.REDIS_PIPELINE_SIZE):
+            batch = status_ids[i : i + settings.REDIS_PIPELINE_SIZE]
+            pipeline = r.pipeline()
+            for status_id in batch:
+                pipeline.smembers(self.index_id(status_id))
+            indexes = pipeline.execute()
+
+            for (status_id, user_ids) in zip(batch, indexes):
+                user_ids = to_ids(user_ids)
+                if 0 not in user_ids:
+                    incomplete.append(status_id)
+                for user_id in user_ids - {0}:
+                    for key in self.get_keys(self.stream_id(user_id), substores):
+                        pipeline.zrem(key, status_id)
+                    flush_pipeline(pipeline)
+                if user_ids:
+                    pipeline.delete(self.index_id(status_id))
+            pipeline.execute()
+        return incomplete
+
     def add_user_statuses(self, viewer, user):
         """add a user's statuses to another user's feed"""
-        # only add the statuses that the viewer should be able to see (ie, not dms)
-        statuses = models.Status.privacy_filter(viewer).filter(user=user)
-        self.bulk_add_objects_to_store(statuses, self.stream_id(viewer))
+        self.bulk_add_user_statuses([(viewer.id, user.id)])
 
     def remove_user_statuses(self, viewer, user):
         """remove a user's status from another user's feed"""
         # remove all so that followers only statuses are removed
-        statuses = user.status_set.all()
-        self.bulk_remove_objects_from_store(statuses, self.stream_id(viewer))
-
-    def get_activity_stream(self, user):
-        """load the statuses to be displayed"""
-        # clear unreads for this feed
+        self.bulk_remove_user_statuses(get_viewer_statuses([(viewer.id, user.id)]))
+
+    def get_user_statuses_for_viewer(self, viewer, user_ids):
+        """the statuses by some users that belong in a viewer's stream, by the
+        same rules as populating the stream"""
+        return self.get_statuses_for_user(viewer).filter(user__id__in=user_ids)
+
+    def bulk_add_user_statuses(self, pairs):
+        """add users' statuses to viewers' feeds, for (viewer id, user id) pairs.
+        Each viewer's statuses are loaded in one query"""
+        viewers = group_pairs_by_viewer(pairs)
+        for viewer in models.User.objects.filter(id__in=viewers.keys()):
+            statuses = self.get_user_statuses_for_viewer(
+                viewer, viewers[viewer.id]
+            ).order_by("-published_date")
+            self.bulk_add_objects_to_store(statuses, self.stream_id(viewer))
+
+    def bulk_remove_user_statuses(self, viewer_statuses):
+        """remove statuses from viewers' feeds, given the statuses for each viewer"""
+        for (viewer_id, statuses) in viewer_statuses.items():
+            self.bulk_remove_objects_from_store(statuses, self.stream_id(viewer_id))
+
+    def clear_unread(self, user):
+        """the user has seen their feed"""
+        if self.compact:
+            fields = list(self.get_unread_count_by_status_type(user))
+            pipeline = r.pipeline()
+            pipeline.hset(self.unread_id(user), self.unread_field(), 0)
+            if fields:
+                pipeline.hdel(
+                    self.unread_id(user),
+                    *[self.unread_by_status_type_field(f) for f in fields],
+                )
+            pipeline.execute()
+            return
         r.set(self.unread_id(user), 0)
         r.delete(self.unread_by_status_type_id(user))
 
-        statuses = self.get_store(self.stream_id(user))
-        return (
-            models.Status.objects.select_subclasses()
-            .filter(id__in=statuses)
-            .select_related(
-                "user",
-                "reply_parent",
-                "comment__book",
-                "review__book",
-                "quotation__book",
+    def get_stream_statuses(self, user, allowed_types=None):
+        """the statuses to be displayed, as a lazy list that only loads the
+        statuses on the page that is shown"""
+        # clear unreads for this feed
+        self.clear_unread(user)
+
+        if self.expiry:
+            (fresh, rebuilding) = self.touch_stream(user)
+            if not fresh and not rebuilding:
+                # the stream expired while the user was away, so rebuild it
+                r.set(self.rebuilding_id(user), 1, ex=STREAM_REBUILD_TIMEOUT)
+                populate_stream_task.delay(self.key, user.id)
+            if not fresh or rebuilding:
+                # and use the database until it's ready
+                return self.get_fallback_statuses(user, allowed_types)
+
+        filter_types = get_feed_filter_choices()
+        if allowed_types is None or set(filter_types) <= set(allowed_types):
+            return StreamStatuses(self.stream_id(user))
+
+        excluded = [f for f in filter_types if f not in allowed_types]
+        store = f"{self.stream_id(user)}-without-{'-'.join(excluded)}"
+        if r.exists(store):
+            return StreamStatuses(store)
+
+        # the stream, less the substreams for the types the user doesn't want to
+        # see. Those are weighted to a score of 0 and then dropped, which works
+        # because every status was published after 1970
+        weights = {self.stream_id(user): 1}
+        weights.update({self.substream_id(user, f): 0 for f in excluded})
+        pipeline = r.pipeline()
+        pipeline.zunionstore(store, weights, aggregate="MIN")
+        pipeline.zremrangebyscore(store, "-inf", 0)
+        pipeline.expire(store, FILTERED_STREAM_EXPIRY)
+        pipeline.execute()
+        return StreamStatuses(store)
+
+    def get_fallback_statuses(self, user, allowed_types=None):
+        """the statuses for a user's stream, straight from the database"""
+        statuses = self.get_statuses_for_user(user)
+        for (filter_type, model) in FEED_FILTER_MODELS:
+            if allowed_types is None or filter_type in allowed_types:
+                continue
+            name = model._meta.model_name  # pylint: disable=protected-access
+            statuses = statuses.filter(
+                Q(**{f"{name}__isnull": True}),
+                Q(**{f"boost__boosted_status__{name}__isnull": True}),
             )
-            .prefetch_related("mention_books", "mention_users")
-            .order_by("-published_date")
-        )
+        latest = statuses.order_by("-published_date").values("id")[: self.max_length]
+        return get_status_queryset().filter(id__in=latest).order_by("-published_date")
 
     def get_unread_count(self, user):
         """get the unread status count for this user's feed"""
+        if self.compact:
+            return int(r.hget(self.unread_id(user), self.unread_field()) or 0)
         return int(r.get(self.unread_id(user)) or 0)
 
     def get_unread_count_by_status_type(self, user):
         """get the unread status count for this user's feed's status types"""
         status_types = r.hgetall(self.unread_by_status_type_id(user))
+        if self.compact:
+            # the hash has the counts for every stream
+            prefix = f"{self.key}-"
+            return {
+                key.decode("utf-8")[len(prefix) :]: int(value) or 0
+                for key, value in status_types.items()
+                if key.decode("utf-8").startswith(prefix)
+            }
         return {
             str(key.decode("utf-8")): int(value) or 0
             for key, value in status_types.items()
@@ -96,6 +841,10 @@ class ActivityStream(RedisStore):
     def populate_streams(self, user):
         """go from zero to a timeline"""
         self.populate_store(self.stream_id(user))
+        if self.expiry:
+            pipeline = r.pipeline()
+            self.mark_built(pipeline, user.id)
+            pipeline.execute()
 
     def get_audience(self, status):  # pylint: disable=no-self-use
         """given a status, what users should see it"""
@@ -136,6 +885,47 @@ class ActivityStream(RedisStore):
             )
         return audience.distinct()
 
+    def get_audience_ids(self, status):
+        """the ids of the users who should see a status, using the relationship
+        sets in redis if they have been built, or the database if not"""
+        if not audience_sets.is_ready():
+            audience = self.get_audience(status)
+            if isinstance(audience, list):
+                audience = {user.id for user in audience}
+            else:
+                audience = set(audience.values_list("id", flat=True))
+        else:
+            audience = self.get_audience_ids_from_sets(status)
+
+        # streams for users who aren't reading them are left to expire
+        if audience and self.expiry:
+            audience = self.filter_active_user_ids(audience)
+        return audience
+
+    def get_audience_ids_from_sets(self, status):  # pylint: disable=no-self-use
+        """set-based equivalent of get_audience"""
+        if status.privacy == "direct" and status.status_type == "Note":
+            return set()
+
+        author_id = status.user.id
+        # only visible to the poster and mentioned users
+        if status.privacy == "direct":
+            mentions = status.mention_users.values_list("id", flat=True)
+            return audience_sets.filter_visible(author_id, {author_id, *mentions})
+
+        # don't show replies to statuses the user can't see
+        if status.reply_parent and status.reply_parent.privacy == "followers":
+            parent_author_id = status.reply_parent.user.id
+            followers = audience_sets.get_common_followers(author_id, parent_author_id)
+            return audience_sets.filter_visible(
+                author_id, {author_id, parent_author_id, *followers}
+            )
+
+        # only visible to the poster's followers and tagged users
+        if status.privacy == "followers":
+            return audience_sets.get_followers(author_id)
+        return audience_sets.get_visible_users(author_id)
+
     def get_stores_for_object(self, obj):
         return [self.stream_id(u) for u in self.get_audience(obj)]
 
@@ -165,6 +955,35 @@ class HomeStream(ActivityStream):
             | Q(following=status.user)  # if the user is following the author
         ).distinct()
 
+    def get_audience_ids_from_sets(self, status):
+        audience = super().get_audience_ids_from_sets(status)
+        if not audience:
+            return audience
+        return audience & audience_sets.get_followers(status.user.id)
+
+    def get_user_statuses_for_viewer(self, viewer, user_ids):
+        """direct comments, reviews and quotes go to the users they mention, as
+        they do when they're first posted, but direct messages don't"""
+        return (
+            models.Status.privacy_filter(viewer)
+            .filter(user__id__in=user_ids)
+            .exclude(
+                privacy="direct",
+                comment__isnull=True,
+                quotation__isnull=True,
+                review__isnull=True,
+                generatednote__isnull=True,
+            )
+            .exclude(
+                ~Q(  # remove everything except
+                    Q(user__followers=viewer)  # user following
+                    | Q(user=viewer)  # is self
+                    | Q(mention_users=viewer)  # mentions user
+                ),
+            )
+            .distinct()
+        )
+
     def get_statuses_for_user(self, user):
         return models.Status.privacy_filter(
             user,
@@ -189,6 +1008,11 @@ class LocalStream(ActivityStream):
             return []
         return super().get_audience(status)
 
+    def get_audience_ids_from_sets(self, status):
+        if status.privacy != "public" or not status.user.local:
+            return set()
+        return super().get_audience_ids_from_sets(status)
+
     def get_statuses_for_user(self, user):
         # all public statuses by a local user
         return models.Status.privacy_filter(
@@ -206,21 +1030,63 @@ class BooksStream(ActivityStream):
         """anyone with the mentioned book on their shelves"""
         # only show public statuses on the books feed,
         # and only statuses that mention books
-        if status.privacy != "public" or not (
-            status.mention_books.exists() or hasattr(status, "book")
-        ):
+        work_id = self.get_status_work_id(status)
+        if not work_id:
             return []
 
-        work = (
-            status.book.parent_work
-            if hasattr(status, "book")
-            else status.mention_books.first().parent_work
-        )
-
         audience = super().get_audience(status)
         if not audience:
             return []
-        return audience.filter(shelfbook__book__parent_work=work).distinct()
+        return audience.filter(shelfbook__book__parent_work__id=work_id).distinct()
+
+    def get_audience_ids_from_sets(self, status):
+        work_id = self.get_status_work_id(status)
+        if not work_id:
+            return set()
+        audience = super().get_audience_ids_from_sets(status)
+        if not audience:
+            return audience
+        return audience & self.get_readers([work_id])[work_id]
+
+    def get_batch_audience_ids(self, statuses):
+        """the audience of each status in a batch, looking up who has the books
+        on their shelves once for the whole batch"""
+        if not audience_sets.is_ready():
+            return super().get_batch_audience_ids(statuses)
+
+        works = {status.id: self.get_status_work_id(status) for status in statuses}
+        readers = self.get_readers({work_id for work_id in works.values() if work_id})
+        audiences = {}
+        for status in statuses:
+            audience = set()
+            if readers[works[status.id]]:
+                audience = super().get_audience_ids_from_sets(status)
+                audience &= readers[works[status.id]]
+            # streams for users who aren't reading them are left to expire
+            if audience and self.expiry:
+                audience = self.filter_active_user_ids(audience)
+            audiences[status.id] = audience
+        return audiences
+
+    def get_readers(self, work_ids):  # pylint: disable=no-self-use
+        """the local users with each work on their shelves"""
+        readers = defaultdict(set)
+        shelf_books = models.ShelfBook.objects.filter(
+            user__local=True, book__parent_work__id__in=work_ids
+        ).values_list("book__parent_work__id", "user__id")
+        for (work_id, user_id) in shelf_books:
+            readers[work_id].add(user_id)
+        return readers
+
+    def get_status_work_id(self, status):  # pylint: disable=no-self-use
+        """the work a public status is about, if any"""
+        if status.privacy != "public":
+            return None
+        if hasattr(status, "book"):
+            return status.book.parent_work_id
+        # the mentioned books may have been prefetched
+        book = next(iter(status.mention_books.all()), None)
+        return book.parent_work_id if book else None
 
     def get_statuses_for_user(self, user):
         """any public status that mentions the user's books"""
@@ -334,12 +1200,45 @@ def add_status_on_create_command(sender, instance, created):
         handle_boost_task.delay(instance.id)
 
 
+@receiver(signals.post_save)
+@receiver(signals.post_delete)
+# pylint: disable=unused-argument
+def clear_status_cache(sender, instance, *args, **kwargs):
+    """edited, deleted, and boosted statuses need to be re-loaded for feeds"""
+    if not issubclass(sender, models.Status):
+        return
+    keys = [status_cache_key(instance.id)]
+    if sender == models.Boost:
+        keys.append(status_cache_key(instance.boosted_status_id))
+    # otherwise the old version could be cached again before the change is saved
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(signals.m2m_changed, sender=models.Status.mention_users.through)
+@receiver(signals.m2m_changed, sender=models.Status.mention_books.through)
+# pylint: disable=unused-argument
+def clear_status_cache_on_mention(sender, instance, *args, **kwargs):
+    """mentions are loaded with the status, so the cached copy is out of date"""
+    if isinstance(instance, models.Status):
+        key = status_cache_key(instance.id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
 @receiver(signals.post_delete, sender=models.Boost)
 # pylint: disable=unused-argument
 def remove_boost_on_delete(sender, instance, *args, **kwargs):
     """boosts are deleted"""
-    # remove the boost
-    remove_status_task.delay(instance.id)
+    # remove the boost. It's gone from the database by the time the task runs, so
+    # the task gets what it needs to work out where the boost is, if it has to
+    remove_status_task.delay(
+        instance.id,
+        deleted_boost={
+            "id": instance.id,
+            "user_id": instance.user_id,
+            "boosted_status_id": instance.boosted_status_id,
+            "privacy": instance.privacy,
+        },
+    )
     # re-add the original status
     add_status_task.delay(instance.boosted_status.id)
 
@@ -413,12 +1312,116 @@ def add_statuses_on_unblock(sender, instance, *args, **kwargs):
         )
 
 
+@receiver(signals.post_save, sender=models.FederatedServer)
+# pylint: disable=unused-argument
+def update_streams_on_server_block(sender, instance, *args, **kwargs):
+    """take statuses from a blocked server out of its local followers' feeds, and
+    put them back when it's unblocked"""
+    update_fields = kwargs.get("update_fields")
+    if not update_fields or "status" not in update_fields:
+        return
+    blocked = instance.status == "blocked"
+    transaction.on_commit(
+        lambda: update_streams_on_server_block_command(instance, blocked)
+    )
+
+
+def update_streams_on_server_block_command(server, blocked):
+    """queue a task for each chunk of followers, after the block is saved"""
+    pairs = list(
+        models.UserFollows.objects.filter(
+            user_subject__local=True, user_object__federated_server=server
+        ).values_list("user_subject__id", "user_object__id")
+    )
+    for i in range(0, len(pairs), settings.FANOUT_CHUNK_SIZE):
+        chunk = pairs[i : i + settings.FANOUT_CHUNK_SIZE]
+        if blocked:
+            bulk_remove_user_statuses_task.delay(chunk)
+        else:
+            # put them back in every stream the block took them out of, which
+            # only adds the statuses that each stream would have had
+            bulk_add_user_statuses_task.delay(chunk)
+
+
+@receiver(signals.post_save, sender=models.UserFollows)
+# pylint: disable=unused-argument
+def add_follower_to_audience_sets(sender, instance, created, *args, **kwargs):
+    """keep the follower sets used for fan-out up to date"""
+    if not created or not instance.user_subject.local:
+        return
+    transaction.on_commit(
+        lambda: audience_sets.add_follower(
+            instance.user_object.id, instance.user_subject.id
+        )
+    )
+
+
+@receiver(signals.post_delete, sender=models.UserFollows)
+# pylint: disable=unused-argument
+def remove_follower_from_audience_sets(sender, instance, *args, **kwargs):
+    """keep the follower sets used for fan-out up to date"""
+    if not instance.user_subject.local:
+        return
+    transaction.on_commit(
+        lambda: audience_sets.remove_follower(
+            instance.user_object.id, instance.user_subject.id
+        )
+    )
+
+
+@receiver(signals.post_save, sender=models.UserBlocks)
+# pylint: disable=unused-argument
+def add_block_to_audience_sets(sender, instance, created, *args, **kwargs):
+    """keep the block sets used for fan-out up to date"""
+    if not created:
+        return
+    transaction.on_commit(
+        lambda: audience_sets.add_block(
+            instance.user_subject.id, instance.user_object.id
+        )
+    )
+
+
+@receiver(signals.post_delete, sender=models.UserBlocks)
+# pylint: disable=unused-argument
+def remove_block_from_audience_sets(sender, instance, *args, **kwargs):
+    """keep the block sets used for fan-out up to date"""
+    # the block set goes both ways, so leave it if there's a block the other way
+    if models.UserBlocks.objects.filter(
+        user_subject=instance.user_object,
+        user_object=instance.user_subject,
+    ).exists():
+        return
+    transaction.on_commit(
+        lambda: audience_sets.remove_block(
+            instance.user_subject.id, instance.user_object.id
+        )
+    )
+
+
+@receiver(signals.post_save, sender=models.User)
+# pylint: disable=unused-argument
+def update_audience_sets_on_user_save(
+    sender, instance, created, *args, update_fields=None, **kwargs
+):
+    """add new local users to the audience sets, and remove deactivated ones"""
+    if not instance.local or (update_fields and "is_active" not in update_fields):
+        return
+    if instance.is_active:
+        transaction.on_commit(lambda: audience_sets.add_local_user(instance.id))
+    else:
+        transaction.on_commit(lambda: audience_sets.remove_local_user(instance.id))
+
+
 @receiver(signals.post_save, sender=models.User)
 # pylint: disable=unused-argument
 def populate_streams_on_account_create(sender, instance, created, *args, **kwargs):
     """build a user's feeds when they join"""
     if not created or not instance.local:
         return
+    # streams are built when they're first loaded instead
+    if settings.STREAM_INACTIVE_DAYS:
+        return
     transaction.on_commit(
         lambda: populate_streams_on_account_create_command(instance.id)
     )
@@ -490,19 +1493,40 @@ def populate_stream_task(stream, user_id):
     stream.populate_streams(user)
 
 
+@app.task(queue=LOW)
+def populate_audience_sets_task():
+    """rebuild the follower and block sets used for fan-out"""
+    audience_sets.populate()
+
+
 @app.task(queue=MEDIUM)
-def remove_status_task(status_ids):
-    """remove a status from any stream it might be in"""
+def remove_status_task(status_ids, deleted_boost=None):
+    """remove a status from any stream it might be in, including a boost that's
+    been deleted, given its id, user id, boosted status id and privacy"""
     # this can take an id or a list of ids
     if not isinstance(status_ids, list):
         status_ids = [status_ids]
-    statuses = models.Status.objects.filter(id__in=status_ids)
 
     for stream in streams.values():
+        incomplete = stream.remove_statuses(status_ids)
+        if not incomplete:
+            continue
+        # statuses added before the index, or whose index has expired
+        statuses = list(models.Status.objects.filter(id__in=incomplete))
+        if deleted_boost and deleted_boost["id"] in incomplete:
+            # the boost's audience is worked out from an unsaved copy of it
+            statuses.append(models.Boost(**deleted_boost))
         for status in statuses:
             stream.remove_object_from_related_stores(status)
 
 
+def remove_statuses(status_ids):
+    """remove a lot of statuses from streams at once, like for moderation"""
+    status_ids = list(status_ids)
+    for i in range(0, len(status_ids), settings.FANOUT_CHUNK_SIZE):
+        remove_status_task.delay(status_ids[i : i + settings.FANOUT_CHUNK_SIZE])
+
+
 @app.task(queue=HIGH)
 def add_status_task(status_id, increment_unread=False):
     """add a status to any stream it should be in"""
@@ -515,6 +1539,15 @@ def add_status_task(status_id, increment_unread=False):
         stream.add_status(status, increment_unread=increment_unread)
 
 
+@app.task(queue=HIGH)
+def add_status_chunk_task(stream, status_id, user_ids, chunk, increment_unread=False):
+    """add a status to the streams of one chunk of its audience"""
+    status = models.Status.objects.select_subclasses().get(id=status_id)
+    streams[stream].add_status_to_users(
+        status, user_ids, increment_unread=increment_unread, chunk=chunk
+    )
+
+
 @app.task(queue=MEDIUM)
 def remove_user_statuses_task(viewer_id, user_id, stream_list=None):
     """remove all statuses by a user from a viewer's stream"""
@@ -535,6 +1568,24 @@ def add_user_statuses_task(viewer_id, user_id, stream_list=None):
         stream.add_user_statuses(viewer, user)
 
 
+@app.task(queue=MEDIUM)
+def bulk_remove_user_statuses_task(pairs, stream_list=None):
+    """remove users' statuses from viewers' streams, for (viewer id, user id) pairs"""
+    stream_list = [streams[s] for s in stream_list] if stream_list else streams.values()
+    viewer_statuses = get_viewer_statuses(pairs)
+    for stream in stream_list:
+        stream.bulk_remove_user_statuses(viewer_statuses)
+
+
+@app.task(queue=MEDIUM)
+def bulk_add_user_statuses_task(pairs, stream_list=None):
+    """add users' statuses to viewers' streams, for (viewer id, user id) pairs"""
+    stream_list = [streams[s] for s in stream_list] if stream_list else streams.values()
+    for stream in stream_list:
+        # each stream has its own rules for which statuses belong in it
+        stream.bulk_add_user_statuses(pairs)
+
+
 @app.task(queue=MEDIUM)
 def handle_boost_task(boost_id):
     """remove the original post and other, earlier boosts"""
@@ -555,6 +1606,65 @@ def handle_boost_task(boost_id):
             stream.remove_object_from_related_stores(status, stores=audience)
 
 
+# the filter type of statuses that the feed filters don't apply to, like notes,
+# which don't have a substream
+UNFILTERED_TYPE = "other"
+FEED_FILTER_MODELS = [
+    ("review", models.Review),
+    ("comment", models.Comment),
+    ("quotation", models.Quotation),
+    ("everything", models.GeneratedNote),
+]
+
+
+def get_boosted_status(boost):
+    """the status that was boosted, as its subclass. It's loaded in one query if
+    it hasn't been already, instead of looking for each subclass in turn"""
+    if not models.Boost.boosted_status.is_cached(boost):
+        boost.boosted_status = models.Status.objects.select_subclasses().get(
+            id=boost.boosted_status_id
+        )
+    return boost.boosted_status
+
+
+def load_boosted_statuses(statuses):
+    """load the statuses boosted by a batch of statuses in one query"""
+    boosts = [
+        status
+        for status in statuses
+        if isinstance(status, models.Boost)
+        and not models.Boost.boosted_status.is_cached(status)
+    ]
+    if not boosts:
+        return
+    boosted = models.Status.objects.select_subclasses().in_bulk(
+        {boost.boosted_status_id for boost in boosts}
+    )
+    for boost in boosts:
+        if boost.boosted_status_id in boosted:
+            boost.boosted_status = boosted[boost.boosted_status_id]
+
+
+def get_feed_filter_type(status):
+    """which of the feed filter choices applies to a status, going by the
+    original status for boosts"""
+    if isinstance(status, models.Boost):
+        status = get_boosted_status(status)
+    elif status.__class__ is models.Status and hasattr(status, "boost"):
+        status = get_boosted_status(status.boost)
+
+    for (filter_type, model) in FEED_FILTER_MODELS:
+        if isinstance(status, model):
+            return filter_type
+
+    # the status may have been loaded without its subclass
+    if status.__class__ is models.Status:
+        for (filter_type, model) in FEED_FILTER_MODELS:
+            if hasattr(status, model.__name__.lower()):
+                return filter_type
+    return UNFILTERED_TYPE
+
+
 def get_status_type(status):
     """return status type even for boosted statuses"""
     status_type = status.status_type.lower()
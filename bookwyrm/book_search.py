@@ -1,14 +1,66 @@
 """ using a bookwyrm instance as a source of book data """
 from dataclasses import asdict, dataclass
-from functools import reduce
-import operator
+from hashlib import md5
 
-from django.contrib.postgres.search import SearchRank, SearchQuery
-from django.db.models import F, Q
+from django.contrib.postgres.search import SearchRank, SearchQuery, TrigramSimilarity
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
 
 from bookwyrm import models
-from bookwyrm import connectors
 from bookwyrm.settings import MEDIA_FULL_URL
+from bookwyrm.tasks import app, LOW
+
+# how many books and authors to suggest as someone types
+TYPEAHEAD_LIMIT = 8
+# the trigram indexes can't help with anything shorter than a trigram
+TYPEAHEAD_MIN_LENGTH = 3
+# how long to remember suggestions, in seconds
+TYPEAHEAD_CACHE_TIMEOUT = 60
+# how many books' search vectors to update in one query
+SEARCH_VECTOR_BATCH_SIZE = 1000
+
+# recompute the search vectors for a set of books, given as a query for their ids.
+# Books are queued for this by triggers when their titles or authors change
+UPDATE_SEARCH_VECTORS_SQL = """
+    WITH books AS ({books}),
+    book_authors AS (
+        SELECT books.book_id, string_agg(bookwyrm_author.name, ' ') AS names
+        FROM books
+        LEFT OUTER JOIN bookwyrm_book_authors
+        ON bookwyrm_book_authors.book_id = books.book_id
+        LEFT OUTER JOIN bookwyrm_author
+        ON bookwyrm_author.id = bookwyrm_book_authors.author_id
+        GROUP BY books.book_id
+    ), updated AS (
+        UPDATE bookwyrm_book SET search_vector =
+            coalesce(
+                NULLIF(setweight(to_tsvector('english', coalesce(title, '')), 'A'), ''),
+                setweight(to_tsvector('simple', coalesce(title, '')), 'A')
+            ) ||
+            setweight(to_tsvector('english', coalesce(subtitle, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(book_authors.names, '')), 'C') ||
+            setweight(to_tsvector('english', coalesce(series, '')), 'D')
+        FROM book_authors
+        WHERE bookwyrm_book.id = book_authors.book_id
+        RETURNING bookwyrm_book.id
+    )
+    SELECT count(*) FROM books
+"""
+# take a batch of books off the queue, skipping any another worker is updating
+QUEUED_BOOKS_SQL = """
+    DELETE FROM bookwyrm_book_search_queue
+    WHERE book_id IN (
+        SELECT book_id FROM bookwyrm_book_search_queue
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING book_id
+"""
+BOOK_RANGE_SQL = """
+    SELECT id AS book_id FROM bookwyrm_book
+    WHERE id >= %(start)s AND id < %(end)s
+"""
 
 
 # pylint: disable=arguments-differ
@@ -38,13 +90,15 @@ def isbn_search(query):
     """search your local database"""
     if not query:
         return []
-    # Up-case the ISBN string to ensure any 'X' check-digit is correct
-    # If the ISBN has only 9 characters, prepend missing zero
-    query = query.strip().upper().rjust(10, "0")
-    filters = [{f: query} for f in ["isbn_10", "isbn_13"]]
+    # isbn 10s and 13s are both stored as isbn 13s
+    isbn = models.identifier.normalize_isbn(query)
+    if not isbn:
+        return models.Edition.objects.none()
     return models.Edition.objects.filter(
-        reduce(operator.or_, (Q(**f) for f in filters))
-    ).distinct()
+        id__in=models.Identifier.objects.filter(
+            identifier_type=models.identifier.ISBN, value=isbn
+        ).values("book_id")
+    )
 
 
 def format_search_result(search_result):
@@ -67,20 +121,14 @@ def format_search_result(search_result):
 
 
 def search_identifiers(query, *filters, return_first=False):
-    """tries remote_id, isbn; defined as dedupe fields on the model"""
-    if connectors.maybe_isbn(query):
-        # Oh did you think the 'S' in ISBN stood for 'standard'?
-        normalized_isbn = query.strip().upper().rjust(10, "0")
-        query = normalized_isbn
-    # pylint: disable=W0212
-    or_filters = [
-        {f.name: query}
-        for f in models.Edition._meta.get_fields()
-        if hasattr(f, "deduplication_field") and f.deduplication_field
-    ]
+    """tries remote_id, isbn; defined as dedupe fields on the model, and looked
+    up in the identifier table"""
     results = models.Edition.objects.filter(
-        *filters, reduce(operator.or_, (Q(**f) for f in or_filters))
-    ).distinct()
+        *filters,
+        id__in=models.Identifier.objects.filter(
+            value__in=models.identifier.identifier_values(query)
+        ).values("book_id"),
+    )
 
     if return_first:
         return results.first()
@@ -98,21 +146,112 @@ def search_title_author(query, min_confidence, *filters, return_first=False):
     )
 
     # when there are multiple editions of the same work, pick the closest
-    editions_of_work = results.values_list("parent_work__id", flat=True).distinct()
-
-    # filter out multiple editions of the same work
-    list_results = []
-    for work_id in set(editions_of_work[:30]):
-        result = (
-            results.filter(parent_work=work_id)
-            .order_by("-rank", "-edition_rank")
-            .first()
+    closest_editions = results.order_by(
+        "parent_work__id", "-rank", "-edition_rank"
+    ).distinct("parent_work__id")
+
+    # filter out multiple editions of the same work, in the same query
+    results = (
+        models.Edition.objects.filter(id__in=closest_editions.values("id"))
+        .annotate(rank=SearchRank(F("search_vector"), query))
+        .order_by("-rank", "-edition_rank")
+    )
+
+    if return_first:
+        return results.first()
+    return list(results[:30])
+
+
+def typeahead(query, limit=TYPEAHEAD_LIMIT):
+    """books and authors with names that contain a partial query, like "the name
+    of the w", for suggestions as someone types"""
+    query = " ".join((query or "").split())
+    if len(query) < TYPEAHEAD_MIN_LENGTH:
+        return {"books": [], "authors": []}
+
+    key = f"typeahead-{md5(query.lower().encode('utf-8')).hexdigest()}-{limit}"
+    suggestions = cache.get(key)
+    if suggestions is None:
+        suggestions = {
+            "books": typeahead_books(query, limit),
+            "authors": typeahead_authors(query, limit),
+        }
+        cache.set(key, suggestions, TYPEAHEAD_CACHE_TIMEOUT)
+    return suggestions
+
+
+def typeahead_books(query, limit):
+    """the closest matching title of each work, using the title trigram index"""
+    editions = (
+        models.Edition.objects.filter(title__trigram_contains=query)
+        .annotate(similarity=TrigramSimilarity("title", query))
+        .order_by("-similarity", "-edition_rank")
+        .prefetch_related("authors")
+    )
+    # the best edition of each work is the first one, so a few more than are
+    # needed are enough to fill the list with different works
+    books = []
+    works = set()
+    for edition in editions[: limit * 3]:
+        if edition.parent_work_id in works:
+            continue
+        works.add(edition.parent_work_id)
+        books.append(
+            {
+                "id": edition.id,
+                "title": edition.title,
+                "author": edition.author_text,
+                "year": edition.published_date.year if edition.published_date else None,
+                "url": edition.local_path,
+            }
         )
+    return books[:limit]
+
 
-        if return_first:
-            return result
-        list_results.append(result)
-    return list_results
+def typeahead_authors(query, limit):
+    """authors with matching names, using the name trigram index"""
+    authors = (
+        models.Author.objects.filter(name__trigram_contains=query)
+        .annotate(similarity=TrigramSimilarity("name", query))
+        .order_by("-similarity")
+    )
+    return [
+        {"id": author.id, "name": author.name, "url": author.local_path}
+        for author in authors[:limit]
+    ]
+
+
+def update_search_vectors(batch_size=SEARCH_VECTOR_BATCH_SIZE):
+    """recompute the search vectors of books that have changed, a batch at a
+    time, and return how many books were updated"""
+    total = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                UPDATE_SEARCH_VECTORS_SQL.format(books=QUEUED_BOOKS_SQL),
+                {"batch_size": batch_size},
+            )
+            count = cursor.fetchone()[0]
+        if not count:
+            return total
+        total += count
+
+
+@app.task(queue=LOW)
+def update_search_vectors_task():
+    """make books that have changed searchable, run periodically by celery beat"""
+    update_search_vectors()
+
+
+def rebuild_search_vectors(start, end):
+    """recompute the search vectors of every book with an id in a range, and
+    return how many books were updated"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPDATE_SEARCH_VECTORS_SQL.format(books=BOOK_RANGE_SQL),
+            {"start": start, "end": end},
+        )
+        return cursor.fetchone()[0]
 
 
 @dataclass
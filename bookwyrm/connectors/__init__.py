@@ -1,6 +1,6 @@
 """ bring connectors into the namespace """
 from .settings import CONNECTORS
 from .abstract_connector import ConnectorException
-from .abstract_connector import get_data, get_image, maybe_isbn
+from .abstract_connector import get_data, get_all_data, get_image, maybe_isbn
 
 from .connector_manager import search, first_search_result
@@ -1,22 +1,40 @@
 """ functionality outline for a book data connector """
 from abc import ABC, abstractmethod
+import asyncio
+from functools import lru_cache
+from hashlib import md5
+from http.cookiejar import DefaultCookiePolicy
 from urllib.parse import quote_plus
 import imghdr
 import logging
 import re
+import time
 
+import aiohttp
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.db import transaction
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 from bookwyrm import activitypub, models, settings
+from bookwyrm.utils.http import JSON_ACCEPT, PooledSession
 from .connector_manager import load_more_data, ConnectorException, raise_not_valid_url
 from .format_mappings import format_mappings
 
 
 logger = logging.getLogger(__name__)
 
+# how many requests to one host can be open at once when loading data in bulk
+LOAD_HOST_CONCURRENCY = 10
+# how many hosts each process keeps connections open to, and how many
+# connections it keeps open to each one
+POOL_HOSTS = 20
+POOL_SIZE = 4
+# how long to keep a response that can be revalidated, in seconds
+HTTP_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
 
 class AbstractMinimalConnector(ABC):
     """just the bare bones, for other bookwyrm instances"""
@@ -127,7 +145,7 @@ class AbstractConnector(AbstractMinimalConnector):
 
     def get_book_data(self, remote_id):  # pylint: disable=no-self-use
         """this allows connectors to override the default behavior"""
-        return get_data(remote_id)
+        return get_data(remote_id, use_cache=True)
 
     def create_edition_from_data(self, work, edition_data, instance=None):
         """if we already have the work, we're ready"""
@@ -223,53 +241,169 @@ def dict_from_mappings(data, mappings):
     return result
 
 
-def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
-    """wrapper for request.get"""
+@lru_cache(maxsize=None)
+def get_session():
+    """the session shared by every request in this process, which keeps
+    connections to each host open to be re-used"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = settings.USER_AGENT
+    # every host shares the session, so none of them get to set cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def http_cache_key(url, params=None):
+    """the cache key for a response"""
+    request = requests.Request("GET", url, params=params).prepare()
+    return f"http-cache-{md5(request.url.encode('utf-8')).hexdigest()}"
+
+
+def get_freshness(resp):
+    """how long a response can be used without checking whether it's changed, in
+    seconds, or None if it shouldn't be stored at all"""
+    directives = {}
+    for directive in resp.headers.get("Cache-Control", "").lower().split(","):
+        (name, _, value) = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+
+    # responses meant for one user aren't shared with everyone else
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    try:
+        return int(directives.get("s-maxage") or directives.get("max-age") or 0)
+    except ValueError:
+        return 0
+
+
+def store_response(key, resp, data):
+    """keep a response, if it's allowed and it's possible to use it again"""
+    freshness = get_freshness(resp)
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if freshness is None or not (freshness or etag or last_modified):
+        return
+    cache.set(
+        key,
+        {
+            "data": data,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh_until": time.time() + freshness,
+        },
+        max(HTTP_CACHE_TIMEOUT, freshness),
+    )
+
+
+def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT, use_cache=False):
+    """wrapper for request.get. With use_cache, responses are stored and only
+    requested again once they're stale, and then only if they've changed"""
     # check if the url is blocked
     raise_not_valid_url(url)
 
+    headers = {"Accept": JSON_ACCEPT}
+    key = http_cache_key(url, params) if use_cache else None
+    cached = cache.get(key) if key else None
+    if cached:
+        if cached["fresh_until"] > time.time():
+            return cached["data"]
+        # ask for the data only if it's changed
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
     try:
-        resp = requests.get(
-            url,
-            params=params,
-            headers={  # pylint: disable=line-too-long
-                "Accept": (
-                    'application/json, application/activity+json, application/ld+json; profile="https://www.w3.org/ns/activitystreams"; charset=utf-8'
-                ),
-                "User-Agent": settings.USER_AGENT,
-            },
-            timeout=timeout,
-        )
+        resp = get_session().get(url, params=params, headers=headers, timeout=timeout)
     except RequestException as err:
         logger.info(err)
         raise ConnectorException(err)
 
+    if cached and resp.status_code == 304:
+        store_response(key, resp, cached["data"])
+        return cached["data"]
+
     if not resp.ok:
         if resp.status_code == 401:
             # this is probably an AUTHORIZED_FETCH issue
             resp.raise_for_status()
         else:
-            raise ConnectorException()
+            raise ConnectorException(response=resp)
     try:
         data = resp.json()
     except ValueError as err:
         logger.info(err)
         raise ConnectorException(err)
 
+    if key:
+        store_response(key, resp, data)
     return data
 
 
+class DataLoader:
+    """loads json from many urls at once, over a pooled session"""
+
+    def __init__(self):
+        self.pool = PooledSession(LOAD_HOST_CONCURRENCY)
+
+    def load_all(self, urls, timeout=settings.QUERY_TIMEOUT):
+        """get the data at each url, returns a dict of the ones that loaded"""
+        results = self.pool.run(self.async_load_all(urls, timeout))
+        return {url: data for (url, data) in zip(urls, results) if data is not None}
+
+    async def async_load_all(self, urls, timeout):
+        """request everything at once, the connector limits it per host"""
+        session = await self.pool.get_session()
+        timeout = aiohttp.ClientTimeout(total=timeout)
+        return await asyncio.gather(*[self.load(session, url, timeout) for url in urls])
+
+    # pylint: disable=no-self-use
+    async def load(self, session, url, timeout):
+        """get the json at a url"""
+        headers = {"Accept": JSON_ACCEPT, "User-Agent": settings.USER_AGENT}
+        try:
+            async with session.get(url, headers=headers, timeout=timeout) as response:
+                if not response.ok:
+                    logger.info("Unable to load %s: %s", url, response.reason)
+                    return None
+                return await response.json(content_type=None)
+        except ValueError as err:
+            logger.info("Invalid json at %s: %s", url, err)
+        except asyncio.TimeoutError:
+            logger.info("Connection timed out for url: %s", url)
+        except aiohttp.ClientError as err:
+            logger.info("Unable to connect to %s: %s", url, err)
+        return None
+
+
+data_loader = DataLoader()
+
+
+def get_all_data(urls, timeout=settings.QUERY_TIMEOUT):
+    """like get_data, but for many urls at once. Urls that are blocked or fail to
+    load are left out of the results"""
+    allowed = []
+    for url in dict.fromkeys(urls):
+        try:
+            raise_not_valid_url(url)
+        except ConnectorException:
+            logger.info("Request denied to blocked domain: %s", url)
+            continue
+        allowed.append(url)
+    if not allowed:
+        return {}
+    return data_loader.load_all(allowed, timeout=timeout)
+
+
 def get_image(url, timeout=10):
     """wrapper for requesting an image"""
     raise_not_valid_url(url)
     try:
-        resp = requests.get(
-            url,
-            headers={
-                "User-Agent": settings.USER_AGENT,
-            },
-            timeout=timeout,
-        )
+        resp = get_session().get(url, timeout=timeout)
     except RequestException as err:
         logger.info(err)
         return None, None
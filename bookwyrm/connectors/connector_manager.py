@@ -1,22 +1,39 @@
 """ interface with whatever connectors the app has """
 import asyncio
+from hashlib import md5
 import importlib
 import ipaddress
 import logging
+import time
 from urllib.parse import urlparse
+from uuid import uuid4
 
 import aiohttp
+from django.core.cache import cache
 from django.dispatch import receiver
 from django.db.models import signals
 
 from requests import HTTPError
 
-from bookwyrm import book_search, models
+from bookwyrm import book_search, models, settings
 from bookwyrm.settings import SEARCH_TIMEOUT, USER_AGENT
-from bookwyrm.tasks import app, LOW
+from bookwyrm.tasks import app, LOW, SEARCH
+from bookwyrm.utils.http import JSON_ACCEPT
 
 logger = logging.getLogger(__name__)
 
+# how long stale search results are kept, to show while they're refreshed
+SEARCH_CACHE_STALE_TIMEOUT = 60 * 60 * 24 * 7
+# hits are results that were fresh, stale hits were shown while they were
+# refreshed, and misses had to be searched for
+SEARCH_CACHE_STATS = ["hits", "stale_hits", "misses"]
+# how long a search's results are kept for the browser to collect, in seconds
+SEARCH_RESULTS_TIMEOUT = 60 * 10
+# how much each search counts towards a connector's average response time
+LATENCY_WEIGHT = 0.2
+# connectors that take longer than this on average are searched last, in seconds
+SLOW_CONNECTOR_LATENCY = SEARCH_TIMEOUT / 2
+
 
 class ConnectorException(HTTPError):
     """when the connector can't do what was asked"""
@@ -24,26 +41,25 @@ class ConnectorException(HTTPError):
 
 async def get_results(session, url, min_confidence, query, connector):
     """try this specific connector"""
-    # pylint: disable=line-too-long
-    headers = {
-        "Accept": (
-            'application/json, application/activity+json, application/ld+json; profile="https://www.w3.org/ns/activitystreams"; charset=utf-8'
-        ),
-        "User-Agent": USER_AGENT,
-    }
+    headers = {"Accept": JSON_ACCEPT, "User-Agent": USER_AGENT}
     params = {"min_confidence": min_confidence}
+    start = time.perf_counter()
     try:
         async with session.get(url, headers=headers, params=params) as response:
             if not response.ok:
                 logger.info("Unable to connect to %s: %s", url, response.reason)
+                # a connector that fails counts as slow as one that times out
+                record_latency(connector, SEARCH_TIMEOUT)
                 return
 
             try:
                 raw_data = await response.json()
             except aiohttp.client_exceptions.ContentTypeError as err:
                 logger.exception(err)
+                record_latency(connector, SEARCH_TIMEOUT)
                 return
 
+            record_latency(connector, time.perf_counter() - start)
             return {
                 "connector": connector,
                 "results": connector.process_search_response(
@@ -52,8 +68,10 @@ async def get_results(session, url, min_confidence, query, connector):
             }
     except asyncio.TimeoutError:
         logger.info("Connection timed out for url: %s", url)
+        record_latency(connector, SEARCH_TIMEOUT)
     except aiohttp.ClientError as err:
         logger.info(err)
+        record_latency(connector, SEARCH_TIMEOUT)
 
 
 async def async_connector_search(query, items, min_confidence):
@@ -76,10 +94,17 @@ def search(query, min_confidence=0.1, return_first=False):
     """find books based on arbitary keywords"""
     if not query:
         return []
-    results = []
 
+    connectors = list(get_connectors())
+    found = {}
     items = []
-    for connector in get_connectors():
+    for connector in connectors:
+        # popular searches are answered from the cache
+        cached = get_cached_search(connector, query, min_confidence)
+        if cached is not None:
+            found[connector.identifier] = {"connector": connector, "results": cached}
+            continue
+
         # get the search url from the connector before sending
         url = connector.get_search_url(query)
         try:
@@ -91,8 +116,17 @@ def search(query, min_confidence=0.1, return_first=False):
         items.append((url, connector))
 
     # load as many results as we can
-    results = asyncio.run(async_connector_search(query, items, min_confidence))
-    results = [r for r in results if r]
+    if items:
+        loaded = asyncio.run(async_connector_search(query, items, min_confidence))
+        for result in loaded:
+            # failed requests will return None, so filter those out
+            if not result:
+                continue
+            connector = result["connector"]
+            cache_search(connector, query, min_confidence, result["results"])
+            found[connector.identifier] = result
+    # in the connectors' priority order
+    results = [found[c.identifier] for c in connectors if c.identifier in found]
 
     if return_first:
         # find the best result from all the responses and return that
@@ -100,10 +134,222 @@ def search(query, min_confidence=0.1, return_first=False):
         all_results = sorted(all_results, key=lambda r: r.confidence, reverse=True)
         return all_results[0] if all_results else None
 
-    # failed requests will return None, so filter those out
     return results
 
 
+def start_search(query, min_confidence=0.1):
+    """search every connector in the background, so that results can be shown as
+    each connector responds. Returns an id for collecting the results"""
+    search_id = uuid4().hex
+    identifiers = []
+    searches = []
+    for connector in get_connectors():
+        cached = get_cached_search(connector, query, min_confidence)
+        if cached is not None:
+            store_search_results(search_id, connector, cached)
+            identifiers.append(connector.identifier)
+            continue
+        url = connector.get_search_url(query)
+        try:
+            raise_not_valid_url(url)
+        except ConnectorException:
+            logger.info("Request denied to blocked domain: %s", url)
+            continue
+        identifiers.append(connector.identifier)
+        searches.append(connector)
+
+    # the connectors are listed before any are searched, so their results can't
+    # come in before anyone knows to look for them
+    cache.set(search_results_key(search_id), identifiers, SEARCH_RESULTS_TIMEOUT)
+    for connector in searches:
+        connector_search_task.delay(
+            search_id, connector.connector.id, query, min_confidence
+        )
+    return search_id
+
+
+# someone is waiting on the search page for these
+@app.task(queue=SEARCH)
+def connector_search_task(search_id, connector_id, query, min_confidence):
+    """search one connector for a search that was started with start_search"""
+    connector = load_connector(models.Connector.objects.get(id=connector_id))
+    results = []
+    try:
+        url = connector.get_search_url(query)
+        result = asyncio.run(
+            async_connector_search(query, [(url, connector)], min_confidence)
+        )[0]
+        if result:
+            results = result["results"]
+            cache_search(connector, query, min_confidence, results)
+    finally:
+        # an empty list marks a connector that failed as done
+        store_search_results(search_id, connector, results)
+
+
+def search_results_key(search_id, connector=None):
+    """the cache key for a search started with start_search, or for one of its
+    connectors' results"""
+    if connector:
+        return f"connector-search-results-{search_id}-{connector.identifier}"
+    return f"connector-search-results-{search_id}"
+
+
+def store_search_results(search_id, connector, results):
+    """keep a connector's results until the browser collects them"""
+    cache.set(
+        search_results_key(search_id, connector),
+        [result.json() for result in results],
+        SEARCH_RESULTS_TIMEOUT,
+    )
+
+
+def get_search_results(search_id):
+    """the results of a search started with start_search, from the connectors that
+    have responded so far, and whether any are still loading. None if there is no
+    such search"""
+    identifiers = cache.get(search_results_key(search_id))
+    if identifiers is None:
+        return None
+
+    connectors = {
+        c.identifier: c
+        for c in models.Connector.objects.filter(identifier__in=identifiers)
+    }
+    keys = {
+        search_results_key(search_id, connectors[identifier]): identifier
+        for identifier in identifiers
+        if identifier in connectors
+    }
+    values = cache.get_many(keys.keys())
+    results = []
+    for (key, identifier) in keys.items():
+        if key not in values:
+            continue
+        connector = connectors[identifier]
+        results.append(
+            {
+                "connector": connector,
+                "results": [
+                    book_search.SearchResult(**result, connector=connector)
+                    for result in values[key]
+                ],
+            }
+        )
+    return {"results": results, "loading": len(results) < len(keys)}
+
+
+def search_cache_key(connector, query, min_confidence):
+    """the cache key for a connector's results for a query, which is normalized
+    so that searches that only differ in case or spacing share results"""
+    normalized = " ".join(query.lower().split())
+    digest = md5(f"{normalized}-{min_confidence}".encode("utf-8")).hexdigest()
+    return f"connector-search-{connector.identifier}-{digest}"
+
+
+def get_cached_search(connector, query, min_confidence):
+    """a connector's stored results for a query, or None if it has to be searched.
+    Stale results are returned, and refreshed in the background"""
+    key = search_cache_key(connector, query, min_confidence)
+    cached = cache.get(key)
+    if cached is None:
+        count_search(connector, "misses")
+        return None
+
+    if cached["fresh_until"] > time.time():
+        count_search(connector, "hits")
+    else:
+        count_search(connector, "stale_hits")
+        # there only needs to be one task refreshing a search
+        if cache.add(f"{key}-refreshing", 1, SEARCH_TIMEOUT * 2):
+            refresh_search_task.delay(connector.connector.id, query, min_confidence)
+
+    return [
+        book_search.SearchResult(**result, connector=connector)
+        for result in cached["results"]
+    ]
+
+
+def cache_search(connector, query, min_confidence, results):
+    """store a connector's results for a query"""
+    cache.set(
+        search_cache_key(connector, query, min_confidence),
+        {
+            "results": [result.json() for result in results],
+            "fresh_until": time.time() + settings.SEARCH_CACHE_TIMEOUT,
+        },
+        settings.SEARCH_CACHE_TIMEOUT + SEARCH_CACHE_STALE_TIMEOUT,
+    )
+
+
+@app.task(queue=LOW)
+def refresh_search_task(connector_id, query, min_confidence):
+    """search a connector again for results that have gone stale"""
+    connector = load_connector(models.Connector.objects.get(id=connector_id))
+    key = search_cache_key(connector, query, min_confidence)
+    try:
+        url = connector.get_search_url(query)
+        raise_not_valid_url(url)
+        results = asyncio.run(
+            async_connector_search(query, [(url, connector)], min_confidence)
+        )
+        if results[0]:
+            cache_search(connector, query, min_confidence, results[0]["results"])
+    finally:
+        cache.delete(f"{key}-refreshing")
+
+
+def count_search(connector, stat):
+    """keep track of how often searches are answered from the cache"""
+    key = f"connector-search-stats-{connector.identifier}-{stat}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_search_cache_stats():
+    """how often each active connector's searches were cached, by outcome"""
+    identifiers = models.Connector.objects.filter(active=True).values_list(
+        "identifier", flat=True
+    )
+    keys = {
+        f"connector-search-stats-{identifier}-{stat}": (identifier, stat)
+        for identifier in identifiers
+        for stat in SEARCH_CACHE_STATS
+    }
+    values = cache.get_many(keys.keys())
+    stats = {identifier: {} for identifier in identifiers}
+    for (key, (identifier, stat)) in keys.items():
+        stats[identifier][stat] = values.get(key, 0)
+
+    latencies = cache.get_many([latency_key(i) for i in identifiers])
+    for identifier in identifiers:
+        stats[identifier]["latency"] = latencies.get(latency_key(identifier))
+    return stats
+
+
+def latency_key(identifier):
+    """the cache key for a connector's average response time"""
+    return f"connector-latency-{identifier}"
+
+
+def record_latency(connector, seconds):
+    """keep a moving average of how long a connector takes to respond, so that
+    slow connectors can be searched last"""
+    key = latency_key(connector.identifier)
+    average = cache.get(key)
+    if average is not None:
+        seconds = average + (seconds - average) * LATENCY_WEIGHT
+    cache.set(key, seconds, None)
+
+
+def is_slow(connector, latencies):
+    """whether a connector usually takes a while to respond"""
+    latency = latencies.get(latency_key(connector.identifier))
+    return latency is not None and latency > SLOW_CONNECTOR_LATENCY
+
+
 def first_search_result(query, min_confidence=0.1):
     """search until you find a result that fits"""
     # try local search first
@@ -115,9 +361,14 @@ def first_search_result(query, min_confidence=0.1):
 
 
 def get_connectors():
-    """load all connectors"""
-    for info in models.Connector.objects.filter(active=True).order_by("priority").all():
-        yield load_connector(info)
+    """load all connectors, by priority, with slow connectors last"""
+    connectors = [
+        load_connector(info)
+        for info in models.Connector.objects.filter(active=True).order_by("priority")
+    ]
+    latencies = cache.get_many([latency_key(c.identifier) for c in connectors])
+    # the sort is stable, so connectors are otherwise in priority order
+    return sorted(connectors, key=lambda c: is_slow(c, latencies))
 
 
 def get_or_create_connector(remote_id):
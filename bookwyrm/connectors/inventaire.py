@@ -65,7 +65,7 @@ class Connector(AbstractConnector):
         return f"{self.books_url}?action=by-uris&uris={value}"
 
     def get_book_data(self, remote_id):
-        data = get_data(remote_id)
+        data = get_data(remote_id, use_cache=True)
         extracted = list(data.get("entities").values())
         try:
             data = extracted[0]
@@ -121,7 +121,7 @@ class Connector(AbstractConnector):
         """get a list of editions for a work"""
         # pylint: disable=line-too-long
         url = f"{self.books_url}?action=reverse-claims&property=wdt:P629&value={work_uri}&sort=true"
-        return get_data(url)
+        return get_data(url, use_cache=True)
 
     def get_edition_from_work_data(self, data):
         data = self.load_edition_data(data.get("uri"))
@@ -201,7 +201,7 @@ class Connector(AbstractConnector):
             return ""
         url = f"{self.base_url}/api/data?action=wp-extract&lang=en&title={link}"
         try:
-            data = get_data(url)
+            data = get_data(url, use_cache=True)
         except ConnectorException:
             return ""
         return data.get("extract")
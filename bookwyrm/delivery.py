@@ -0,0 +1,443 @@
+""" durable delivery of outgoing activities, queued in redis by host """
+import asyncio
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import json
+import logging
+import time
+from urllib.parse import urlparse
+from uuid import uuid4
+
+import aiohttp
+import redis
+from django.apps import apps
+from django.utils.http import http_date
+
+from bookwyrm import settings
+from bookwyrm.redis_store import r, flush_pipeline
+from bookwyrm.signatures import make_digest, Signer
+from bookwyrm.tasks import app, DELIVERY
+from bookwyrm.utils.http import PooledSession
+
+logger = logging.getLogger(__name__)
+
+# the redis set of hosts with deliveries waiting
+HOSTS_KEY = "delivery-hosts"
+
+# how many times to try to deliver an activity to an inbox before giving up
+MAX_ATTEMPTS = 8
+# how long to wait before retrying a delivery, in seconds, doubled for each attempt
+RETRY_DELAY = 30
+# how long a delivery can be in progress before it's tried again, in seconds,
+# in case the worker sending it died
+LEASE_TIME = 60
+# how many deliveries to take from each host's queue at a time
+BATCH_SIZE = 50
+# how many batches to send in one task before leaving the rest for another task
+MAX_ROUNDS = 10
+# the longest a batch can take to send, in seconds, after which the deliveries
+# that are still going are tried again later. It's shorter than the lease, so
+# nothing is claimed again while it's being sent
+ROUND_TIMEOUT = LEASE_TIME - 15
+# how long one task can hold a host's queue, in seconds. That's long enough for
+# all of its rounds, with time to spare for preparing and recording them
+LOCK_TIMEOUT = 2 * MAX_ROUNDS * ROUND_TIMEOUT
+# how long an activity can wait to be delivered, in seconds
+ACTIVITY_EXPIRY = 3 * 24 * 60 * 60
+
+# consecutive failed deliveries after which a host is skipped for a while
+CIRCUIT_FAILURES = 5
+# how long a failing host is skipped for, in seconds, doubled each time it
+# fails again, up to the maximum
+CIRCUIT_COOLDOWN = 5 * 60
+MAX_CIRCUIT_COOLDOWN = 6 * 60 * 60
+
+# how long to wait to connect to an inbox, or for it to respond, in seconds
+SEND_TIMEOUT = 10
+
+# how many threads each worker signs requests in
+SIGNING_THREADS = 4
+
+# error responses which might succeed if they're tried again later
+RETRY_STATUSES = [408, 425, 429]
+
+Delivery = namedtuple(
+    "Delivery", ("host", "item", "signer", "activity", "digest", "inbox")
+)
+
+SENT = "sent"
+RETRY = "retry"
+FAILED = "failed"
+
+
+def queue_id(host):
+    """the redis key for the deliveries waiting for a host, scored by when
+    they should next be tried"""
+    return f"delivery-{host}"
+
+
+def circuit_id(host):
+    """the redis key for how a host's deliveries have been failing"""
+    return f"delivery-{host}-circuit"
+
+
+def lock_id(host):
+    """the redis key for the task sending to a host"""
+    return f"delivery-{host}-lock"
+
+
+def scheduled_id(host):
+    """the redis key for a task that has been queued to send to a host"""
+    return f"delivery-{host}-scheduled"
+
+
+def pending_id(activity_id):
+    """the redis key for how many deliveries of an activity are still queued"""
+    return f"{activity_id}-pending"
+
+
+def get_host(inbox):
+    """deliveries are grouped by the host they're going to"""
+    return urlparse(inbox).netloc
+
+
+def enqueue(sender_id, activity, recipients):
+    """store an activity and queue a delivery for each inbox, returns the hosts
+    that have new deliveries"""
+    activity_id = f"delivery-activity-{uuid4()}"
+    now = time.time()
+
+    inboxes = {inbox for inbox in recipients if inbox}
+    if not inboxes:
+        return []
+
+    pipeline = r.pipeline()
+    pipeline.set(activity_id, activity, ex=ACTIVITY_EXPIRY)
+    pipeline.set(pending_id(activity_id), len(inboxes), ex=ACTIVITY_EXPIRY)
+    hosts = set()
+    for inbox in inboxes:
+        host = get_host(inbox)
+        item = {"sender": sender_id, "activity": activity_id, "inbox": inbox}
+        pipeline.zadd(queue_id(host), {json.dumps(item): now})
+        pipeline.sadd(HOSTS_KEY, host)
+        hosts.add(host)
+        flush_pipeline(pipeline)
+    pipeline.execute()
+    return sorted(hosts)
+
+
+def get_circuit(host):
+    """when a failing host can be tried again, and whether it's been failing"""
+    circuit = r.hgetall(circuit_id(host))
+    return float(circuit.get(b"open_until", 0)), bool(circuit.get(b"opens"))
+
+
+def claim(host, now, size):
+    """take the deliveries that are due for a host, and hold on to them for long
+    enough to send them"""
+    key = queue_id(host)
+    items = r.zrangebyscore(key, "-inf", now, start=0, num=size)
+    if items:
+        r.zadd(key, {item: now + LEASE_TIME for item in items}, xx=True)
+    return items
+
+
+def record_results(host, results, now):
+    """remove sent deliveries from the queue, schedule retries, and keep track of
+    whether the host is failing"""
+    key = queue_id(host)
+    pipeline = r.pipeline()
+    sent = False
+    failures = 0
+    finished = Counter()
+    for (item, outcome) in results:
+        pipeline.zrem(key, item)
+        delivery = json.loads(item)
+        if outcome == SENT:
+            sent = True
+            finished[delivery["activity"]] += 1
+            continue
+        if outcome == FAILED:
+            logger.warning("Failed to deliver to %s, giving up", delivery["inbox"])
+            finished[delivery["activity"]] += 1
+            continue
+
+        failures += 1
+        attempts = delivery.get("attempts", 0) + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.warning(
+                "Unable to deliver to %s after %d attempts", delivery["inbox"], attempts
+            )
+            finished[delivery["activity"]] += 1
+            continue
+        delivery["attempts"] = attempts
+        retry_at = now + RETRY_DELAY * 2 ** (attempts - 1)
+        pipeline.zadd(key, {json.dumps(delivery): retry_at})
+
+    start = len(pipeline)
+    count_finished(pipeline, finished)
+
+    if sent:
+        # the host is working
+        pipeline.delete(circuit_id(host))
+    elif failures:
+        pipeline.hincrby(circuit_id(host), "failures", failures)
+    results = pipeline.execute()
+    delete_finished(finished, results[start : start + len(finished)])
+
+    if not sent and failures and results[-1] >= CIRCUIT_FAILURES:
+        open_circuit(host, now)
+
+
+def count_finished(pipeline, finished):
+    """count off the deliveries that are done, so that each activity can be deleted
+    once it's been sent everywhere it's going"""
+    for (activity_id, count) in finished.items():
+        pipeline.decrby(pending_id(activity_id), count)
+
+
+def delete_finished(finished, remaining):
+    """delete the activities that have no deliveries left, given how many each
+    one had left after the finished ones were counted off"""
+    # only one worker sees the count reach zero
+    done = [
+        activity_id for (activity_id, count) in zip(finished, remaining) if count <= 0
+    ]
+    if done:
+        r.delete(*done, *[pending_id(activity_id) for activity_id in done])
+
+
+def open_circuit(host, now):
+    """stop sending to a host that keeps failing, for a while"""
+    opens = r.hincrby(circuit_id(host), "opens", 1)
+    cooldown = min(CIRCUIT_COOLDOWN * 2 ** (opens - 1), MAX_CIRCUIT_COOLDOWN)
+    logger.warning("Deliveries to %s are failing, waiting %ds", host, cooldown)
+    pipeline = r.pipeline()
+    pipeline.hset(circuit_id(host), "open_until", now + cooldown)
+    pipeline.hset(circuit_id(host), "failures", 0)
+    pipeline.expire(circuit_id(host), ACTIVITY_EXPIRY)
+    pipeline.execute()
+
+
+def prepare(batches):
+    """load the senders and activities for claimed deliveries, and drop any whose
+    activity has expired"""
+    deliveries = [
+        (host, item, json.loads(item))
+        for (host, items) in batches.items()
+        for item in items
+    ]
+    activity_ids = list({delivery["activity"] for (_, _, delivery) in deliveries})
+    activities = {}
+    if activity_ids:
+        activities = {
+            activity_id: value.decode("utf-8")
+            for (activity_id, value) in zip(activity_ids, r.mget(activity_ids))
+            if value
+        }
+    # every inbox gets the same activity, so it only needs to be hashed once
+    digests = {key: make_digest(value) for (key, value) in activities.items()}
+
+    user_model = apps.get_model("bookwyrm.User", require_ready=True)
+    senders = user_model.objects.select_related("key_pair").in_bulk(
+        {delivery["sender"] for (_, _, delivery) in deliveries}
+    )
+    # and each sender's private key only needs to be parsed once
+    signers = {
+        sender_id: Signer(sender)
+        for (sender_id, sender) in senders.items()
+        if sender.key_pair and sender.key_pair.private_key
+    }
+
+    ready = []
+    expired = []
+    for (host, item, delivery) in deliveries:
+        activity_id = delivery["activity"]
+        signer = signers.get(delivery["sender"])
+        if activity_id not in activities or not signer:
+            expired.append((host, item))
+            continue
+        ready.append(
+            Delivery(
+                host,
+                item,
+                signer,
+                activities[activity_id],
+                digests[activity_id],
+                delivery["inbox"],
+            )
+        )
+    return ready, expired
+
+
+class DeliveryWorker:
+    """sends deliveries over a pooled session, signing them in other threads"""
+
+    def __init__(self):
+        # requests wait for a connection to their host before they start, so
+        # only time connecting and waiting for a response, not the whole request
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=SEND_TIMEOUT, sock_read=SEND_TIMEOUT
+        )
+        self.pool = PooledSession(settings.DELIVERY_HOST_CONCURRENCY, timeout=timeout)
+        self.executor = ThreadPoolExecutor(max_workers=SIGNING_THREADS)
+
+    def send_all(self, deliveries):
+        """send deliveries, returns the outcome of each one"""
+        return self.pool.run(self.async_send_all(deliveries))
+
+    async def async_send_all(self, deliveries):
+        """send everything at once, the connector limits it per host. Deliveries
+        that are still going after the round's time is up are tried again later"""
+        if not deliveries:
+            return []
+        session = await self.pool.get_session()
+        sends = [
+            asyncio.ensure_future(self.send(session, delivery))
+            for delivery in deliveries
+        ]
+        (_, pending) = await asyncio.wait(sends, timeout=ROUND_TIMEOUT)
+        for send in pending:
+            send.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return [RETRY if send.cancelled() else send.result() for send in sends]
+
+    async def send(self, session, delivery):
+        """sign an activity and post it to an inbox"""
+        destination = delivery.inbox
+        try:
+            now = http_date()
+            # signing is slow, so it happens in another thread while this one
+            # gets on with sending
+            signature = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                delivery.signer.sign,
+                "post",
+                destination,
+                now,
+                delivery.digest,
+            )
+            headers = {
+                "Date": now,
+                "Digest": delivery.digest,
+                "Signature": signature,
+                "Content-Type": "application/activity+json; charset=utf-8",
+                "User-Agent": settings.USER_AGENT,
+            }
+            async with session.post(
+                destination, data=delivery.activity, headers=headers
+            ) as response:
+                if response.ok:
+                    return SENT
+                logger.info(
+                    "Failed to send broadcast to %s: %s", destination, response.reason
+                )
+                if response.status >= 500 or response.status in RETRY_STATUSES:
+                    return RETRY
+                return FAILED
+        except asyncio.TimeoutError:
+            logger.info("Connection timed out for url: %s", destination)
+        except aiohttp.ClientError as err:
+            logger.info("Unable to connect to %s: %s", destination, err)
+        return RETRY
+
+
+@lru_cache(maxsize=None)
+def get_worker():
+    """the process's delivery worker, which is only created in processes that
+    send deliveries, not every one that queues them"""
+    return DeliveryWorker()
+
+
+def deliver(hosts, reschedule=True):
+    """send the queued deliveries for these hosts. Anything that's left, or needs
+    to be retried, is sent by another task later"""
+    locked = [
+        host for host in hosts if r.set(lock_id(host), 1, nx=True, ex=LOCK_TIMEOUT)
+    ]
+    active = set(locked)
+    try:
+        for _ in range(MAX_ROUNDS):
+            now = time.time()
+            batches = {}
+            for host in sorted(active):
+                (open_until, failing) = get_circuit(host)
+                if open_until > now:
+                    active.discard(host)
+                    continue
+                # only try one delivery to a host that was failing
+                items = claim(host, now, 1 if failing else BATCH_SIZE)
+                if not items:
+                    active.discard(host)
+                    continue
+                batches[host] = items
+            if not batches:
+                break
+
+            send_batches(batches)
+    finally:
+        for host in locked:
+            r.delete(lock_id(host))
+            if reschedule:
+                schedule(host)
+
+
+def send_batches(batches):
+    """send claimed deliveries and record how they went"""
+    (deliveries, expired) = prepare(batches)
+    outcomes = get_worker().send_all(deliveries)
+    results = {host: [] for host in batches}
+    for ((host, item, *_), outcome) in zip(deliveries, outcomes):
+        results[host].append((item, outcome))
+    for (host, item) in expired:
+        results[host].append((item, FAILED))
+    for (host, host_results) in results.items():
+        record_results(host, host_results, time.time())
+
+
+def schedule(host):
+    """queue a task for when a host's next delivery is due"""
+    next_delivery = get_next_delivery(host)
+    if not next_delivery:
+        return
+    (open_until, _) = get_circuit(host)
+    countdown = max(next_delivery[0][1], open_until) - time.time()
+    countdown = max(int(countdown), 0)
+    # there only needs to be one task waiting for each host
+    if r.set(scheduled_id(host), 1, nx=True, ex=countdown + 1):
+        deliver_task.apply_async(args=([host],), countdown=countdown)
+
+
+def get_next_delivery(host):
+    """the first delivery in a host's queue. A host with nothing waiting is
+    forgotten, unless something is queued for it while it's being checked"""
+    with r.pipeline() as pipeline:
+        while True:
+            try:
+                pipeline.watch(queue_id(host))
+                next_delivery = pipeline.zrange(queue_id(host), 0, 0, withscores=True)
+                if next_delivery:
+                    return next_delivery
+                pipeline.multi()
+                pipeline.srem(HOSTS_KEY, host)
+                pipeline.execute()
+                return None
+            except redis.WatchError:
+                # a delivery was queued, so check again
+                continue
+
+
+@app.task(queue=DELIVERY)
+def deliver_task(hosts):
+    """send the deliveries that are waiting for some hosts"""
+    for host in hosts:
+        r.delete(scheduled_id(host))
+    deliver(hosts)
+
+
+@app.task(queue=DELIVERY)
+def deliver_all_task():
+    """send anything that's waiting for any host, like deliveries that were in
+    progress when a worker stopped"""
+    deliver([host.decode("utf-8") for host in r.smembers(HOSTS_KEY)])
@@ -0,0 +1,154 @@
+""" Measure how quickly queued activities are delivered to other servers """
+import asyncio
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+from django.core.management.base import BaseCommand, CommandError
+from bookwyrm import delivery, models
+from bookwyrm.redis_store import r
+
+
+class FakeInboxes:
+    """local servers that accept activities like a slow, unreliable inbox"""
+
+    def __init__(self, hosts, latency, failure_rate):
+        self.hosts = hosts
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = 0
+        self.ports = []
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.thread = None
+
+    async def inbox(self, request):
+        """accept an activity after a while, or fail"""
+        await request.read()
+        self.received += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return web.Response(status=503)
+        return web.Response(status=202)
+
+    async def start_servers(self):
+        """listen on a port for each host"""
+        app = web.Application()
+        app.router.add_post("/inbox", self.inbox)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        for _ in range(self.hosts):
+            site = web.TCPSite(self.runner, "127.0.0.1", 0)
+            await site.start()
+            # pylint: disable=protected-access
+            self.ports.append(site._server.sockets[0].getsockname()[1])
+
+    def start(self):
+        """run the servers in a thread"""
+        self.loop.run_until_complete(self.start_servers())
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """shut the servers down"""
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def inboxes(self):
+        """the inbox urls, one for each host"""
+        return [f"http://127.0.0.1:{port}/inbox" for port in self.ports]
+
+
+def clear_queues(hosts):
+    """remove anything the benchmark left behind"""
+    pipeline = r.pipeline()
+    for host in hosts:
+        pipeline.delete(delivery.queue_id(host), delivery.circuit_id(host))
+        pipeline.srem(delivery.HOSTS_KEY, host)
+    pipeline.execute()
+
+
+def benchmark_delivery(hosts=10, deliveries=1000, latency=0.05, failure_rate=0):
+    """deliver to local fake inboxes and report how fast it went"""
+    sender = (
+        models.User.objects.filter(local=True, is_active=True)
+        .exclude(key_pair__private_key=None)
+        .first()
+    )
+    if not sender:
+        raise CommandError("There needs to be a local user to send activities")
+
+    servers = FakeInboxes(hosts, latency, failure_rate)
+    servers.start()
+    inboxes = servers.inboxes()
+    activity = json.dumps({"type": "Benchmark", "actor": sender.remote_id})
+    try:
+        start = time.perf_counter()
+        queued = set()
+        for i in range(0, deliveries, hosts):
+            # each broadcast goes to one inbox on every host
+            recipients = [f"{inbox}?{i}" for inbox in inboxes][: deliveries - i]
+            queued.update(delivery.enqueue(sender.id, activity, recipients))
+        queue_time = time.perf_counter() - start
+        queued = sorted(queued)
+
+        start = time.perf_counter()
+        while any(
+            r.zcount(delivery.queue_id(host), "-inf", time.time()) for host in queued
+        ):
+            delivery.deliver(queued, reschedule=False)
+        send_time = time.perf_counter() - start
+        waiting = sum(r.zcard(delivery.queue_id(host)) for host in queued)
+    finally:
+        servers.stop()
+        clear_queues([delivery.get_host(inbox) for inbox in inboxes])
+
+    print(f"Queued {deliveries} deliveries in {queue_time:.2f}s")
+    print(
+        f"Sent {servers.received} requests to {hosts} hosts in {send_time:.2f}s "
+        f"({servers.received / send_time:.1f} deliveries/s)"
+    )
+    if waiting:
+        print(f"{waiting} deliveries failed and were waiting to be retried")
+
+
+class Command(BaseCommand):
+    """time the delivery queue against local inboxes"""
+
+    help = "Measure deliveries per second to local fake inboxes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hosts", type=int, default=10, help="How many fake servers to start"
+        )
+        parser.add_argument(
+            "--deliveries",
+            type=int,
+            default=1000,
+            help="How many deliveries to queue in total",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="How long each inbox takes to respond, in seconds",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0,
+            help="The fraction of deliveries that the inboxes reject with an error",
+        )
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        benchmark_delivery(
+            hosts=options["hosts"],
+            deliveries=options["deliveries"],
+            latency=options["latency"],
+            failure_rate=options["failure_rate"],
+        )
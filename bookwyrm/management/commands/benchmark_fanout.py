@@ -0,0 +1,152 @@
+""" Compare status fan-out with database and redis set audience resolution """
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bookwyrm import activitystreams, models, settings
+from bookwyrm.redis_store import r, flush_pipeline
+
+
+def create_followers(author, count):
+    """a lot of local users who all follow the author"""
+    prefix = f"fanout{author.id}"
+    users = models.User.objects.bulk_create(
+        models.User(
+            username=f"{prefix}-{i}",
+            localname=f"{prefix}-{i}",
+            inbox=f"https://{prefix}.example/{i}/inbox",
+            local=True,
+        )
+        for i in range(count)
+    )
+    models.UserFollows.objects.bulk_create(
+        models.UserFollows(user_subject=user, user_object=author) for user in users
+    )
+    return [user.id for user in users]
+
+
+def time_call(func, reset=None, runs=5):
+    """best of a few runs, in milliseconds, resetting before each one"""
+    results = []
+    for _ in range(runs):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        func()
+        results.append((time.perf_counter() - start) * 1000)
+    return min(results)
+
+
+def fan_out(stream, status, audience_ids):
+    """add a status to the streams of its audience, and count it as unread, the
+    way add_status and its chunk tasks do, but all in this process"""
+    audience = sorted(audience_ids)
+    for (chunk, i) in enumerate(range(0, len(audience), settings.FANOUT_CHUNK_SIZE)):
+        stream.add_status_to_users(
+            status,
+            audience[i : i + settings.FANOUT_CHUNK_SIZE],
+            increment_unread=True,
+            chunk=chunk,
+        )
+
+
+def clear_streams(stream, status, user_ids):
+    """remove everything the fan-out wrote"""
+    pipeline = r.pipeline()
+    pipeline.delete(stream.fanout_id(status), stream.index_id(status.id))
+    for user_id in user_ids:
+        pipeline.delete(
+            *stream.get_keys(stream.stream_id(user_id), stream.get_substore_names()),
+            stream.unread_id(user_id),
+            stream.unread_by_status_type_id(user_id),
+        )
+        flush_pipeline(pipeline)
+    pipeline.execute()
+
+
+def time_fan_out(stream, status, user_ids, runs):
+    """the whole fan-out, finding the audience in the database and in the redis
+    sets"""
+    reset = lambda: clear_streams(stream, status, user_ids)
+    database = time_call(
+        lambda: fan_out(
+            stream, status, stream.get_audience(status).values_list("id", flat=True)
+        ),
+        reset=reset,
+        runs=runs,
+    )
+    redis_sets = time_call(
+        lambda: fan_out(stream, status, stream.get_audience_ids_from_sets(status)),
+        reset=reset,
+        runs=runs,
+    )
+    reset()
+    return database, redis_sets
+
+
+def add_to_sets(sets, author_id, user_ids):
+    """put the test users in the audience sets, a pipeline at a time"""
+    pipeline = r.pipeline()
+    for user_id in user_ids:
+        pipeline.sadd(sets.local_users_key, user_id)
+        pipeline.sadd(sets.followers_id(author_id), user_id)
+        flush_pipeline(pipeline)
+    pipeline.execute()
+
+
+def remove_from_sets(sets, author_id, user_ids):
+    """take the test users back out of the audience sets"""
+    for i in range(0, len(user_ids), settings.REDIS_PIPELINE_SIZE):
+        r.srem(sets.local_users_key, *user_ids[i : i + settings.REDIS_PIPELINE_SIZE])
+    r.delete(sets.followers_id(author_id))
+
+
+def benchmark_fanout(sizes, runs=5):
+    """time home stream fan-out for a followers-only status"""
+    stream = activitystreams.HomeStream()
+    sets = activitystreams.audience_sets
+    results = []
+    for size in sizes:
+        with transaction.atomic():
+            author = models.User.objects.create(
+                username=f"fanout-author-{size}",
+                localname=f"fanout-author-{size}",
+                inbox=f"https://fanout.example/{size}/inbox",
+                local=True,
+            )
+            user_ids = create_followers(author, size) + [author.id]
+            status = models.Status(user=author, content="hi", privacy="followers")
+            status.save(broadcast=False)
+
+            add_to_sets(sets, author.id, user_ids)
+            try:
+                database, redis_sets = time_fan_out(stream, status, user_ids, runs)
+            finally:
+                remove_from_sets(sets, author.id, user_ids)
+                transaction.set_rollback(True)
+        results.append((size, database, redis_sets))
+    return results
+
+
+class Command(BaseCommand):
+    """time status fan-out"""
+
+    help = "Benchmark status fan-out to followers' streams (not for production)"
+
+    # pylint: disable=no-self-use
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Comma-separated follower counts to test",
+        )
+        parser.add_argument("--runs", type=int, default=5)
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        self.stdout.write(f"{'followers':>10} {'database ms':>12} {'sets ms':>10}")
+        for (size, database, redis_sets) in benchmark_fanout(sizes, options["runs"]):
+            self.stdout.write(f"{size:>10} {database:>12.1f} {redis_sets:>10.1f}")
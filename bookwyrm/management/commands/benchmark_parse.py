@@ -0,0 +1,97 @@
+""" Measure how quickly incoming activities are parsed """
+import json
+import pathlib
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from bookwyrm import activitypub
+from bookwyrm.activitypub.base_activity import (
+    get_field_info,
+    get_model_from_type,
+    model_registry,
+)
+
+DEFAULT_CORPUS = pathlib.Path(__file__).parent.joinpath(
+    "../../tests/data/ap_activities.json"
+)
+
+
+def scan_models(activity_type):
+    """look up a model by searching through all of them, for comparison"""
+    return [
+        m
+        for m in apps.get_models()
+        if getattr(getattr(m, "activity_serializer", None), "type", None)
+        == activity_type
+    ][0]
+
+
+def time_rounds(function, items, rounds):
+    """calls per second of a function over all the items"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for item in items:
+            function(item)
+    return rounds * len(items) / (time.perf_counter() - start)
+
+
+def uncached_parse(activity_json):
+    """parse without the remembered field information, for comparison"""
+    get_field_info.cache_clear()
+    return activitypub.parse(activity_json)
+
+
+def benchmark_parse(corpus=DEFAULT_CORPUS, rounds=1000):
+    """parse the corpus repeatedly and look up the model for each object type"""
+    with open(corpus, "r", encoding="utf-8") as corpus_file:
+        activities = json.load(corpus_file)
+    print(f"Parsing {len(activities)} activities {rounds} times")
+
+    # activitypub.parse changes the json it's given, so each parse gets a copy
+    copies = [json.dumps(activity) for activity in activities]
+    parse_rate = time_rounds(
+        lambda data: activitypub.parse(json.loads(data)), copies, rounds
+    )
+    uncached_rate = time_rounds(
+        lambda data: uncached_parse(json.loads(data)), copies, rounds
+    )
+    print(f"Parse: {parse_rate:,.0f}/s ({uncached_rate:,.0f}/s re-reading fields)")
+
+    types = [
+        activity["object"]["type"]
+        for activity in activities
+        if isinstance(activity.get("object"), dict)
+    ]
+    # only the types that are stored as models
+    types = [t for t in types if t in model_registry]
+    registry_rate = time_rounds(get_model_from_type, types, rounds)
+    scan_rate = time_rounds(scan_models, types, rounds)
+    print(
+        f"Model lookup: {registry_rate:,.0f}/s "
+        f"({scan_rate:,.0f}/s searching all models)"
+    )
+
+
+class Command(BaseCommand):
+    """time activity parsing"""
+
+    help = "Measure parse throughput on a corpus of recorded activities"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--corpus",
+            default=DEFAULT_CORPUS,
+            help="A json file with a list of activities",
+        )
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=1000,
+            help="How many times to parse the corpus",
+        )
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        benchmark_parse(corpus=options["corpus"], rounds=options["rounds"])
@@ -0,0 +1,207 @@
+""" Measure local title/author search over a large generated catalogue """
+import statistics
+import time
+
+from django.contrib.postgres.search import SearchRank, SearchQuery
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from bookwyrm import book_search, models
+
+# the remote id of the generated books, so they can be told apart from real ones
+FIXTURE_ID = "https://benchmark.invalid"
+WORDS = [
+    "dune",
+    "harry",
+    "potter",
+    "name",
+    "wind",
+    "lord",
+    "rings",
+    "earthsea",
+    "wizard",
+    "dispossessed",
+    "left",
+    "hand",
+    "darkness",
+    "piranesi",
+    "fifth",
+    "season",
+    "obelisk",
+    "stone",
+    "sky",
+    "kindred",
+    "parable",
+    "sower",
+    "neuromancer",
+    "foundation",
+    "empire",
+]
+DEFAULT_QUERIES = ["dune", "harry potter", "left hand darkness", "stone sky"]
+
+# a title made from two of the words, the same for every edition of a work
+TITLE_SQL = (
+    "words[1 + (work_number %% {count})] || ' ' || "
+    "words[1 + ((work_number / {count}) %% {count})] || ' ' || work_number"
+).format(count=len(WORDS))
+
+
+def create_fixture(editions, editions_per_work):
+    """add works and editions with raw sql, which is much faster than saving
+    each model"""
+    works = max(editions // editions_per_work, 1)
+    with connection.cursor() as cursor:
+        # the work number is kept in series_number so editions can find their work
+        cursor.execute(
+            f"""
+            WITH generated AS (
+                SELECT n AS work_number, %(words)s::text[] AS words
+                FROM generate_series(0, %(works)s - 1) AS n
+            ), new_books AS (
+                INSERT INTO bookwyrm_book (
+                    created_date, updated_date, remote_id, title, series_number,
+                    languages
+                )
+                SELECT now(), now(), %(fixture_id)s, {TITLE_SQL},
+                    work_number::text, '{{}}'
+                FROM generated
+                RETURNING id
+            )
+            INSERT INTO bookwyrm_work (book_ptr_id) SELECT id FROM new_books;
+            """,
+            {"words": WORDS, "works": works, "fixture_id": f"{FIXTURE_ID}/work"},
+        )
+        cursor.execute(
+            f"""
+            WITH generated AS (
+                SELECT n / %(per_work)s AS work_number, %(words)s::text[] AS words
+                FROM generate_series(0, %(editions)s - 1) AS n
+            ), new_books AS (
+                INSERT INTO bookwyrm_book (
+                    created_date, updated_date, remote_id, title, series_number,
+                    languages
+                )
+                SELECT now(), now(), %(fixture_id)s, {TITLE_SQL},
+                    work_number::text, '{{}}'
+                FROM generated
+                RETURNING id, series_number
+            )
+            INSERT INTO bookwyrm_edition (
+                book_ptr_id, parent_work_id, edition_rank, publishers
+            )
+            SELECT new_books.id, works.id, new_books.id %% %(per_work)s, '{{}}'
+            FROM new_books
+            JOIN bookwyrm_book works
+            ON works.series_number = new_books.series_number
+            AND works.remote_id = %(work_id)s;
+            """,
+            {
+                "words": WORDS,
+                "editions": editions,
+                "per_work": editions_per_work,
+                "fixture_id": f"{FIXTURE_ID}/edition",
+                "work_id": f"{FIXTURE_ID}/work",
+            },
+        )
+    # the inserted books are queued to have their search vectors set
+    book_search.update_search_vectors()
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE bookwyrm_book; ANALYZE bookwyrm_edition;")
+
+
+def search_each_work(query, min_confidence=0):
+    """the previous search, with a query for each work, for comparison"""
+    query = SearchQuery(query, config="simple") | SearchQuery(query, config="english")
+    results = (
+        models.Edition.objects.filter(search_vector=query)
+        .annotate(rank=SearchRank(F("search_vector"), query))
+        .filter(rank__gt=min_confidence)
+        .order_by("-rank")
+    )
+    editions_of_work = results.values_list("parent_work__id", flat=True).distinct()
+    return [
+        results.filter(parent_work=work_id).order_by("-rank", "-edition_rank").first()
+        for work_id in set(editions_of_work[:30])
+    ]
+
+
+def time_search(function, query, rounds):
+    """the median time for a search in milliseconds, and how many sql queries it
+    made"""
+    timings = []
+    for _ in range(rounds):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            function(query)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), len(queries)
+
+
+def benchmark_search(
+    editions=1000000, editions_per_work=5, queries=None, rounds=5, keep=False
+):
+    """generate a catalogue and compare the two ways of searching it"""
+    queries = queries or DEFAULT_QUERIES
+    with transaction.atomic():
+        start = time.perf_counter()
+        create_fixture(editions, editions_per_work)
+        print(f"Created {editions:,} editions in {time.perf_counter() - start:.1f}s")
+
+        for query in queries:
+            (single, single_queries) = time_search(
+                lambda q: book_search.search_title_author(q, 0), query, rounds
+            )
+            (each, each_queries) = time_search(search_each_work, query, rounds)
+            print(
+                f'"{query}": {single:.1f}ms ({single_queries} sql queries), '
+                f"previously {each:.1f}ms ({each_queries} sql queries)"
+            )
+
+        if not keep:
+            transaction.set_rollback(True)
+
+
+class Command(BaseCommand):
+    """time local book search"""
+
+    help = "Measure local book search over a generated catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--editions",
+            type=int,
+            default=1000000,
+            help="How many editions to generate",
+        )
+        parser.add_argument(
+            "--editions-per-work",
+            type=int,
+            default=5,
+            help="How many editions each generated work has",
+        )
+        parser.add_argument(
+            "--query",
+            action="append",
+            dest="queries",
+            help="A search to time, can be given more than once",
+        )
+        parser.add_argument(
+            "--rounds", type=int, default=5, help="How many times to run each search"
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the generated books instead of removing them afterwards",
+        )
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        benchmark_search(
+            editions=options["editions"],
+            editions_per_work=options["editions_per_work"],
+            queries=options["queries"],
+            rounds=options["rounds"],
+            keep=options["keep"],
+        )
@@ -0,0 +1,104 @@
+""" Measure how much redis memory activity streams use per user """
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from bookwyrm import activitystreams
+from bookwyrm.management.commands.migrate_stream_layout import get_layout
+from bookwyrm.redis_store import r, flush_pipeline
+
+# far above any real user id, so the benchmark doesn't touch real streams
+FIRST_USER_ID = 10**12
+STATUS_TYPES = ["note", "review", "comment", "quotation"]
+
+
+def fill_user(pipeline, user_id, compact):
+    """full streams and some unread statuses for a made up user,
+    returns the keys that were written"""
+    keys = set()
+    now = time.time()
+    filter_types = activitystreams.get_feed_filter_choices() + [
+        activitystreams.UNFILTERED_TYPE
+    ]
+    for stream in activitystreams.streams.values():
+        stream = get_layout(stream, compact)
+        for i in range(stream.max_length):
+            value = {random.randint(1, 10**7): now - i * 60}
+            pipeline.zadd(stream.stream_id(user_id), value)
+            keys.add(stream.stream_id(user_id))
+            filter_type = random.choice(filter_types)
+            # statuses that the feed filters don't apply to have no substream
+            if filter_type != activitystreams.UNFILTERED_TYPE:
+                substream = stream.substream_id(user_id, filter_type)
+                pipeline.zadd(substream, value)
+                keys.add(substream)
+
+        if stream.compact:
+            pipeline.hset(stream.unread_id(user_id), stream.unread_field(), 12)
+        else:
+            pipeline.set(stream.unread_id(user_id), 12)
+        for status_type in STATUS_TYPES:
+            pipeline.hset(
+                stream.unread_by_status_type_id(user_id),
+                stream.unread_by_status_type_field(status_type),
+                3,
+            )
+        keys.update(
+            {stream.unread_id(user_id), stream.unread_by_status_type_id(user_id)}
+        )
+        flush_pipeline(pipeline)
+    return keys
+
+
+def measure_layout(users, compact):
+    """bytes and keys used per user with one layout"""
+    before = r.info("memory")["used_memory"]
+    pipeline = r.pipeline()
+    keys = set()
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        keys.update(fill_user(pipeline, user_id, compact))
+    pipeline.execute()
+    used = r.info("memory")["used_memory"] - before
+
+    stream = get_layout(activitystreams.streams["home"], compact)
+    encoding = r.object("encoding", stream.stream_id(FIRST_USER_ID)).decode("utf-8")
+
+    for key in keys:
+        pipeline.delete(key)
+        flush_pipeline(pipeline)
+    pipeline.execute()
+    return used / users, len(keys) / users, encoding
+
+
+def benchmark_stream_memory(users=1000):
+    """compare the default and compact layouts"""
+    results = {}
+    for compact in [False, True]:
+        results[compact] = measure_layout(users, compact)
+        name = "compact" if compact else "default"
+        (bytes_per_user, keys_per_user, encoding) = results[compact]
+        print(
+            f"{name:>8}: {bytes_per_user:,.0f} bytes per user, "
+            f"{keys_per_user:.0f} keys per user, streams encoded as {encoding}"
+        )
+    saving = 1 - results[True][0] / results[False][0]
+    print(f"The compact layout uses {saving:.0%} less memory per user")
+
+
+class Command(BaseCommand):
+    """report redis memory per user for each stream layout"""
+
+    help = "Measure redis memory per user for the default and compact stream layouts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=1000,
+            help="How many made up users to fill streams for",
+        )
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        benchmark_stream_memory(users=options["users"])
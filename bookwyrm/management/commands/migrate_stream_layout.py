@@ -0,0 +1,69 @@
+""" Move unread counts and streams to the configured redis layout """
+import copy
+
+from django.core.management.base import BaseCommand
+from bookwyrm import activitystreams, models, settings
+from bookwyrm.redis_store import r
+
+
+def get_layout(stream, compact):
+    """a copy of a stream that uses the given layout"""
+    stream = copy.copy(stream)
+    stream.compact = compact
+    return stream
+
+
+def migrate_user(user_id, compact):
+    """copy a user's unread counts into the new layout and remove the old ones"""
+    pipeline = r.pipeline()
+    old_keys = set()
+    for stream in activitystreams.streams.values():
+        old = get_layout(stream, not compact)
+        new = get_layout(stream, compact)
+
+        count = old.get_unread_count(user_id)
+        counts_by_type = old.get_unread_count_by_status_type(user_id)
+        if count:
+            if new.unread_field():
+                pipeline.hset(new.unread_id(user_id), new.unread_field(), count)
+            else:
+                pipeline.set(new.unread_id(user_id), count)
+        for (status_type, type_count) in counts_by_type.items():
+            pipeline.hset(
+                new.unread_by_status_type_id(user_id),
+                new.unread_by_status_type_field(status_type),
+                type_count,
+            )
+        old_keys.update({old.unread_id(user_id), old.unread_by_status_type_id(user_id)})
+
+        if new.max_length:
+            stream_id = new.stream_id(user_id)
+            for key in new.get_keys(stream_id, new.get_substore_names()):
+                pipeline.zremrangebyrank(key, 0, -1 * new.max_length)
+    pipeline.delete(*old_keys)
+    pipeline.execute()
+
+
+def migrate_stream_layout(compact=None):
+    """move every user's unread counts and streams into the configured layout"""
+    compact = settings.REDIS_COMPACT_STREAMS if compact is None else compact
+    print("Migrating to the", "compact" if compact else "default", "layout")
+    users = models.User.objects.filter(local=True, is_active=True)
+    for (count, user_id) in enumerate(
+        users.values_list("id", flat=True).iterator(), start=1
+    ):
+        migrate_user(user_id, compact)
+        if not count % 1000:
+            print(f"{count} users migrated")
+    print("Done")
+
+
+class Command(BaseCommand):
+    """switch the redis layout for activity streams"""
+
+    help = "Move unread counts and streams to the layout set by REDIS_COMPACT_STREAMS"
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the migration"""
+        migrate_stream_layout()
@@ -0,0 +1,46 @@
+""" Fill in the identifier lookup table for existing books and authors """
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from bookwyrm import models
+from bookwyrm.models.identifier import rebuild_identifiers
+
+
+def populate_identifiers(batch_size=1000):
+    """rebuild the identifiers of every book and author, a batch at a time"""
+    for model in [models.Edition, models.Work, models.Author]:
+        total = model.objects.count()
+        print(f"Populating identifiers for {total} {model.__name__} objects")
+        done = 0
+        last_id = 0
+        while True:
+            batch = list(
+                model.objects.filter(id__gt=last_id).order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                rebuild_identifiers(batch)
+            last_id = batch[-1].id
+            done += len(batch)
+            print(f"{done}/{total}", end="\r")
+        print(f"{done}/{total}")
+    print("All done, thank you for your patience!")
+
+
+class Command(BaseCommand):
+    """fill in the identifier table"""
+
+    help = "Populate the identifier lookup table for all books and authors"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="How many books or authors to update at a time",
+        )
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the backfill"""
+        populate_identifiers(batch_size=options["batch_size"])
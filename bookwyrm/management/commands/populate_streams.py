@@ -1,6 +1,12 @@
 """ Re-create user streams """
+from collections import Counter
+from datetime import datetime
+import time
+
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from bookwyrm import activitystreams, lists_stream, models
+from bookwyrm.redis_store import r, flush_pipeline
 
 
 def populate_streams(stream=None):
@@ -12,6 +18,7 @@ def populate_streams(stream=None):
         is_active=True,
     ).order_by("-last_active_date")
     print("This may take a long time! Please be patient.")
+    activitystreams.populate_audience_sets_task.delay()
     for user in users:
         print(".", end="")
         lists_stream.populate_lists_task.delay(user.id)
@@ -20,6 +27,150 @@ def populate_streams(stream=None):
             activitystreams.populate_stream_task.delay(stream_key, user.id)
 
 
+def checkpoint_id(streams):
+    """the redis key for the progress of a bulk rebuild of these streams"""
+    return f"populate-streams-{'-'.join(sorted(streams))}-checkpoint"
+
+
+def get_checkpoint(key):
+    """the published date and id of the last status that was written"""
+    value = r.get(key)
+    if not value:
+        return None
+    published_date, status_id = value.decode("utf-8").split("|")
+    return datetime.fromisoformat(published_date), int(status_id)
+
+
+def set_checkpoint(key, status):
+    """record how far through the statuses the rebuild has got"""
+    r.set(key, f"{status.published_date.isoformat()}|{status.id}")
+
+
+def get_status_batches(cursor, batch_size):
+    """the statuses that can appear in streams, newest first, a batch at a time,
+    starting after the cursor"""
+    queryset = (
+        models.Status.objects.select_subclasses()
+        .filter(deleted=False, privacy__in=["public", "unlisted", "followers"])
+        .select_related(
+            "user",
+            "reply_parent__user",
+            "comment__book",
+            "review__book",
+            "quotation__book",
+        )
+        .prefetch_related("mention_users", "mention_books")
+        .order_by("-published_date", "-id")
+    )
+    while True:
+        batch = queryset
+        if cursor:
+            published_date, status_id = cursor
+            batch = batch.filter(
+                Q(published_date__lt=published_date)
+                | Q(published_date=published_date, id__lt=status_id)
+            )
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield batch
+        cursor = (batch[-1].published_date, batch[-1].id)
+
+
+def get_full_user_ids(stream, added):
+    """users whose stream has had as many statuses added as it keeps. The rest
+    of the statuses are older than all of those, so they'd be trimmed out"""
+    if not stream.max_length:
+        return set()
+    return {user_id for (user_id, count) in added.items() if count >= stream.max_length}
+
+
+def prepare_users():
+    """build the relationship sets that each status's audience comes from, and
+    the users' lists streams. Returns the ids of the users who get streams"""
+    activitystreams.audience_sets.populate()
+    user_ids = set(
+        models.User.objects.filter(local=True, is_active=True).values_list(
+            "id", flat=True
+        )
+    )
+    for user_id in user_ids:
+        lists_stream.populate_lists_task.delay(user_id)
+    return user_ids
+
+
+def add_batch(batch, added):
+    """add a batch of statuses to each stream, except those that are already
+    full, and count them. Returns how many stream entries were written"""
+    write_count = 0
+    for (stream_key, counts) in added.items():
+        stream = activitystreams.streams[stream_key]
+        stream_added = stream.bulk_add_statuses(
+            batch, skip_user_ids=get_full_user_ids(stream, counts)
+        )
+        counts.update(stream_added)
+        write_count += sum(stream_added.values())
+    return write_count
+
+
+def mark_built(streams, user_ids):
+    """record that the users' streams are ready to be read from redis, for
+    streams that expire"""
+    pipeline = r.pipeline()
+    for stream_key in streams:
+        stream = activitystreams.streams[stream_key]
+        if not stream.expiry:
+            continue
+        for user_id in user_ids:
+            stream.mark_built(pipeline, user_id)
+            flush_pipeline(pipeline)
+    pipeline.execute()
+
+
+def bulk_populate_streams(stream=None, batch_size=1000, restart=False):
+    """build all the streams by walking through statuses once, newest first,
+    and adding each batch to the streams of everyone who should see it, until
+    every stream is full"""
+    streams = [stream] if stream else list(activitystreams.streams.keys())
+    key = checkpoint_id(streams)
+    if restart:
+        r.delete(key)
+    cursor = get_checkpoint(key)
+    if cursor:
+        print(f"Resuming from status {cursor[1]} ({cursor[0]})")
+    else:
+        print("Populating streams", streams)
+
+    user_ids = prepare_users()
+    # how many statuses have been added to each user's streams in this run. A
+    # resumed run counts from zero, which only costs writes that get trimmed
+    added = {stream_key: Counter() for stream_key in streams}
+    start = time.perf_counter()
+    status_count = 0
+    write_count = 0
+    for batch in get_status_batches(cursor, batch_size):
+        write_count += add_batch(batch, added)
+        set_checkpoint(key, batch[-1])
+
+        status_count += len(batch)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{status_count} statuses, {write_count} stream entries "
+            f"({status_count / elapsed:.1f} statuses/s, "
+            f"{write_count / elapsed:.1f} entries/s)"
+        )
+        if all(
+            get_full_user_ids(activitystreams.streams[stream_key], counts) >= user_ids
+            for (stream_key, counts) in added.items()
+        ):
+            print("Every stream is full")
+            break
+
+    mark_built(streams, user_ids)
+    r.delete(key)
+    print(f"Done: {status_count} statuses in {time.perf_counter() - start:.1f}s")
+
+
 class Command(BaseCommand):
     """start all over with user streams"""
 
@@ -31,9 +182,33 @@ class Command(BaseCommand):
             default=None,
             help="Specifies which time of stream to populate",
         )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Rebuild in this process by walking through all statuses once, "
+            "resuming an interrupted run",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="How many statuses to load at a time with --bulk",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the progress of an interrupted --bulk run",
+        )
 
     # pylint: disable=no-self-use,unused-argument
     def handle(self, *args, **options):
         """run feed builder"""
         stream = options.get("stream")
+        if options.get("bulk"):
+            bulk_populate_streams(
+                stream=stream,
+                batch_size=options["batch_size"],
+                restart=options["restart"],
+            )
+            return
         populate_streams(stream=stream)
@@ -0,0 +1,56 @@
+""" Split existing streams into their status type substreams """
+from django.core.management.base import BaseCommand
+from bookwyrm import activitystreams, models
+from bookwyrm.redis_store import r
+
+
+def populate_user_substreams(user_id):
+    """add the statuses in each of a user's streams to their substreams"""
+    pipeline = r.pipeline()
+    count = 0
+    for stream in activitystreams.streams.values():
+        # statuses that the feed filters don't apply to used to have a substream
+        pipeline.delete(stream.substream_id(user_id, activitystreams.UNFILTERED_TYPE))
+        entries = r.zrange(stream.stream_id(user_id), 0, -1, withscores=True)
+        if not entries:
+            continue
+        statuses = models.Status.objects.select_subclasses().in_bulk(
+            [int(status_id) for (status_id, _) in entries]
+        )
+        activitystreams.load_boosted_statuses(statuses.values())
+        for (status_id, rank) in entries:
+            status = statuses.get(int(status_id))
+            if not status:
+                continue
+            for name in stream.get_substore_names(status):
+                key = stream.substream_id(user_id, name)
+                pipeline.zadd(key, {status.id: rank})
+                if stream.expiry:
+                    pipeline.expire(key, stream.expiry)
+                count += 1
+    pipeline.execute()
+    return count
+
+
+def populate_substreams():
+    """build the substreams for every user from the streams they already have"""
+    print("Populating substreams")
+    users = models.User.objects.filter(local=True, is_active=True)
+    for (count, user_id) in enumerate(
+        users.values_list("id", flat=True).iterator(), start=1
+    ):
+        populate_user_substreams(user_id)
+        if not count % 1000:
+            print(f"{count} users done")
+    print("Done")
+
+
+class Command(BaseCommand):
+    """build substreams for existing streams"""
+
+    help = "Split existing streams into the substreams used by filtered feeds"
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the split"""
+        populate_substreams()
@@ -0,0 +1,70 @@
+""" Recompute the search vectors of every book """
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+from bookwyrm import book_search, models
+
+
+def rebuild_chunk(start, end):
+    """update one range of books, in a thread with its own database connection"""
+    try:
+        return book_search.rebuild_search_vectors(start, end)
+    finally:
+        connection.close()
+
+
+def rebuild_search_index(chunk_size=10000, workers=4):
+    """update every book's search vector, with ranges of ids updated in parallel"""
+    bounds = models.Book.objects.aggregate(start=Min("id"), end=Max("id"))
+    if bounds["start"] is None:
+        print("No books to index")
+        return
+
+    total = models.Book.objects.count()
+    chunks = range(bounds["start"], bounds["end"] + 1, chunk_size)
+    print(f"Indexing {total:,} books in {len(chunks):,} chunks")
+    done = 0
+    if workers == 1:
+        for start in chunks:
+            done += book_search.rebuild_search_vectors(start, start + chunk_size)
+            print(f"{done:,}/{total:,}", end="\r")
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(rebuild_chunk, start, start + chunk_size)
+                for start in chunks
+            ]
+            for future in as_completed(futures):
+                done += future.result()
+                print(f"{done:,}/{total:,}", end="\r")
+    print(f"{done:,}/{total:,}")
+    print("All done, thank you for your patience!")
+
+
+class Command(BaseCommand):
+    """rebuild the search index"""
+
+    help = "Recompute the search vectors of every book"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="How many book ids to update in each query",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="How many chunks to update at once",
+        )
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """run the rebuild"""
+        rebuild_search_index(
+            chunk_size=options["chunk_size"], workers=options["workers"]
+        )
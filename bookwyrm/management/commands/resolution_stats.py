@@ -0,0 +1,32 @@
+""" Report how well the remote id resolution cache is working """
+from django.core.management.base import BaseCommand
+
+from bookwyrm.activitypub.base_activity import get_resolution_stats
+
+
+def resolution_stats():
+    """print the counters and the rates that matter"""
+    stats = get_resolution_stats()
+    for (stat, value) in stats.items():
+        print(f"{stat.replace('_', ' '):>16}: {value}")
+
+    lookups = stats["hits"] + stats["misses"]
+    if lookups:
+        print(f"Hit rate: {stats['hits'] / lookups:.1%}")
+    avoided = stats["unresolved_hits"] + stats["shared_fetches"]
+    if avoided + stats["fetches"]:
+        print(
+            f"Fetches avoided: {avoided} "
+            f"({avoided / (avoided + stats['fetches']):.1%} of remote loads)"
+        )
+
+
+class Command(BaseCommand):
+    """show the remote id resolution counters"""
+
+    help = "Show hit rates and fetches avoided by the remote id resolution cache"
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """print the stats"""
+        resolution_stats()
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.17 on 2026-10-18 11:13
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0173_default_user_auth_group_setting"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="author",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name"],
+                name="bookwyrm_author_name_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"],
+                name="bookwyrm_book_title_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
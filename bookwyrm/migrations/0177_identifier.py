@@ -0,0 +1,55 @@
+# Generated by Django 3.2.17 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0176_typeahead_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Identifier",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("identifier_type", models.CharField(max_length=255)),
+                ("value", models.CharField(max_length=255)),
+                (
+                    "author",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="identifiers",
+                        to="bookwyrm.author",
+                    ),
+                ),
+                (
+                    "book",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="identifiers",
+                        to="bookwyrm.book",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="identifier",
+            index=models.Index(
+                fields=["value", "identifier_type"],
+                name="bookwyrm_id_value_5d945f_idx",
+            ),
+        ),
+    ]
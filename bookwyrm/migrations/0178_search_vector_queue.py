@@ -0,0 +1,127 @@
+# Generated by Django 3.2.17 on 2026-10-18 14:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0177_identifier"),
+    ]
+
+    operations = [
+        # books are queued when they change, and their search vectors are updated
+        # in batches by update_search_vectors_task
+        migrations.RunSQL(
+            sql="""
+                CREATE TABLE bookwyrm_book_search_queue (
+                    book_id integer PRIMARY KEY
+                );
+
+                DROP TRIGGER IF EXISTS search_vector_trigger
+                ON bookwyrm_book;
+                DROP FUNCTION IF EXISTS book_trigger;
+
+                CREATE FUNCTION book_trigger() RETURNS trigger AS $$
+                begin
+                    INSERT INTO bookwyrm_book_search_queue (book_id)
+                    VALUES (new.id)
+                    ON CONFLICT DO NOTHING;
+                    return new;
+                end
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER search_vector_trigger
+                AFTER INSERT OR UPDATE OF title, subtitle, series
+                ON bookwyrm_book
+                FOR EACH ROW EXECUTE FUNCTION book_trigger();
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS search_vector_trigger
+                ON bookwyrm_book;
+                DROP FUNCTION IF EXISTS book_trigger;
+
+                CREATE FUNCTION book_trigger() RETURNS trigger AS $$
+                begin
+                    new.search_vector :=
+                        coalesce(
+                            NULLIF(setweight(to_tsvector('english', coalesce(new.title, '')), 'A'), ''),
+                            setweight(to_tsvector('simple', coalesce(new.title, '')), 'A')
+                        ) ||
+                        setweight(to_tsvector('english', coalesce(new.subtitle, '')), 'B') ||
+                        (SELECT setweight(to_tsvector('simple', coalesce(array_to_string(array_agg(bookwyrm_author.name), ' '), '')), 'C')
+                            FROM bookwyrm_book
+                            LEFT OUTER JOIN bookwyrm_book_authors
+                            ON bookwyrm_book.id = bookwyrm_book_authors.book_id
+                            LEFT OUTER JOIN bookwyrm_author
+                            ON bookwyrm_book_authors.author_id = bookwyrm_author.id
+                            WHERE bookwyrm_book.id = new.id
+                        ) ||
+                        setweight(to_tsvector('english', coalesce(new.series, '')), 'D');
+                    return new;
+                end
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER search_vector_trigger
+                BEFORE INSERT OR UPDATE OF title, subtitle, series, search_vector
+                ON bookwyrm_book
+                FOR EACH ROW EXECUTE FUNCTION book_trigger();
+
+                DROP TABLE IF EXISTS bookwyrm_book_search_queue;
+            """,
+        ),
+        # when an author is edited
+        migrations.RunSQL(
+            sql="""
+                CREATE OR REPLACE FUNCTION author_trigger() RETURNS trigger AS $$
+                begin
+                    INSERT INTO bookwyrm_book_search_queue (book_id)
+                    SELECT book_id FROM bookwyrm_book_authors
+                    WHERE author_id = new.id
+                    ON CONFLICT DO NOTHING;
+                    return new;
+                end
+                $$ LANGUAGE plpgsql;
+            """,
+            reverse_sql="""
+                CREATE OR REPLACE FUNCTION author_trigger() RETURNS trigger AS $$
+                begin
+                    WITH book AS (
+                        SELECT bookwyrm_book.id as row_id
+                        FROM bookwyrm_author
+                        LEFT OUTER JOIN bookwyrm_book_authors
+                        ON bookwyrm_book_authors.id = new.id
+                        LEFT OUTER JOIN bookwyrm_book
+                        ON bookwyrm_book.id = bookwyrm_book_authors.book_id
+                    )
+                    UPDATE bookwyrm_book SET search_vector = ''
+                    FROM book
+                    WHERE id = book.row_id;
+                    return new;
+                end
+                $$ LANGUAGE plpgsql;
+            """,
+        ),
+        # when an author is added to or removed from a book
+        migrations.RunSQL(
+            sql="""
+                CREATE OR REPLACE FUNCTION book_authors_trigger() RETURNS trigger AS $$
+                begin
+                    INSERT INTO bookwyrm_book_search_queue (book_id)
+                    VALUES (coalesce(new.book_id, old.book_id))
+                    ON CONFLICT DO NOTHING;
+                    return new;
+                end
+                $$ LANGUAGE plpgsql;
+            """,
+            reverse_sql="""
+                CREATE OR REPLACE FUNCTION book_authors_trigger() RETURNS trigger AS $$
+                begin
+                    UPDATE bookwyrm_book SET search_vector = ''
+                    WHERE id = coalesce(new.book_id, old.book_id);
+                    return new;
+                end
+                $$ LANGUAGE plpgsql;
+            """,
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 3.2.17 on 2026-10-18 15:20
+
+import re
+
+from django.db import migrations
+
+# the identifying fields of each model when the identifier table was added
+SHARED_FIELDS = [
+    "remote_id",
+    "openlibrary_key",
+    "inventaire_id",
+    "librarything_key",
+    "goodreads_key",
+    "bnf_id",
+    "viaf",
+    "wikidata",
+    "asin",
+    "aasin",
+    "isfdb",
+]
+FIELDS = {
+    "Edition": SHARED_FIELDS + ["isbn_10", "isbn_13", "oclc_number"],
+    "Work": SHARED_FIELDS + ["lccn"],
+    "Author": SHARED_FIELDS + ["wikipedia_link", "isni", "gutenberg_id", "website"],
+}
+ISBN_FIELDS = ["isbn_10", "isbn_13"]
+
+
+def normalize_isbn(value):
+    """the isbn 13 for an isbn 10 or 13 in any format, or None if it isn't one"""
+    isbn = re.sub(r"[^0-9X]", "", value.upper())
+    if len(isbn) == 9:
+        isbn = isbn.rjust(10, "0")
+    if len(isbn) == 10:
+        converted = "978" + isbn[:9]
+        if not converted.isnumeric():
+            return None
+        checksum = sum(int(i) for i in converted[::2]) + sum(
+            int(i) * 3 for i in converted[1::2]
+        )
+        return converted + str((10 - checksum % 10) % 10)
+    if len(isbn) == 13 and isbn.isnumeric():
+        return isbn
+    return None
+
+
+def get_identifiers(instance, fields):
+    """the (type, value) pairs that identify a book or author"""
+    identifiers = set()
+    for field in fields:
+        value = getattr(instance, field, None)
+        if not value or not isinstance(value, str):
+            continue
+        if field in ISBN_FIELDS:
+            identifiers.add(("isbn", normalize_isbn(value)))
+        else:
+            identifiers.add((field, value.strip()[:255]))
+    if instance.origin_id:
+        identifiers.add(("remote_id", instance.origin_id.strip()[:255]))
+    return {(key, value) for (key, value) in identifiers if value}
+
+
+def backfill_identifiers(apps, schema_editor):
+    """fill in the identifier table for the books and authors that already exist,
+    so that lookups don't miss them"""
+    db_alias = schema_editor.connection.alias
+    identifier_model = apps.get_model("bookwyrm", "Identifier")
+    # anything saved since the table was added is rebuilt along with the rest
+    identifier_model.objects.using(db_alias).all().delete()
+    for (model_name, fields) in FIELDS.items():
+        model = apps.get_model("bookwyrm", model_name)
+        owner = "author" if model_name == "Author" else "book"
+
+        batch = []
+        queryset = model.objects.using(db_alias).only("id", "origin_id", *fields)
+        for instance in queryset.iterator(chunk_size=1000):
+            batch.extend(
+                identifier_model(
+                    identifier_type=key, value=value, **{f"{owner}_id": instance.id}
+                )
+                for (key, value) in get_identifiers(instance, fields)
+            )
+            if len(batch) >= 1000:
+                identifier_model.objects.using(db_alias).bulk_create(batch)
+                batch = []
+        identifier_model.objects.using(db_alias).bulk_create(batch)
+
+
+def remove_identifiers(apps, schema_editor):
+    """empty the table again"""
+    db_alias = schema_editor.connection.alias
+    apps.get_model("bookwyrm", "Identifier").objects.using(db_alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0178_search_vector_queue"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_identifiers, remove_identifiers),
+    ]
@@ -4,6 +4,7 @@ import sys
 
 from .book import Book, Work, Edition, BookDataModel
 from .author import Author
+from .identifier import Identifier
 from .link import Link, FileLink, LinkDomain
 from .connector import Connector
 
@@ -1,5 +1,4 @@
 """ activitypub model functionality """
-import asyncio
 from base64 import b64encode
 from collections import namedtuple
 from functools import reduce
@@ -9,18 +8,16 @@ import logging
 from typing import List
 from uuid import uuid4
 
-import aiohttp
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
 from django.apps import apps
+from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.db.models import Q
-from django.utils.http import http_date
 
-from bookwyrm import activitypub
-from bookwyrm.settings import USER_AGENT, PAGE_LENGTH
-from bookwyrm.signatures import make_signature, make_digest
+from bookwyrm import activitypub, delivery
+from bookwyrm.settings import PAGE_LENGTH
 from bookwyrm.tasks import app, MEDIUM
 from bookwyrm.models.fields import ImageField, ManyToManyField
 
@@ -30,6 +27,10 @@ logger = logging.getLogger(__name__)
 
 PropertyField = namedtuple("PropertyField", ("set_activity_from_field"))
 
+# how long to remember who a user's activities are sent to, in case something
+# changes them that doesn't clear the cache
+RECIPIENTS_CACHE_TIMEOUT = 60 * 60 * 24
+
 # pylint: disable=invalid-name
 def set_activity_from_property_field(activity, obj, field):
     """assign a model property value to the activity json"""
@@ -156,33 +157,7 @@ class ActivitypubMixin:
 
         # unless it's a dm, all the followers should receive the activity
         if privacy != "direct":
-            # we will send this out to a subset of all remote users
-            queryset = (
-                user_model.viewer_aware_objects(user)
-                .filter(
-                    local=False,
-                )
-                .distinct()
-            )
-            # filter users first by whether they're using the desired software
-            # this lets us send book updates only to other bw servers
-            if software:
-                queryset = queryset.filter(bookwyrm_user=(software == "bookwyrm"))
-            # if there's a user, we only want to send to the user's followers
-            if user:
-                queryset = queryset.filter(following=user)
-
-            # ideally, we will send to shared inboxes for efficiency
-            shared_inboxes = (
-                queryset.filter(shared_inbox__isnull=False)
-                .values_list("shared_inbox", flat=True)
-                .distinct()
-            )
-            # but not everyone has a shared inbox
-            inboxes = queryset.filter(shared_inbox__isnull=True).values_list(
-                "inbox", flat=True
-            )
-            recipients += list(shared_inboxes) + list(inboxes)
+            recipients += get_follower_inboxes(user, software=software)
         return list(set(recipients))
 
     def to_activity_dataclass(self):
@@ -195,6 +170,50 @@ class ActivitypubMixin:
         return self.to_activity_dataclass().serialize()
 
 
+def recipients_cache_key(user_id):
+    """the cache key for the inboxes a user's activities are sent to"""
+    return f"recipient-inboxes-{user_id or 'instance'}"
+
+
+def get_follower_inboxes(user, software=None):
+    """the inboxes of the remote users who follow a user, or of all remote users
+    for activities that aren't owned by a user, split by the software they use"""
+    key = recipients_cache_key(user.id if user else None)
+    inboxes = cache.get(key)
+    if inboxes is None:
+        inboxes = load_follower_inboxes(user)
+        cache.set(key, inboxes, RECIPIENTS_CACHE_TIMEOUT)
+
+    # this lets us send book updates only to other bw servers
+    if software:
+        return inboxes["bookwyrm" if software == "bookwyrm" else "other"]
+    return inboxes["bookwyrm"] + inboxes["other"]
+
+
+def load_follower_inboxes(user):
+    """look up the inboxes to send a user's activities to"""
+    user_model = apps.get_model("bookwyrm.User", require_ready=True)
+    # we will send this out to a subset of all remote users
+    queryset = user_model.viewer_aware_objects(user).filter(local=False)
+    # if there's a user, we only want to send to the user's followers
+    if user:
+        queryset = queryset.filter(following=user)
+
+    inboxes = {"bookwyrm": set(), "other": set()}
+    for (bookwyrm_user, shared_inbox, inbox) in queryset.values_list(
+        "bookwyrm_user", "shared_inbox", "inbox"
+    ).distinct():
+        # ideally, we will send to shared inboxes for efficiency,
+        # but not everyone has a shared inbox
+        inboxes["bookwyrm" if bookwyrm_user else "other"].add(shared_inbox or inbox)
+    return {software: list(urls) for (software, urls) in inboxes.items()}
+
+
+def clear_recipients_cache(user_ids):
+    """forget the inboxes for these users, and None for the instance"""
+    cache.delete_many([recipients_cache_key(user_id) for user_id in user_ids])
+
+
 class ObjectMixin(ActivitypubMixin):
     """add this mixin for object models that are AP serializable"""
 
@@ -509,56 +528,10 @@ def unfurl_related_field(related_field, sort_field=None):
 @app.task(queue=MEDIUM)
 def broadcast_task(sender_id: int, activity: str, recipients: List[str]):
     """the celery task for broadcast"""
-    user_model = apps.get_model("bookwyrm.User", require_ready=True)
-    sender = user_model.objects.select_related("key_pair").get(id=sender_id)
-    asyncio.run(async_broadcast(recipients, sender, activity))
-
-
-async def async_broadcast(recipients: List[str], sender, data: str):
-    """Send all the broadcasts simultaneously"""
-    timeout = aiohttp.ClientTimeout(total=10)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = []
-        for recipient in recipients:
-            tasks.append(
-                asyncio.ensure_future(sign_and_send(session, sender, data, recipient))
-            )
-
-        results = await asyncio.gather(*tasks)
-        return results
-
-
-async def sign_and_send(
-    session: aiohttp.ClientSession, sender, data: str, destination: str
-):
-    """Sign the messages and send them in an asynchronous bundle"""
-    now = http_date()
-
-    if not sender.key_pair.private_key:
-        # this shouldn't happen. it would be bad if it happened.
-        raise ValueError("No private key found for sender")
-
-    digest = make_digest(data)
-
-    headers = {
-        "Date": now,
-        "Digest": digest,
-        "Signature": make_signature("post", sender, destination, now, digest),
-        "Content-Type": "application/activity+json; charset=utf-8",
-        "User-Agent": USER_AGENT,
-    }
-
-    try:
-        async with session.post(destination, data=data, headers=headers) as response:
-            if not response.ok:
-                logger.exception(
-                    "Failed to send broadcast to %s: %s", destination, response.reason
-                )
-            return response
-    except asyncio.TimeoutError:
-        logger.info("Connection timed out for url: %s", destination)
-    except aiohttp.ClientError as err:
-        logger.exception(err)
+    hosts = delivery.enqueue(sender_id, activity, recipients)
+    if hosts:
+        # sending can be slow, so it's left to the delivery queue
+        delivery.deliver_task.delay(hosts)
 
 
 # pylint: disable=unused-argument
@@ -68,6 +68,13 @@ class Author(BookDataModel):
     activity_serializer = activitypub.Author
 
     class Meta:
-        """sets up postgres GIN index field"""
+        """sets up postgres GIN index fields, for full text and typeahead search"""
 
-        indexes = (GinIndex(fields=["search_vector"]),)
+        indexes = (
+            GinIndex(fields=["search_vector"]),
+            GinIndex(
+                fields=["name"],
+                name="bookwyrm_author_name_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        )
@@ -207,6 +207,18 @@ class Book(BookDataModel):
         if not isinstance(self, Edition) and not isinstance(self, Work):
             raise ValueError("Books should be added as Editions or Works")
 
+        # the search vector is only ever written by update_search_vectors, and
+        # saving the copy loaded with this book would undo a newer one
+        if (
+            not self._state.adding
+            and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "search_vector"
+            ]
         return super().save(*args, **kwargs)
 
     def get_remote_id(self):
@@ -222,9 +234,16 @@ class Book(BookDataModel):
         )
 
     class Meta:
-        """sets up postgres GIN index field"""
-
-        indexes = (GinIndex(fields=["search_vector"]),)
+        """sets up postgres GIN index fields, for full text and typeahead search"""
+
+        indexes = (
+            GinIndex(fields=["search_vector"]),
+            GinIndex(
+                fields=["title"],
+                name="bookwyrm_book_title_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        )
 
 
 class Work(OrderedCollectionPageMixin, Book):
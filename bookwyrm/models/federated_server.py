@@ -1,10 +1,15 @@
 """ connections to external ActivityPub servers """
+import time
 from urllib.parse import urlparse
 
 from django.apps import apps
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
+import redis
 
+from bookwyrm.redis_store import r
+from .activitypub_mixin import clear_recipients_cache
 from .base_model import BookWyrmModel
 
 FederationStatus = [
@@ -34,6 +39,7 @@ class FederatedServer(BookWyrmModel):
         self.user_set.filter(is_active=True).update(
             is_active=False, deactivation_reason="domain_block"
         )
+        self.clear_follower_inboxes()
 
         # check for related connectors
         if self.application_type == "bookwyrm":
@@ -50,6 +56,7 @@ class FederatedServer(BookWyrmModel):
         self.user_set.filter(deactivation_reason="domain_block").update(
             is_active=True, deactivation_reason=None
         )
+        self.clear_follower_inboxes()
 
         # check for related connectors
         if self.application_type == "bookwyrm":
@@ -60,9 +67,92 @@ class FederatedServer(BookWyrmModel):
                 deactivation_reason="domain_block",
             ).update(active=True, deactivation_reason=None)
 
+    def clear_follower_inboxes(self):
+        """the server's users were (de)activated without signals, so update
+        the inboxes for the local users they follow"""
+        follows_model = apps.get_model("bookwyrm.UserFollows", require_ready=True)
+        followed = follows_model.objects.filter(
+            user_subject__federated_server=self, user_object__local=True
+        ).values_list("user_object_id", flat=True)
+        user_ids = [None] + list(followed)
+        transaction.on_commit(lambda: clear_recipients_cache(user_ids))
+
     @classmethod
     def is_blocked(cls, url):
         """look up if a domain is blocked"""
-        url = urlparse(url)
-        domain = url.netloc
-        return cls.objects.filter(server_name=domain, status="blocked").exists()
+        return blocklist.is_blocked(urlparse(url))
+
+
+class Blocklist:
+    """a copy of the blocked server names for each process, which is reloaded
+    when a server is blocked or unblocked anywhere"""
+
+    # the redis key that changes whenever the blocklist does
+    version_key = "federated-server-blocklist-version"
+    # how often to check the version, in seconds
+    check_interval = 5
+
+    def __init__(self):
+        self.version = None
+        self.checked = 0
+        self.domains = frozenset()
+
+    def get_version(self):
+        """the current version, or None if redis can't say"""
+        try:
+            return r.get(self.version_key) or b"0"
+        except redis.exceptions.RedisError:
+            return None
+
+    def refresh(self):
+        """reload the blocked domains if they've changed"""
+        now = time.time()
+        if self.version is not None and now - self.checked < self.check_interval:
+            return
+        version = self.get_version()
+        if version is None or version != self.version:
+            self.domains = frozenset(
+                FederatedServer.objects.filter(status="blocked").values_list(
+                    "server_name", flat=True
+                )
+            )
+        # without redis, every check has to go to the database
+        self.version = version
+        self.checked = now
+
+    def changed(self):
+        """reload in this process now, and in the others after the transaction"""
+        self.version = None
+        transaction.on_commit(self.publish)
+
+    def publish(self):
+        """tell the other processes to reload"""
+        try:
+            r.incr(self.version_key)
+        except redis.exceptions.RedisError:
+            pass
+
+    def is_blocked(self, url):
+        """is a parsed url on the blocklist, either by name or because a
+        wildcard like *.example.com covers it"""
+        self.refresh()
+        if url.netloc in self.domains:
+            return True
+        parts = (url.hostname or "").split(".")
+        return any(
+            f"*.{'.'.join(parts[i:])}" in self.domains for i in range(1, len(parts))
+        )
+
+
+blocklist = Blocklist()
+
+
+@receiver(models.signals.post_save, sender=FederatedServer)
+@receiver(models.signals.post_delete, sender=FederatedServer)
+# pylint: disable=unused-argument
+def update_blocklist(sender, instance, *args, **kwargs):
+    """servers might have been blocked or unblocked"""
+    update_fields = kwargs.get("update_fields")
+    if update_fields and "status" not in update_fields:
+        return
+    blocklist.changed()
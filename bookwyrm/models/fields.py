@@ -9,6 +9,7 @@ from dateutil.parser import ParserError
 from django.contrib.postgres.fields import ArrayField as DjangoArrayField
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.lookups import PatternLookup
 from django.forms import ClearableFileInput, ImageField as DjangoImageField
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -523,6 +524,22 @@ class TextField(ActivitypubFieldMixin, models.TextField):
     """activitypub-aware text field"""
 
 
+@CharField.register_lookup
+@TextField.register_lookup
+class TrigramContains(PatternLookup):
+    """case insensitive substring match that compiles to ILIKE, which a
+    gin_trgm_ops index can serve. icontains uppercases the column instead"""
+
+    lookup_name = "trigram_contains"
+    param_pattern = "%%%s%%"
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        params.extend(rhs_params)
+        return f"{lhs_sql} ILIKE {rhs_sql}", params
+
+
 class BooleanField(ActivitypubFieldMixin, models.BooleanField):
     """activitypub-aware boolean field"""
 
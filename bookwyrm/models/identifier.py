@@ -0,0 +1,127 @@
+""" every identifier for books and authors, in one table for quick lookups """
+import re
+
+from django.db import models
+from django.dispatch import receiver
+
+from .author import Author
+from .book import Book, Edition, Work, isbn_10_to_13
+
+# isbn 10s and 13s are both stored as isbn 13s
+ISBN = "isbn"
+# local books and authors have a remote id from here and one from where they
+# came from, and either one can be used to find them
+REMOTE_ID = "remote_id"
+
+
+class Identifier(models.Model):
+    """one of a book or author's identifiers, normalized"""
+
+    identifier_type = models.CharField(max_length=255)
+    value = models.CharField(max_length=255)
+    book = models.ForeignKey(
+        "Book", on_delete=models.CASCADE, null=True, related_name="identifiers"
+    )
+    author = models.ForeignKey(
+        "Author", on_delete=models.CASCADE, null=True, related_name="identifiers"
+    )
+
+    class Meta:
+        """looked up by value, optionally of one type"""
+
+        indexes = [models.Index(fields=["value", "identifier_type"])]
+
+
+def normalize_isbn(value):
+    """the isbn 13 for an isbn 10 or 13 in any format, or None if it isn't one"""
+    isbn = re.sub(r"[^0-9X]", "", value.upper())
+    # If the ISBN has only 9 characters, prepend missing zero
+    if len(isbn) == 9:
+        isbn = isbn.rjust(10, "0")
+    if len(isbn) == 10:
+        return isbn_10_to_13(isbn)
+    if len(isbn) == 13 and isbn.isnumeric():
+        return isbn
+    return None
+
+
+def normalize_value(value):
+    """an identifier as it's stored, trimmed to fit the value column"""
+    return value.strip()[:255]
+
+
+def get_identifiers(instance):
+    """the (type, value) pairs that identify a book or author"""
+    identifiers = set()
+    # pylint: disable=protected-access
+    for field in instance._meta.get_fields():
+        if not getattr(field, "deduplication_field", False):
+            continue
+        value = getattr(instance, field.name)
+        if not value or not isinstance(value, str):
+            continue
+        if field.name in ["isbn_10", "isbn_13"]:
+            identifiers.add((ISBN, normalize_isbn(value)))
+        else:
+            identifiers.add((field.name, normalize_value(value)))
+    if getattr(instance, "origin_id", None):
+        identifiers.add((REMOTE_ID, normalize_value(instance.origin_id)))
+    return {(key, value) for (key, value) in identifiers if value}
+
+
+def owner_field(instance):
+    """which foreign key an identifier uses to point to this object"""
+    return "book" if isinstance(instance, Book) else "author"
+
+
+def update_identifiers(instance):
+    """make the stored identifiers match a book or author's fields"""
+    field = owner_field(instance)
+    current = get_identifiers(instance)
+    existing = {
+        (identifier.identifier_type, identifier.value): identifier.id
+        for identifier in Identifier.objects.filter(**{field: instance})
+    }
+
+    stale = [
+        identifier_id for (key, identifier_id) in existing.items() if key not in current
+    ]
+    if stale:
+        Identifier.objects.filter(id__in=stale).delete()
+    Identifier.objects.bulk_create(
+        Identifier(identifier_type=key, value=value, **{field: instance})
+        for (key, value) in current
+        if (key, value) not in existing
+    )
+
+
+def rebuild_identifiers(instances):
+    """replace the stored identifiers for many books or authors of one type at
+    once"""
+    if not instances:
+        return
+    field = owner_field(instances[0])
+    Identifier.objects.filter(**{f"{field}__in": instances}).delete()
+    Identifier.objects.bulk_create(
+        Identifier(identifier_type=key, value=value, **{field: instance})
+        for instance in instances
+        for (key, value) in get_identifiers(instance)
+    )
+
+
+def identifier_values(query):
+    """the values that could be stored for an identifier someone searched for"""
+    values = {normalize_value(query)}
+    isbn = normalize_isbn(query)
+    if isbn:
+        values.add(isbn)
+    return values
+
+
+@receiver(models.signals.post_save, sender=Edition)
+@receiver(models.signals.post_save, sender=Work)
+@receiver(models.signals.post_save, sender=Author)
+# pylint: disable=unused-argument
+def save_identifiers(sender, instance, *args, **kwargs):
+    """keep the lookup table up to date as books and authors change"""
+    update_identifiers(instance)
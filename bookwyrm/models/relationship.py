@@ -2,11 +2,12 @@
 from django.core.cache import cache
 from django.db import models, transaction, IntegrityError
 from django.db.models import Q
+from django.dispatch import receiver
 
 from bookwyrm import activitypub
 from bookwyrm.tasks import HIGH
 from .activitypub_mixin import ActivitypubMixin, ActivityMixin
-from .activitypub_mixin import generate_activity
+from .activitypub_mixin import clear_recipients_cache, generate_activity
 from .base_model import BookWyrmModel
 from . import fields
 
@@ -216,3 +217,15 @@ def clear_cache(user_subject, user_object):
             f"cached-relationship-{user_object.id}-{user_subject.id}",
         ]
     )
+
+
+@receiver(models.signals.post_save, sender=UserFollows)
+@receiver(models.signals.post_delete, sender=UserFollows)
+@receiver(models.signals.post_save, sender=UserBlocks)
+@receiver(models.signals.post_delete, sender=UserBlocks)
+# pylint: disable=unused-argument
+def clear_recipients_on_relationship_change(sender, instance, *args, **kwargs):
+    """who gets a user's activities depends on follows and blocks"""
+    user_ids = [instance.user_subject_id, instance.user_object_id]
+    # otherwise the old recipients could be cached again before the change is saved
+    transaction.on_commit(lambda: clear_recipients_cache(user_ids))
@@ -23,6 +23,7 @@ from bookwyrm.signatures import create_key_pair
 from bookwyrm.tasks import app, LOW
 from bookwyrm.utils import regex
 from .activitypub_mixin import OrderedCollectionPageMixin, ActivitypubMixin
+from .activitypub_mixin import clear_recipients_cache
 from .base_model import BookWyrmModel, DeactivationReason, new_access_code
 from .federated_server import FederatedServer
 from . import fields
@@ -176,6 +177,9 @@ class User(OrderedCollectionPageMixin, AbstractUser):
     name_field = "username"
     property_fields = [("following_link", "following")]
     field_tracker = FieldTracker(fields=["name", "avatar"])
+    inbox_tracker = FieldTracker(
+        fields=["inbox", "shared_inbox", "is_active", "bookwyrm_user"]
+    )
 
     # two factor authentication
     two_factor_auth = models.BooleanField(default=None, blank=True, null=True)
@@ -541,3 +545,16 @@ def preview_image(instance, *args, **kwargs):
 
     if len(changed_fields) > 0:
         generate_user_preview_image_task.delay(instance.id)
+
+
+# pylint: disable=unused-argument
+@receiver(models.signals.post_save, sender=User)
+def clear_recipients_on_remote_user_change(instance, created, *args, **kwargs):
+    """remote users' inboxes are cached for the local users they follow"""
+    if instance.local or not (created or instance.inbox_tracker.changed()):
+        return
+    # None is activities, like book edits, that go to every remote user
+    user_ids = [None]
+    if not created:
+        user_ids += instance.following.filter(local=True).values_list("id", flat=True)
+    transaction.on_commit(lambda: clear_recipients_cache(user_ids))
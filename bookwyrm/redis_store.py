@@ -1,32 +1,80 @@
 """ access the activity stores stored in redis """
 from abc import ABC, abstractmethod
+import logging
 import redis
 
 from bookwyrm import settings
 
 r = redis.from_url(settings.REDIS_ACTIVITY_URL)
 
+logger = logging.getLogger(__name__)
+
+
+def flush_pipeline(pipeline, limit=settings.REDIS_PIPELINE_SIZE):
+    """send the buffered commands once the pipeline reaches its size limit"""
+    if len(pipeline) >= limit:
+        pipeline.execute()
+
 
 class RedisStore(ABC):
     """sets of ranked, related objects, like statuses for a user's feed"""
 
     max_length = settings.MAX_STREAM_LENGTH
+    # how long a store is kept after it was last written to, if it isn't kept forever
+    expiry = None
+    # lua scripts that have been loaded into redis, by source
+    scripts = {}
+
+    def get_script(self, source):  # pylint: disable=no-self-use
+        """load a lua script into redis the first time it's used, returns None if
+        the server doesn't allow scripting"""
+        if source not in RedisStore.scripts:
+            try:
+                script = r.register_script(source)
+                script.sha = r.script_load(source)
+            except redis.exceptions.ResponseError as err:
+                logger.warning("Unable to load redis script, using pipeline: %s", err)
+                script = None
+            RedisStore.scripts[source] = script
+        return RedisStore.scripts[source]
 
     def get_value(self, obj):
         """the object and rank"""
         return {obj.id: self.get_rank(obj)}
 
-    def add_object_to_related_stores(self, obj, execute=True):
+    def get_substore_names(self, obj=None):  # pylint: disable=no-self-use
+        """names of stores that hold a subset of each store's objects, alongside
+        it. Given an object, only the substores that the object belongs in"""
+        # pylint: disable=unused-argument
+        return []
+
+    def get_keys(self, store, names):  # pylint: disable=no-self-use
+        """a store and the given substores"""
+        return [store] + [f"{store}-{name}" for name in names]
+
+    def index_object(self, pipeline, obj, stores):  # pylint: disable=no-self-use
+        """record which stores an object was added to, for stores that keep an
+        index so that objects can be removed without working out their stores"""
+        # pylint: disable=unused-argument
+        return
+
+    def add_object_to_related_stores(self, obj, stores=None, execute=True):
         """add an object to all suitable stores"""
         value = self.get_value(obj)
+        stores = self.get_stores_for_object(obj) if stores is None else stores
         # we want to do this as a bulk operation, hence "pipeline"
+        substores = self.get_substore_names(obj)
         pipeline = r.pipeline()
-        for store in self.get_stores_for_object(obj):
-            # add the status to the feed
-            pipeline.zadd(store, value)
-            # trim the store
-            if self.max_length:
-                pipeline.zremrangebyrank(store, 0, -1 * self.max_length)
+        for store in stores:
+            for key in self.get_keys(store, substores):
+                # add the status to the feed
+                pipeline.zadd(key, value)
+                # trim the store
+                if self.max_length:
+                    pipeline.zremrangebyrank(key, 0, -1 * self.max_length)
+                if self.expiry:
+                    pipeline.expire(key, self.expiry)
+            flush_pipeline(pipeline)
         if not execute:
             return pipeline
         # and go!
@@ -40,27 +88,48 @@ class RedisStore(ABC):
         else:
             obj_id = obj.id
         stores = self.get_stores_for_object(obj) if stores is None else stores
+        substores = self.get_substore_names()
         pipeline = r.pipeline()
         for store in stores:
-            pipeline.zrem(store, -1, obj_id)
+            for key in self.get_keys(store, substores):
+                pipeline.zrem(key, -1, obj_id)
+            flush_pipeline(pipeline)
         pipeline.execute()
 
     def bulk_add_objects_to_store(self, objs, store):
         """add a list of objects to a given store"""
         pipeline = r.pipeline()
+        keys = {store}
         for obj in objs[: self.max_length]:
-            pipeline.zadd(store, self.get_value(obj))
-        if objs and self.max_length:
-            pipeline.zremrangebyrank(store, 0, -1 * self.max_length)
+            value = self.get_value(obj)
+            for key in self.get_keys(store, self.get_substore_names(obj)):
+                pipeline.zadd(key, value)
+                keys.add(key)
+            self.index_object(pipeline, obj, [store])
+            flush_pipeline(pipeline)
+        if objs:
+            self.trim_stores(pipeline, keys)
         pipeline.execute()
 
     def bulk_remove_objects_from_store(self, objs, store):
         """remove a list of objects from a given store"""
         pipeline = r.pipeline()
+        keys = self.get_keys(store, self.get_substore_names())
         for obj in objs[: self.max_length]:
-            pipeline.zrem(store, -1, obj.id)
+            for key in keys:
+                pipeline.zrem(key, -1, obj.id)
         pipeline.execute()
 
+    def trim_stores(self, pipeline, keys):
+        """limit the length of stores that have had objects added, and reset
+        when they expire"""
+        for key in keys:
+            if self.max_length:
+                pipeline.zremrangebyrank(key, 0, -1 * self.max_length)
+            if self.expiry:
+                pipeline.expire(key, self.expiry)
+            flush_pipeline(pipeline)
+
     def get_store(self, store, **kwargs):  # pylint: disable=no-self-use
         """load the values in a store"""
         return r.zrevrange(store, 0, -1, **kwargs)
@@ -69,13 +138,19 @@ class RedisStore(ABC):
         """go from zero to a store"""
         pipeline = r.pipeline()
         queryset = self.get_objects_for_store(store)
+        keys = {store}
 
         for obj in queryset[: self.max_length]:
-            pipeline.zadd(store, self.get_value(obj))
+            value = self.get_value(obj)
+            for key in self.get_keys(store, self.get_substore_names(obj)):
+                pipeline.zadd(key, value)
+                keys.add(key)
+            self.index_object(pipeline, obj, [store])
+            flush_pipeline(pipeline)
 
         # only trim the store if objects were added
-        if queryset.exists() and self.max_length:
-            pipeline.zremrangebyrank(store, 0, -1 * self.max_length)
+        if queryset.exists():
+            self.trim_stores(pipeline, keys)
         pipeline.execute()
 
     @abstractmethod
@@ -213,6 +213,30 @@ REDIS_ACTIVITY_URL = env(
     f"redis://:{REDIS_ACTIVITY_PASSWORD}@{REDIS_ACTIVITY_HOST}:{REDIS_ACTIVITY_PORT}/{REDIS_ACTIVITY_DB_INDEX}",
 )
 MAX_STREAM_LENGTH = int(env("MAX_STREAM_LENGTH", 200))
+# statuses with a large audience are added to streams in chunks of this many users.
+# Each chunk is written in one redis transaction, with a command per user if redis
+# allows scripts, or several per user if it doesn't, so this also limits how big
+# those transactions get
+FANOUT_CHUNK_SIZE = int(env("FANOUT_CHUNK_SIZE", 1000))
+# the most commands to buffer in a redis pipeline before sending them, except in
+# fan-out transactions, which are limited by FANOUT_CHUNK_SIZE instead
+REDIS_PIPELINE_SIZE = int(env("REDIS_PIPELINE_SIZE", 1000))
+# stop updating the streams of users who haven't loaded them in this many days,
+# and rebuild them when they come back (0 keeps every stream up to date)
+STREAM_INACTIVE_DAYS = int(env("STREAM_INACTIVE_DAYS", 0))
+# keep each user's unread counts in a single hash and cap streams at the size redis
+# can store compactly. Run migrate_stream_layout after changing this
+REDIS_COMPACT_STREAMS = env.bool("REDIS_COMPACT_STREAMS", False)
+# how many connections each worker opens to one server when delivering activities
+DELIVERY_HOST_CONCURRENCY = int(env("DELIVERY_HOST_CONCURRENCY", 4))
+# how often every host's queue is checked for deliveries that were left behind,
+# in seconds
+DELIVERY_SWEEP_INTERVAL = int(env("DELIVERY_SWEEP_INTERVAL", 5 * 60))
+# accept incoming activities straight away and check their signatures in a worker
+INBOX_FAST_ACCEPT = env.bool("INBOX_FAST_ACCEPT", False)
+# how many accepted activities can wait to be verified before new ones are turned
+# away, for each priority
+INBOX_QUEUE_MAX_LENGTH = int(env("INBOX_QUEUE_MAX_LENGTH", 10000))
 
 STREAMS = [
     {"key": "home", "name": _("Home Timeline"), "shortname": _("Home")},
@@ -224,6 +248,11 @@ STREAMS = [
 SEARCH_TIMEOUT = int(env("SEARCH_TIMEOUT", 8))
 # timeout for a query to an individual connector
 QUERY_TIMEOUT = int(env("QUERY_TIMEOUT", 5))
+# how long results from a connector are used before they're searched again
+SEARCH_CACHE_TIMEOUT = int(env("SEARCH_CACHE_TIMEOUT", 60 * 60 * 6))
+# how often books that have changed are made searchable, in seconds. New and
+# edited books can take this long to show up in local title and author search
+SEARCH_VECTOR_UPDATE_INTERVAL = int(env("SEARCH_VECTOR_UPDATE_INTERVAL", 30))
 
 # Redis cache backend
 if env("USE_DUMMY_CACHE", False):
@@ -1,4 +1,5 @@
 """ signs activitypub activities """
+from functools import lru_cache
 import hashlib
 from urllib.parse import urlparse
 import datetime
@@ -22,29 +23,46 @@ def create_key_pair():
     return private_key, public_key
 
 
+@lru_cache(maxsize=1000)
+def import_public_key(public_key):
+    """parsing keys is slow, and the same remote users send lots of activities"""
+    return RSA.import_key(public_key)
+
+
 def make_signature(method, sender, destination, date, digest=None):
     """uses a private key to sign an outgoing message"""
-    inbox_parts = urlparse(destination)
-    signature_headers = [
-        f"(request-target): {method} {inbox_parts.path}",
-        f"host: {inbox_parts.netloc}",
-        f"date: {date}",
-    ]
-    headers = "(request-target) host date"
-    if digest is not None:
-        signature_headers.append(f"digest: {digest}")
-        headers = "(request-target) host date digest"
-
-    message_to_sign = "\n".join(signature_headers)
-    signer = pkcs1_15.new(RSA.import_key(sender.key_pair.private_key))
-    signed_message = signer.sign(SHA256.new(message_to_sign.encode("utf8")))
-    signature = {
-        "keyId": f"{sender.remote_id}#main-key",
-        "algorithm": "rsa-sha256",
-        "headers": headers,
-        "signature": b64encode(signed_message).decode("utf8"),
-    }
-    return ",".join(f'{k}="{v}"' for (k, v) in signature.items())
+    return Signer(sender).sign(method, destination, date, digest=digest)
+
+
+class Signer:
+    """signs outgoing messages for a user, parsing their private key once"""
+
+    def __init__(self, sender):
+        self.key_id = f"{sender.remote_id}#main-key"
+        self.signer = pkcs1_15.new(RSA.import_key(sender.key_pair.private_key))
+
+    def sign(self, method, destination, date, digest=None):
+        """the signature header for a message"""
+        inbox_parts = urlparse(destination)
+        signature_headers = [
+            f"(request-target): {method} {inbox_parts.path}",
+            f"host: {inbox_parts.netloc}",
+            f"date: {date}",
+        ]
+        headers = "(request-target) host date"
+        if digest is not None:
+            signature_headers.append(f"digest: {digest}")
+            headers = "(request-target) host date digest"
+
+        message_to_sign = "\n".join(signature_headers)
+        signed_message = self.signer.sign(SHA256.new(message_to_sign.encode("utf8")))
+        signature = {
+            "keyId": self.key_id,
+            "algorithm": "rsa-sha256",
+            "headers": headers,
+            "signature": b64encode(signed_message).decode("utf8"),
+        }
+        return ",".join(f'{k}="{v}"' for (k, v) in signature.items())
 
 
 def make_digest(data):
@@ -96,11 +114,12 @@ class Signature:
 
         return cls(key_id, headers, signature)
 
-    def verify(self, public_key, request):
-        """verify rsa signature"""
-        if http_date_age(request.headers["date"]) > MAX_SIGNATURE_AGE:
+    def verify(self, public_key, request, received=None):
+        """verify rsa signature. The request's age is measured from when it was
+        received, as a utc datetime, if it was queued to be checked later"""
+        if http_date_age(request.headers["date"], now=received) > MAX_SIGNATURE_AGE:
             raise ValueError(f"Request too old: {request.headers['date']}")
-        public_key = RSA.import_key(public_key)
+        public_key = import_public_key(public_key)
 
         comparison_string = []
         for signed_header_name in self.headers.split(" "):
@@ -122,8 +141,8 @@ class Signature:
         signer.verify(digest, self.signature)
 
 
-def http_date_age(datestr):
+def http_date_age(datestr, now=None):
     """age of a signature in seconds"""
     parsed = datetime.datetime.strptime(datestr, "%a, %d %b %Y %H:%M:%S GMT")
-    delta = datetime.datetime.utcnow() - parsed
+    delta = (now or datetime.datetime.utcnow()) - parsed
     return delta.total_seconds()
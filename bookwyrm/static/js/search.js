@@ -0,0 +1,47 @@
+(function () {
+    "use strict";
+
+    // How often to check for new results, in milliseconds
+    const POLL_INTERVAL = 1000;
+    // Give up on connectors that haven't responded after this many checks
+    const MAX_POLLS = 30;
+
+    /**
+     * Show results from other catalogues as each one responds
+     *
+     * Use `data-search-results` on the element the results are added to, with
+     * the url to collect them from, and `data-search-loading` on anything that
+     * should be hidden once every catalogue has responded.
+     *
+     * @param  {Element} container
+     * @param  {number} polls - How many times the results have been checked
+     * @return {undefined}
+     */
+    function loadResults(container, polls) {
+        fetch(container.dataset.searchResults)
+            .then((response) => response.json())
+            .then((data) => {
+                data.results.forEach((result) => {
+                    if (container.querySelector(`[data-connector="${result.connector}"]`)) {
+                        return;
+                    }
+
+                    container.insertAdjacentHTML("beforeend", result.html);
+                });
+
+                if (data.loading && polls < MAX_POLLS) {
+                    setTimeout(() => loadResults(container, polls + 1), POLL_INTERVAL);
+
+                    return;
+                }
+
+                document.querySelectorAll("[data-search-loading]").forEach((element) => {
+                    element.classList.add("is-hidden");
+                });
+            });
+    }
+
+    document.querySelectorAll("[data-search-results]").forEach((container) => {
+        setTimeout(() => loadResults(container, 1), POLL_INTERVAL);
+    });
+})();
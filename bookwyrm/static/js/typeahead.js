@@ -0,0 +1,59 @@
+(function () {
+    "use strict";
+
+    /**
+     * Suggest books and authors from this instance as a user types
+     *
+     * Use `data-typeahead` on the input field, with a `list` attribute
+     * pointing to the datalist to fill.
+     *
+     * @example
+     * <input
+     *     type="text"
+     *     data-typeahead
+     *     list="search-suggestions"
+     * >
+     * <datalist id="search-suggestions"></datalist>
+     * @param  {Event} event
+     * @return {undefined}
+     */
+    function typeahead(event) {
+        const input = event.target;
+        const query = input.value.trim();
+
+        clearTimeout(input.typeaheadTimer);
+
+        // The server doesn't suggest anything for less than three characters
+        if (query.length < 3) {
+            return;
+        }
+
+        // Wait until the user pauses typing
+        input.typeaheadTimer = setTimeout(() => {
+            fetch("/search/typeahead.json?q=" + encodeURIComponent(query))
+                .then((response) => response.json())
+                .then((data) => showSuggestions(input, data));
+        }, 200);
+    }
+
+    function showSuggestions(input, data) {
+        const suggestionsBox = document.getElementById(input.getAttribute("list"));
+
+        // Clear existing suggestions
+        suggestionsBox.innerHTML = "";
+
+        data.books
+            .map((book) => book.title)
+            .concat(data.authors.map((author) => author.name))
+            .forEach((suggestion) => {
+                const suggestionItem = document.createElement("option");
+
+                suggestionItem.value = suggestion;
+                suggestionsBox.appendChild(suggestionItem);
+            });
+    }
+
+    document.querySelectorAll("[data-typeahead]").forEach((input) => {
+        input.addEventListener("input", typeahead);
+    });
+})();
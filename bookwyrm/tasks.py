@@ -16,3 +16,7 @@ MEDIUM = "medium_priority"
 HIGH = "high_priority"
 # import items get their own queue because they're such a pain in the ass
 IMPORTS = "imports"
+# searches of remote connectors can be slow, so they don't hold up other tasks
+SEARCH = "search"
+# and so can sending activities to other servers
+DELIVERY = "delivery"
@@ -5,6 +5,8 @@ import pathlib
 from unittest.mock import patch
 
 from dataclasses import dataclass
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError
 from django.test import TestCase
 from PIL import Image
 import responses
@@ -12,14 +14,21 @@ import responses
 from bookwyrm import activitypub
 from bookwyrm.activitypub.base_activity import (
     ActivityObject,
+    create_related_items,
     resolve_remote_id,
     set_related_field,
+    set_related_fields,
+    set_related_item,
     get_representative,
+    get_resolution_stats,
+    get_field_info,
+    get_model_from_type,
 )
 from bookwyrm.activitypub import ActivitySerializerError
 from bookwyrm import models
 
 
+# pylint: disable=too-many-public-methods
 @patch("bookwyrm.activitystreams.add_status_task.delay")
 @patch("bookwyrm.suggested_users.rerank_user_task.delay")
 @patch("bookwyrm.suggested_users.remove_user_task.delay")
@@ -119,6 +128,157 @@ class BaseActivity(TestCase):
         self.assertEqual(result.remote_id, "https://example.com/user/mouse")
         self.assertEqual(result.name, "MOUSE?? MOUSE!!")
 
+    @responses.activate
+    def test_resolve_remote_id_unresolved(self, *_):
+        """don't keep trying to load something that isn't there"""
+        responses.add(responses.GET, "https://example.com/user/rat", status=404)
+        with patch("bookwyrm.activitypub.base_activity.cache", LocMemCache("a", {})):
+            for _ in range(2):
+                result = resolve_remote_id(
+                    "https://example.com/user/rat", model=models.User
+                )
+                self.assertIsNone(result)
+            stats = get_resolution_stats()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(stats["fetches"], 1)
+        self.assertEqual(stats["unresolved_hits"], 1)
+
+    def test_resolve_remote_id_cached(self, *_):
+        """remember where a remote id was found"""
+        with patch("bookwyrm.activitypub.base_activity.cache", LocMemCache("b", {})):
+            for _ in range(2):
+                result = resolve_remote_id("http://example.com/a/b", model=models.User)
+                self.assertEqual(result, self.user)
+            # the wrong model doesn't match
+            with patch("bookwyrm.models.Status.find_existing_by_remote_id") as mock:
+                mock.return_value = None
+                with patch(
+                    "bookwyrm.activitypub.base_activity.load_remote_id"
+                ) as load_mock:
+                    resolve_remote_id("http://example.com/a/b", model=models.Status)
+                self.assertTrue(load_mock.called)
+            stats = get_resolution_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_resolve_remote_id_shared_fetch(self, *_):
+        """use the result of another worker that loaded the same remote id"""
+        cache = LocMemCache("c", {})
+        cache.set("resolve-lock-https://example.com/user/rat", 1)
+        with patch("bookwyrm.activitypub.base_activity.cache", cache), patch(
+            "bookwyrm.activitypub.base_activity.get_resolved"
+        ) as resolved_mock, patch(
+            "bookwyrm.activitypub.base_activity.load_remote_id"
+        ) as load_mock:
+            # the other worker hadn't finished when this one started
+            resolved_mock.side_effect = [None, self.user]
+            result = resolve_remote_id(
+                "https://example.com/user/rat", model=models.User
+            )
+            stats = get_resolution_stats()
+        self.assertEqual(result, self.user)
+        self.assertFalse(load_mock.called)
+        self.assertEqual(stats["shared_fetches"], 1)
+
+    def test_resolve_remote_id_shared_fetch_wait(self, *_):
+        """wait a little while for another worker that's still loading a remote id,
+        rather than loading it again"""
+        cache = LocMemCache("d", {})
+        cache.set("resolve-lock-https://example.com/user/rat", 1)
+        with patch("bookwyrm.activitypub.base_activity.cache", cache), patch(
+            "bookwyrm.activitypub.base_activity.get_resolved"
+        ) as resolved_mock, patch(
+            "bookwyrm.activitypub.base_activity.load_remote_id"
+        ) as load_mock, patch(
+            "bookwyrm.activitypub.base_activity.time.sleep"
+        ) as sleep_mock:
+            resolved_mock.side_effect = [None, None, None, self.user]
+            result = resolve_remote_id(
+                "https://example.com/user/rat", model=models.User
+            )
+        self.assertEqual(result, self.user)
+        self.assertEqual(sleep_mock.call_count, 2)
+        self.assertFalse(load_mock.called)
+
+    def test_resolve_remote_id_shared_fetch_failed(self, *_):
+        """another worker that couldn't load a remote id isn't waited for"""
+        cache = LocMemCache("f", {})
+        cache.set("resolve-lock-https://example.com/user/rat", 1)
+        with patch("bookwyrm.activitypub.base_activity.cache", cache), patch(
+            "bookwyrm.activitypub.base_activity.get_resolved", return_value=None
+        ), patch(
+            "bookwyrm.activitypub.base_activity.load_remote_id"
+        ) as load_mock, patch(
+            "bookwyrm.activitypub.base_activity.time.sleep",
+            # the other worker finishes after the first check
+            side_effect=lambda _: cache.delete(
+                "resolve-lock-https://example.com/user/rat"
+            ),
+        ) as sleep_mock:
+            result = resolve_remote_id(
+                "https://example.com/user/rat", model=models.User
+            )
+        self.assertIsNone(result)
+        self.assertEqual(sleep_mock.call_count, 1)
+        self.assertFalse(load_mock.called)
+
+    def test_resolve_remote_id_shared_fetch_no_wait(self, *_):
+        """web requests don't wait for another worker that's loading a remote id,
+        or load it again"""
+        cache = LocMemCache("g", {})
+        cache.set("resolve-lock-https://example.com/user/rat", 1)
+        with patch("bookwyrm.activitypub.base_activity.cache", cache), patch(
+            "bookwyrm.activitypub.base_activity.load_remote_id"
+        ) as load_mock, patch(
+            "bookwyrm.activitypub.base_activity.time.sleep"
+        ) as sleep_mock:
+            result = resolve_remote_id(
+                "https://example.com/user/rat", model=models.User, wait=False
+            )
+        self.assertIsNone(result)
+        self.assertFalse(load_mock.called)
+        self.assertFalse(sleep_mock.called)
+
+    @responses.activate
+    def test_resolve_remote_id_server_error(self, *_):
+        """errors that might not last don't stop the remote id being loaded again"""
+        for status in [429, 500, 502]:
+            responses.add(responses.GET, "https://example.com/user/rat", status=status)
+        with patch("bookwyrm.activitypub.base_activity.cache", LocMemCache("e", {})):
+            for _ in range(3):
+                result = resolve_remote_id(
+                    "https://example.com/user/rat", model=models.User
+                )
+                self.assertIsNone(result)
+        self.assertEqual(len(responses.calls), 3)
+
+    def test_get_model_from_type(self, *_):
+        """find the model that stores an activity type"""
+        self.assertEqual(get_model_from_type("Person"), models.User)
+        self.assertEqual(get_model_from_type("Review"), models.Review)
+        with self.assertRaises(ActivitySerializerError):
+            get_model_from_type("Fish")
+
+    def test_get_field_info(self, *_):
+        """the fields of an activity dataclass are only read once"""
+        field_info = get_field_info(activitypub.Create)
+        self.assertIs(field_info, get_field_info(activitypub.Create))
+        fields_by_name = {info[0]: info for info in field_info}
+        # the object is another activity, and required
+        self.assertTrue(fields_by_name["object"][2])
+        self.assertTrue(fields_by_name["object"][4])
+        # the type has a default
+        self.assertFalse(fields_by_name["type"][4])
+        self.assertEqual(fields_by_name["type"][3], "Create")
+
+    def test_parse_corpus(self, *_):
+        """the activities the parse benchmark uses are all parsable"""
+        datafile = pathlib.Path(__file__).parent.joinpath("../data/ap_activities.json")
+        activities = json.loads(datafile.read_bytes())
+        for activity in activities:
+            parsed = activitypub.parse(activity)
+            self.assertEqual(parsed.type, activity["type"])
+
     def test_to_model_invalid_model(self, *_):
         """catch mismatch between activity type and model type"""
         instance = ActivityObject(id="a", type="b")
@@ -222,7 +382,7 @@ class BaseActivity(TestCase):
         )
 
         # sets the celery task call to the function call
-        with patch("bookwyrm.activitypub.base_activity.set_related_field.delay"):
+        with patch("bookwyrm.activitypub.base_activity.set_related_fields.delay"):
             with patch("bookwyrm.models.status.Status.ignore_activity") as discarder:
                 discarder.return_value = False
                 update_data.to_model(model=models.Status, instance=status)
@@ -251,3 +411,110 @@ class BaseActivity(TestCase):
 
         self.assertIsInstance(status.attachments.first(), models.Image)
         self.assertIsNotNone(status.attachments.first().image)
+        # it's created without its save signals, which usually set this
+        self.assertEqual(
+            status.attachments.first().remote_id,
+            status.attachments.first().get_remote_id(),
+        )
+
+    def test_create_related_items(self, *_):
+        """new attachments are given a remote id, unless they came with one"""
+        with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
+            status = models.Status.objects.create(content="hi", user=self.user)
+        federated = models.Image(
+            status=status, remote_id="https://example.com/image/1", caption="a"
+        )
+        local = models.Image(status=status, caption="b")
+
+        create_related_items(models.Image, [federated, local])
+
+        federated.refresh_from_db()
+        local.refresh_from_db()
+        self.assertEqual(federated.remote_id, "https://example.com/image/1")
+        self.assertEqual(local.remote_id, local.get_remote_id())
+
+    def test_set_related_fields(self, *_):
+        """load a work's editions, only fetching the ones that aren't here yet"""
+        work = models.Work.objects.create(
+            title="Test Work", remote_id="https://example.com/book/1"
+        )
+        existing = models.Edition.objects.create(
+            title="Existing Edition", remote_id="https://example.com/book/2"
+        )
+        edition_data = {
+            "id": "https://example.com/book/3",
+            "type": "Edition",
+            "title": "Loaded Edition",
+            "work": "https://example.com/book/1",
+        }
+        with patch(
+            "bookwyrm.activitypub.base_activity.get_all_data"
+        ) as get_data_mock, patch(
+            "bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"
+        ), patch(
+            "bookwyrm.models.identifier.update_identifiers"
+        ) as identifiers_mock:
+            get_data_mock.return_value = {"https://example.com/book/3": edition_data}
+            set_related_fields(
+                "Edition",
+                "Work",
+                "parent_work",
+                work.remote_id,
+                [
+                    "https://example.com/book/2",
+                    "https://example.com/book/3",
+                    "https://example.com/book/4",
+                ],
+            )
+        get_data_mock.assert_called_once_with(
+            ["https://example.com/book/3", "https://example.com/book/4"]
+        )
+        existing.refresh_from_db()
+        self.assertEqual(existing.parent_work, work)
+        # the existing edition is saved, so its signals run
+        self.assertIn(
+            existing, [call[0][0] for call in identifiers_mock.call_args_list]
+        )
+        self.assertEqual(work.editions.count(), 2)
+        self.assertTrue(work.editions.filter(title="Loaded Edition").exists())
+
+    def test_set_related_fields_error(self, *_):
+        """one item that can't be saved doesn't stop the rest from loading"""
+        work = models.Work.objects.create(
+            title="Test Work", remote_id="https://example.com/book/1"
+        )
+        items = [
+            {
+                "id": f"https://example.com/book/{i}",
+                "type": "Edition",
+                "title": title,
+                "work": "https://example.com/book/1",
+            }
+            for (i, title) in [(2, "First Edition"), (3, "Bad"), (4, "Last Edition")]
+        ]
+
+        def save_item(model, model_field, related_field_name, instance, data):
+            """fail part way through saving one of the editions"""
+            if data["title"] == "Bad":
+                models.Edition.objects.create(title="Bad", parent_work=instance)
+                raise IntegrityError()
+            return set_related_item(
+                model, model_field, related_field_name, instance, data
+            )
+
+        with patch(
+            "bookwyrm.activitypub.base_activity.set_related_item", save_item
+        ), patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
+            set_related_fields("Edition", "Work", "parent_work", work.remote_id, items)
+
+        self.assertEqual(
+            set(work.editions.values_list("title", flat=True)),
+            {"First Edition", "Last Edition"},
+        )
+
+    def test_set_related_fields_invalid_origin(self, *_):
+        """the origin has to exist"""
+        with self.assertRaises(ValueError):
+            set_related_fields(
+                "Image", "Status", "status", "https://example.com/status/1", []
+            )
@@ -3,10 +3,12 @@ from datetime import datetime
 from unittest.mock import patch
 from django.test import TestCase
 from django.utils import timezone
+import redis
 
 from bookwyrm import activitystreams, models
 
 
+# pylint: disable=too-many-public-methods
 @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
 @patch("bookwyrm.activitystreams.add_status_task.delay")
 @patch("bookwyrm.activitystreams.add_book_statuses_task.delay")
@@ -68,6 +70,58 @@ class Activitystreams(TestCase):
             f"{self.local_user.id}-test-unread-by-type",
         )
 
+    def test_compact_ids(self, *_):
+        """unread counts for every stream share one hash in the compact layout"""
+        with patch.object(self.test_stream, "compact", True):
+            self.assertEqual(
+                self.test_stream.unread_id(self.local_user),
+                f"{self.local_user.id}-unread",
+            )
+            self.assertEqual(
+                self.test_stream.unread_by_status_type_id(self.local_user.id),
+                f"{self.local_user.id}-unread",
+            )
+            self.assertEqual(self.test_stream.unread_field(), "test")
+            self.assertEqual(
+                self.test_stream.unread_by_status_type_field("review"), "test-review"
+            )
+            self.assertEqual(self.test_stream.max_length, 128)
+
+    def test_get_unread_count_compact(self, *_):
+        """read this stream's counts out of the shared hash"""
+        with patch.object(self.test_stream, "compact", True), patch(
+            "bookwyrm.activitystreams.r.hget", return_value=b"3"
+        ) as hget_mock, patch("bookwyrm.activitystreams.r.hgetall") as hgetall_mock:
+            hgetall_mock.return_value = {
+                b"test": b"3",
+                b"test-review": b"2",
+                b"test-comment": b"1",
+                b"home-review": b"5",
+            }
+            self.assertEqual(self.test_stream.get_unread_count(self.local_user), 3)
+            self.assertEqual(
+                self.test_stream.get_unread_count_by_status_type(self.local_user),
+                {"review": 2, "comment": 1},
+            )
+        self.assertEqual(
+            hget_mock.call_args[0], (f"{self.local_user.id}-unread", "test")
+        )
+
+    def test_clear_unread_compact(self, *_):
+        """only this stream's counts are cleared"""
+        with patch.object(self.test_stream, "compact", True), patch(
+            "bookwyrm.activitystreams.r.hgetall",
+            return_value={b"test": b"3", b"test-review": b"3", b"home-review": b"5"},
+        ), patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            self.test_stream.clear_unread(self.local_user)
+        pipeline = redis_mock.return_value
+        self.assertEqual(
+            pipeline.hset.call_args[0], (f"{self.local_user.id}-unread", "test", 0)
+        )
+        self.assertEqual(
+            pipeline.hdel.call_args[0], (f"{self.local_user.id}-unread", "test-review")
+        )
+
     def test_get_rank(self, *_):
         """sort order"""
         date = datetime(2022, 1, 28, 0, 0, tzinfo=timezone.utc)
@@ -82,33 +136,23 @@ class Activitystreams(TestCase):
             "1643328000.0",
         )
 
-    def test_get_activity_stream(self, *_):
-        """load statuses"""
-        status = models.Status.objects.create(
-            user=self.remote_user,
-            content="hi",
-            privacy="direct",
-        )
-        status2 = models.Comment.objects.create(
-            user=self.remote_user,
-            content="hi",
-            privacy="direct",
-            book=self.book,
+    def test_stream_statuses_filter(self, *_):
+        """the statuses in a stream can be filtered like a queryset"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        comment = models.Comment.objects.create(
+            user=self.remote_user, content="hi", book=self.book
         )
         models.Comment.objects.create(
-            user=self.remote_user,
-            content="hi",
-            privacy="direct",
-            book=self.book,
+            user=self.remote_user, content="hi", book=self.book
         )
-        with patch("bookwyrm.activitystreams.r.set"), patch(
-            "bookwyrm.activitystreams.r.delete"
-        ), patch("bookwyrm.activitystreams.ActivityStream.get_store") as redis_mock:
-            redis_mock.return_value = [status.id, status2.id]
-            result = self.test_stream.get_activity_stream(self.local_user)
-        self.assertEqual(result.count(), 2)
-        self.assertEqual(result.first(), status2)
-        self.assertEqual(result.last(), status)
+        statuses = activitystreams.StreamStatuses(f"{self.local_user.id}-test")
+        with patch("bookwyrm.activitystreams.r.zrevrange") as redis_mock:
+            redis_mock.return_value = [
+                str(comment.id).encode(),
+                str(status.id).encode(),
+            ]
+            result = statuses.filter(comment__isnull=False)
+        self.assertEqual(list(result), [comment])
         self.assertIsInstance(result.first(), models.Comment)
 
     def test_abstractstream_get_audience(self, *_):
@@ -196,3 +240,643 @@ class Activitystreams(TestCase):
         self.assertFalse(self.local_user in users)
         self.assertFalse(self.another_user in users)
         self.assertFalse(self.remote_user in users)
+
+    def test_audience_sets_populate(self, *_):
+        """the sets are sent in batches, and only used once they're all built"""
+        with patch("bookwyrm.activitystreams.r") as redis_mock, patch(
+            "bookwyrm.activitystreams.flush_pipeline"
+        ) as flush_mock:
+            redis_mock.scan_iter.return_value = []
+            activitystreams.audience_sets.populate()
+        pipeline = redis_mock.pipeline.return_value
+        self.assertEqual(flush_mock.call_count, pipeline.sadd.call_count)
+        pipeline.sadd.assert_any_call("audience-local-users", self.local_user.id)
+        redis_mock.delete.assert_called_once_with("audience-sets-ready")
+        pipeline.set.assert_called_once_with("audience-sets-ready", 1)
+
+    @patch("bookwyrm.activitystreams.AudienceSets.is_ready", return_value=False)
+    def test_get_audience_ids_from_database(self, *_):
+        """fall back to the database if the relationship sets aren't built"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        self.assertEqual(
+            self.test_stream.get_audience_ids(status),
+            {self.local_user.id, self.another_user.id},
+        )
+
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="direct"
+        )
+        self.assertEqual(self.test_stream.get_audience_ids(status), set())
+
+    @patch("bookwyrm.activitystreams.AudienceSets.is_ready", return_value=True)
+    def test_get_audience_ids_from_sets(self, *_):
+        """public statuses go to everyone who can see the author"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch("bookwyrm.activitystreams.AudienceSets.get_visible_users") as mock:
+            mock.return_value = {self.local_user.id}
+            result = self.test_stream.get_audience_ids(status)
+        self.assertEqual(result, {self.local_user.id})
+        self.assertEqual(mock.call_args[0][0], self.remote_user.id)
+
+    @patch("bookwyrm.activitystreams.AudienceSets.is_ready", return_value=True)
+    def test_get_audience_ids_from_sets_direct(self, *_):
+        """direct statuses are filtered down to mentioned users"""
+        status = models.Comment.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="direct",
+            book=self.book,
+        )
+        status.mention_users.add(self.local_user)
+        with patch("bookwyrm.activitystreams.AudienceSets.filter_visible") as mock:
+            mock.return_value = {self.local_user.id}
+            result = self.test_stream.get_audience_ids(status)
+        self.assertEqual(result, {self.local_user.id})
+        self.assertEqual(
+            mock.call_args[0][1], {self.remote_user.id, self.local_user.id}
+        )
+
+    def test_add_status(self, *_):
+        """statuses are added to each audience member's stream"""
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_audience_ids"
+        ) as audience_mock, patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script", return_value=None
+        ), patch(
+            "bookwyrm.redis_store.r.pipeline"
+        ) as redis_mock:
+            audience_mock.return_value = {self.another_user.id}
+            pipeline = redis_mock.return_value.__enter__.return_value
+            pipeline.hexists.return_value = False
+            self.test_stream.add_status(status, increment_unread=True)
+        pipeline.watch.assert_called_once_with(f"{status.id}-test-fanout")
+        self.assertEqual(pipeline.zadd.call_args[0][0], f"{self.another_user.id}-test")
+        self.assertEqual(
+            pipeline.incr.call_args[0][0], f"{self.another_user.id}-test-unread"
+        )
+        self.assertEqual(pipeline.hset.call_args[0][0], f"{status.id}-test-fanout")
+        self.assertEqual(
+            pipeline.sadd.call_args[0],
+            (f"{status.id}-test-streams", 0, self.another_user.id),
+        )
+        self.assertTrue(pipeline.execute.called)
+
+    def test_add_status_no_audience(self, *_):
+        """a status that isn't added to any streams is still indexed"""
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="direct"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_audience_ids",
+            return_value=set(),
+        ), patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            self.test_stream.add_status(status)
+        pipeline = redis_mock.return_value
+        pipeline.sadd.assert_called_once_with(f"{status.id}-test-streams", 0)
+        self.assertFalse(pipeline.zadd.called)
+        self.assertTrue(pipeline.execute.called)
+
+        # so there's no need to find its audience to remove it
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.remove_object_from_related_stores"
+        ) as fallback_mock, patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.return_value = [{b"0"}]
+            activitystreams.remove_status_task(status.id)
+        self.assertFalse(fallback_mock.called)
+        self.assertFalse(redis_mock.return_value.zrem.called)
+
+    def test_add_status_chunked(self, *_):
+        """large audiences are split up into separate tasks"""
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_audience_ids"
+        ) as audience_mock, patch(
+            "bookwyrm.activitystreams.settings.FANOUT_CHUNK_SIZE", 1
+        ), patch(
+            "bookwyrm.activitystreams.add_status_chunk_task.apply_async"
+        ) as task_mock:
+            audience_mock.return_value = {self.local_user.id, self.another_user.id}
+            self.test_stream.add_status(status, increment_unread=True)
+        self.assertEqual(task_mock.call_count, 2)
+        self.assertEqual(
+            task_mock.call_args_list[0][1]["args"],
+            ("test", status.id, [self.local_user.id], 0),
+        )
+        self.assertEqual(
+            task_mock.call_args_list[1][1]["args"],
+            ("test", status.id, [self.another_user.id], 1),
+        )
+
+    def test_add_status_to_users_repeated_chunk(self, *_):
+        """running a chunk again doesn't add to the unread count"""
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script", return_value=None
+        ), patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            pipeline = redis_mock.return_value.__enter__.return_value
+            pipeline.hexists.return_value = True
+            self.test_stream.add_status_to_users(
+                status, [self.another_user.id], increment_unread=True, chunk=3
+            )
+        pipeline.hexists.assert_called_once_with(f"{status.id}-test-fanout", 3)
+        self.assertTrue(pipeline.zadd.called)
+        self.assertFalse(pipeline.incr.called)
+        self.assertEqual(pipeline.hset.call_args[0][1], 3)
+
+    def test_add_status_to_users_race(self, *_):
+        """a chunk that another worker finished first isn't counted twice"""
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script", return_value=None
+        ), patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            pipeline = redis_mock.return_value.__enter__.return_value
+            pipeline.hexists.side_effect = [False, True]
+            pipeline.execute.side_effect = [redis.WatchError, []]
+            self.test_stream.add_status_to_users(
+                status, [self.another_user.id], increment_unread=True
+            )
+        self.assertEqual(pipeline.execute.call_count, 2)
+        # only the first, failed, attempt counted it as unread
+        self.assertEqual(pipeline.incr.call_count, 1)
+
+    def test_add_status_to_users_script(self, *_):
+        """the lua script does all the writes for each user"""
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script"
+        ) as script_mock, patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            self.test_stream.add_status_to_users(
+                status, [self.another_user.id], increment_unread=True
+            )
+        script = script_mock.return_value
+        self.assertEqual(script.call_count, 1)
+        kwargs = script.call_args[1]
+        self.assertEqual(
+            kwargs["keys"],
+            [
+                f"{self.another_user.id}-test",
+                f"{self.another_user.id}-test-unread",
+                f"{self.another_user.id}-test-unread-by-type",
+                # notes don't have a substream
+                f"{self.another_user.id}-test",
+                f"{status.id}-test-fanout",
+            ],
+        )
+        self.assertEqual(
+            kwargs["args"][1:],
+            [
+                status.id,
+                200,
+                "note",
+                1,
+                0,
+                "",
+                "-test-streams",
+                self.another_user.id,
+                0,
+            ],
+        )
+        self.assertEqual(kwargs["client"], redis_mock.return_value)
+        # the chunk is marked as done in the same transaction
+        pipeline = redis_mock.return_value
+        pipeline.hset.assert_called_once_with(f"{status.id}-test-fanout", 0, 1)
+        self.assertEqual(pipeline.execute.call_count, 1)
+
+    def test_get_stream_statuses(self, *_):
+        """only the requested page of statuses is loaded"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        status2 = models.Comment.objects.create(
+            user=self.remote_user, content="hi", privacy="public", book=self.book
+        )
+        with patch("bookwyrm.activitystreams.r.set"), patch(
+            "bookwyrm.activitystreams.r.delete"
+        ):
+            result = self.test_stream.get_stream_statuses(self.local_user)
+
+        with patch("bookwyrm.activitystreams.r.zrevrange") as redis_mock:
+            redis_mock.return_value = [str(status2.id).encode(), str(status.id)]
+            page = result[15:30]
+        self.assertEqual(
+            redis_mock.call_args[0], (f"{self.local_user.id}-test", 15, 29)
+        )
+        self.assertEqual(page, [status2, status])
+        self.assertIsInstance(page[0], models.Comment)
+
+        with patch("bookwyrm.activitystreams.r.zcard", return_value=2):
+            self.assertEqual(result.count(), 2)
+
+    def test_get_statuses_cached(self, *_):
+        """statuses that are already in the cache aren't queried"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        status2 = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch("bookwyrm.activitystreams.cache") as cache_mock:
+            cache_mock.get_many.return_value = {
+                activitystreams.status_cache_key(status.id): status
+            }
+            result = activitystreams.get_statuses([status2.id, status.id])
+        self.assertEqual(result, [status2, status])
+        cache_mock.set_many.assert_called_once_with(
+            {activitystreams.status_cache_key(status2.id): status2},
+            timeout=activitystreams.STATUS_CACHE_TIMEOUT,
+        )
+
+    def test_get_stream_statuses_filtered(self, *_):
+        """filtered feeds are the stream without the substreams for the types
+        that aren't allowed"""
+        with patch("bookwyrm.activitystreams.r.set"), patch(
+            "bookwyrm.activitystreams.r.delete"
+        ), patch("bookwyrm.activitystreams.r.exists", return_value=0), patch(
+            "bookwyrm.activitystreams.r.pipeline"
+        ) as redis_mock:
+            result = self.test_stream.get_stream_statuses(
+                self.local_user, allowed_types=["review", "everything"]
+            )
+        store = f"{self.local_user.id}-test-without-comment-quotation"
+        self.assertEqual(result.store, store)
+        pipeline = redis_mock.return_value
+        pipeline.zunionstore.assert_called_once_with(
+            store,
+            {
+                f"{self.local_user.id}-test": 1,
+                f"{self.local_user.id}-test-comment": 0,
+                f"{self.local_user.id}-test-quotation": 0,
+            },
+            aggregate="MIN",
+        )
+        pipeline.zremrangebyscore.assert_called_once_with(store, "-inf", 0)
+
+    def test_get_stream_statuses_filtered_cached(self, *_):
+        """a filtered feed that was built recently is used again"""
+        with patch("bookwyrm.activitystreams.r.set"), patch(
+            "bookwyrm.activitystreams.r.delete"
+        ), patch("bookwyrm.activitystreams.r.exists", return_value=1), patch(
+            "bookwyrm.activitystreams.r.pipeline"
+        ) as redis_mock:
+            result = self.test_stream.get_stream_statuses(
+                self.local_user, allowed_types=["review"]
+            )
+        self.assertEqual(
+            result.store,
+            f"{self.local_user.id}-test-without-comment-quotation-everything",
+        )
+        self.assertFalse(redis_mock.return_value.zunionstore.called)
+
+    def test_get_feed_filter_type(self, *_):
+        """each status goes in the substream for the feed filter that shows it"""
+        statuses = [
+            (
+                models.Status.objects.create(user=self.remote_user, content="hi"),
+                "other",
+            ),
+            (
+                models.GeneratedNote.objects.create(
+                    user=self.remote_user, content="hi"
+                ),
+                "everything",
+            ),
+            (
+                models.Comment.objects.create(
+                    user=self.remote_user, content="hi", book=self.book
+                ),
+                "comment",
+            ),
+            (
+                models.Quotation.objects.create(
+                    user=self.remote_user, content="hi", quote="hi", book=self.book
+                ),
+                "quotation",
+            ),
+            (
+                models.Review.objects.create(
+                    user=self.remote_user, content="hi", book=self.book
+                ),
+                "review",
+            ),
+            (
+                models.ReviewRating.objects.create(
+                    user=self.remote_user, rating=3, book=self.book
+                ),
+                "review",
+            ),
+        ]
+        with patch("bookwyrm.activitystreams.handle_boost_task.delay"):
+            for (status, filter_type) in statuses[:]:
+                boost = models.Boost.objects.create(
+                    user=self.another_user, boosted_status=status
+                )
+                statuses.append((boost, filter_type))
+        loaded = {
+            status.id: status
+            for status in models.Status.objects.select_subclasses().filter(
+                id__in=[s.id for (s, _) in statuses]
+            )
+        }
+
+        for (status, filter_type) in statuses:
+            self.assertEqual(
+                activitystreams.get_feed_filter_type(loaded[status.id]), filter_type
+            )
+            # statuses that aren't loaded as their subclass are looked up
+            self.assertEqual(
+                activitystreams.get_feed_filter_type(
+                    models.Status.objects.get(id=status.id)
+                ),
+                filter_type,
+            )
+
+    def test_get_feed_filter_type_boost(self, *_):
+        """a boosted status is loaded as its subclass in one query"""
+        review = models.Review.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        with patch("bookwyrm.activitystreams.handle_boost_task.delay"):
+            boost = models.Boost.objects.create(
+                user=self.another_user, boosted_status=review
+            )
+        boost = models.Status.objects.select_subclasses().get(id=boost.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(activitystreams.get_feed_filter_type(boost), "review")
+
+        boosts = list(models.Status.objects.select_subclasses().filter(id=boost.id))
+        with self.assertNumQueries(1):
+            activitystreams.load_boosted_statuses(boosts)
+        with self.assertNumQueries(0):
+            self.assertEqual(activitystreams.get_feed_filter_type(boosts[0]), "review")
+
+    def test_bulk_add_statuses(self, *_):
+        """a batch of statuses goes into each audience member's stream"""
+        status = models.Review.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_audience_ids",
+            return_value={self.local_user.id, self.another_user.id},
+        ), patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script", return_value=None
+        ), patch(
+            "bookwyrm.redis_store.r.pipeline"
+        ) as redis_mock:
+            added = self.test_stream.bulk_add_statuses([status])
+        self.assertEqual(added, {self.local_user.id: 1, self.another_user.id: 1})
+        pipeline = redis_mock.return_value
+        self.assertEqual(
+            {call[0][0] for call in pipeline.zadd.call_args_list},
+            {
+                f"{self.local_user.id}-test",
+                f"{self.local_user.id}-test-review",
+                f"{self.another_user.id}-test",
+                f"{self.another_user.id}-test-review",
+            },
+        )
+        self.assertEqual(pipeline.zremrangebyrank.call_count, 4)
+        self.assertTrue(pipeline.execute.called)
+
+    def test_bulk_add_statuses_skip(self, *_):
+        """users whose streams are full are skipped"""
+        status = models.Review.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_audience_ids",
+            return_value={self.local_user.id, self.another_user.id},
+        ), patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script", return_value=None
+        ), patch(
+            "bookwyrm.redis_store.r.pipeline"
+        ) as redis_mock:
+            added = self.test_stream.bulk_add_statuses(
+                [status], skip_user_ids={self.local_user.id}
+            )
+        self.assertEqual(added, {self.another_user.id: 1})
+        pipeline = redis_mock.return_value
+        self.assertEqual(
+            pipeline.sadd.call_args[0],
+            (f"{status.id}-test-streams", 0, self.another_user.id),
+        )
+
+    def test_trim_stores_script(self, *_):
+        """substreams are trimmed by the script, which keeps the index up to date"""
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script"
+        ) as script_mock, patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            pipeline = redis_mock.return_value
+            self.test_stream.trim_stores(
+                pipeline,
+                {f"{self.local_user.id}-test", f"{self.local_user.id}-test-review"},
+            )
+        script = script_mock.return_value
+        script.assert_called_once_with(
+            keys=[f"{self.local_user.id}-test-review"],
+            args=[200, "-test-streams", self.local_user.id],
+            client=pipeline,
+        )
+        pipeline.zremrangebyrank.assert_called_once_with(
+            f"{self.local_user.id}-test", 0, -200
+        )
+
+    @patch("bookwyrm.activitystreams.AudienceSets.is_ready", return_value=True)
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_get_audience_ids_inactive(self, *_):
+        """statuses aren't added to streams that nobody is reading"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.AudienceSets.get_visible_users",
+            return_value={self.local_user.id, self.another_user.id},
+        ), patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            scores = {
+                self.local_user.id: timezone.now().timestamp(),
+                self.another_user.id: None,
+            }
+            pipeline = redis_mock.return_value
+            pipeline.execute.side_effect = lambda: [
+                scores[call[0][1]] for call in pipeline.zscore.call_args_list
+            ]
+            result = self.test_stream.get_audience_ids(status)
+        self.assertEqual(result, {self.local_user.id})
+        # only the audience's scores are looked up
+        self.assertEqual(
+            {call[0] for call in pipeline.zscore.call_args_list},
+            {
+                ("test-readers", self.local_user.id),
+                ("test-readers", self.another_user.id),
+            },
+        )
+
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_get_stream_statuses_active(self, *_):
+        """a stream that's been read recently is loaded from redis"""
+        with patch("bookwyrm.activitystreams.r.set"), patch(
+            "bookwyrm.activitystreams.r.delete"
+        ), patch("bookwyrm.activitystreams.r.pipeline") as redis_mock, patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ) as task_mock:
+            redis_mock.return_value.execute.return_value = [
+                timezone.now().timestamp(),
+                0,
+                1,
+            ]
+            result = self.test_stream.get_stream_statuses(self.local_user)
+        self.assertIsInstance(result, activitystreams.StreamStatuses)
+        self.assertFalse(task_mock.called)
+        pipeline = redis_mock.return_value
+        self.assertEqual(pipeline.zadd.call_args[0][0], "test-readers")
+        self.assertEqual(pipeline.expire.call_args_list[0][0][1], 91 * 60 * 60 * 24)
+
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_get_stream_statuses_inactive(self, *_):
+        """a stale stream is rebuilt, and the database is used in the meantime"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        review = models.Review.objects.create(
+            user=self.remote_user, content="hi", privacy="public", book=self.book
+        )
+        models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="direct"
+        )
+        with patch("bookwyrm.activitystreams.r.set") as set_mock, patch(
+            "bookwyrm.activitystreams.r.delete"
+        ), patch("bookwyrm.activitystreams.r.pipeline") as redis_mock, patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ) as task_mock:
+            redis_mock.return_value.execute.return_value = [None, 0, 1]
+            result = self.test_stream.get_stream_statuses(self.local_user)
+            filtered = self.test_stream.get_stream_statuses(
+                self.local_user, allowed_types=["comment"]
+            )
+        self.assertEqual(task_mock.call_args[0], ("test", self.local_user.id))
+        self.assertEqual(
+            set_mock.call_args[0], (f"{self.local_user.id}-test-rebuilding", 1)
+        )
+        self.assertEqual(list(result), [review, status])
+        self.assertIsInstance(result[0], models.Review)
+        self.assertEqual(list(filtered), [status])
+
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_get_stream_statuses_rebuilding(self, *_):
+        """the database is used until the stream has been rebuilt"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock, patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ) as task_mock:
+            # the user has loaded the stream since it went stale, but it's not ready
+            redis_mock.return_value.execute.return_value = [
+                timezone.now().timestamp(),
+                1,
+                0,
+            ]
+            result = self.test_stream.get_stream_statuses(self.local_user)
+        self.assertFalse(task_mock.called)
+        self.assertEqual(list(result), [status])
+
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_get_stream_statuses_rebuild_failed(self, *_):
+        """a stream whose rebuild never finished is rebuilt again, even though the
+        user has loaded it since"""
+        with patch("bookwyrm.activitystreams.r.set"), patch(
+            "bookwyrm.activitystreams.r.delete"
+        ), patch("bookwyrm.activitystreams.r.pipeline") as redis_mock, patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ) as task_mock:
+            # the rebuilding marker has expired, and the stream was never built
+            redis_mock.return_value.execute.return_value = [
+                timezone.now().timestamp(),
+                0,
+                0,
+            ]
+            result = self.test_stream.get_stream_statuses(self.local_user)
+        self.assertEqual(task_mock.call_args[0], ("test", self.local_user.id))
+        self.assertNotIsInstance(result, activitystreams.StreamStatuses)
+
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_populate_streams_rebuilding(self, *_):
+        """the stream is read from redis again once it's been rebuilt"""
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock, patch.object(
+            self.test_stream, "populate_store"
+        ):
+            self.test_stream.populate_streams(self.local_user)
+        pipeline = redis_mock.return_value
+        pipeline.set.assert_called_once_with(
+            f"{self.local_user.id}-test-built", 1, ex=91 * 60 * 60 * 24
+        )
+        pipeline.delete.assert_called_once_with(f"{self.local_user.id}-test-rebuilding")
+        self.assertEqual(pipeline.zadd.call_args[0][0], "test-readers")
+
+    def test_remove_statuses(self, *_):
+        """statuses are removed from the streams in their index"""
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.return_value = [
+                {b"0", str(self.local_user.id).encode()},
+                set(),
+            ]
+            incomplete = self.test_stream.remove_statuses([5, 6])
+        self.assertEqual(incomplete, [6])
+        pipeline = redis_mock.return_value
+        self.assertEqual(
+            [call[0][0] for call in pipeline.smembers.call_args_list],
+            ["5-test-streams", "6-test-streams"],
+        )
+        self.assertEqual(
+            {call[0] for call in pipeline.zrem.call_args_list},
+            {
+                (key, 5)
+                for key in self.test_stream.get_keys(
+                    f"{self.local_user.id}-test",
+                    self.test_stream.get_substore_names(),
+                )
+            },
+        )
+        self.assertEqual(pipeline.delete.call_args[0], ("5-test-streams",))
+
+    def test_remove_statuses_incomplete(self, *_):
+        """a status that wasn't indexed when it was fanned out is removed from the
+        streams it's been indexed in since, and its audience is worked out too"""
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.return_value = [
+                {str(self.local_user.id).encode()},
+            ]
+            incomplete = self.test_stream.remove_statuses([5])
+        self.assertEqual(incomplete, [5])
+        pipeline = redis_mock.return_value
+        self.assertTrue(pipeline.zrem.called)
+        self.assertEqual(pipeline.delete.call_args[0], ("5-test-streams",))
+
+    def test_index_object(self, *_):
+        """adding a status to one user's stream doesn't make its index complete"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_script", return_value=None
+        ), patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            self.test_stream.bulk_add_objects_to_store(
+                [status], f"{self.local_user.id}-test"
+            )
+        redis_mock.return_value.sadd.assert_called_once_with(
+            f"{status.id}-test-streams", self.local_user.id
+        )
@@ -78,3 +78,40 @@ class Activitystreams(TestCase):
         self.assertEqual(queryset.count(), 1)
         self.assertTrue(status in queryset)
         self.assertEqual(args[1], f"{self.local_user.id}-books")
+
+    @patch("bookwyrm.activitystreams.audience_sets.is_ready", return_value=True)
+    def test_get_batch_audience_ids(self, *_):
+        """readers are looked up once for a batch of statuses"""
+        other_work = models.Work.objects.create(title="other work")
+        status = models.Comment.objects.create(
+            user=self.remote_user, content="hi", privacy="public", book=self.book
+        )
+        other = models.Comment.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="public",
+            book=models.Edition.objects.create(title="hi", parent_work=other_work),
+        )
+        unlisted = models.Comment.objects.create(
+            user=self.remote_user, content="hi", privacy="unlisted", book=self.book
+        )
+        models.ShelfBook.objects.create(
+            user=self.local_user,
+            shelf=self.local_user.shelf_set.first(),
+            book=self.book,
+        )
+        statuses = list(
+            models.Status.objects.select_subclasses()
+            .select_related("comment__book")
+            .prefetch_related("mention_books")
+            .filter(id__in=[status.id, other.id, unlisted.id])
+        )
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_audience_ids_from_sets",
+            return_value={self.local_user.id},
+        ), self.assertNumQueries(1):
+            audiences = activitystreams.BooksStream().get_batch_audience_ids(statuses)
+        self.assertEqual(
+            audiences,
+            {status.id: {self.local_user.id}, other.id: set(), unlisted.id: set()},
+        )
@@ -2,6 +2,7 @@
 from datetime import datetime, timedelta
 from unittest.mock import patch
 
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
 from django.utils import timezone
 
@@ -110,6 +111,15 @@ class ActivitystreamsSignals(TestCase):
         self.assertEqual(args[0], "books")
         self.assertEqual(args[1], self.local_user.id)
 
+    @patch("bookwyrm.settings.STREAM_INACTIVE_DAYS", 90)
+    def test_populate_streams_on_account_create_lazy(self, *_):
+        """streams are built when they're first loaded, not at signup"""
+        with patch("bookwyrm.activitystreams.transaction.on_commit") as mock:
+            activitystreams.populate_streams_on_account_create(
+                models.User, self.local_user, True
+            )
+        self.assertFalse(mock.called)
+
     def test_remove_statuses_on_block(self, *_):
         """don't show statuses from blocked users"""
         with patch("bookwyrm.activitystreams.remove_user_statuses_task.delay") as mock:
@@ -155,3 +165,108 @@ class ActivitystreamsSignals(TestCase):
             block.delete()
 
         self.assertEqual(mock.call_count, 0)
+
+    def test_add_follower_to_audience_sets(self, *_):
+        """local followers are tracked for fan-out"""
+        with patch("bookwyrm.activitystreams.add_user_statuses_task.delay"), patch(
+            "bookwyrm.activitystreams.AudienceSets.add_follower"
+        ) as mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                models.UserFollows.objects.create(
+                    user_subject=self.local_user,
+                    user_object=self.remote_user,
+                )
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0], (self.remote_user.id, self.local_user.id))
+
+    def test_add_block_to_audience_sets(self, *_):
+        """blocks are tracked for fan-out"""
+        with patch("bookwyrm.activitystreams.remove_user_statuses_task.delay"), patch(
+            "bookwyrm.activitystreams.AudienceSets.add_block"
+        ) as mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                models.UserBlocks.objects.create(
+                    user_subject=self.local_user,
+                    user_object=self.remote_user,
+                )
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0], (self.local_user.id, self.remote_user.id))
+
+    @patch("bookwyrm.activitystreams.add_user_statuses_task.delay")
+    def test_update_streams_on_server_block_command(self, *_):
+        """followers of users on a blocked server are updated in chunks"""
+        server = models.FederatedServer.objects.create(server_name="example.com")
+        models.User.objects.filter(id=self.remote_user.id).update(
+            federated_server=server
+        )
+        models.UserFollows.objects.create(
+            user_subject=self.local_user, user_object=self.remote_user
+        )
+
+        with patch(
+            "bookwyrm.activitystreams.bulk_remove_user_statuses_task.delay"
+        ) as mock:
+            activitystreams.update_streams_on_server_block_command(server, True)
+        self.assertEqual(
+            mock.call_args[0][0], [(self.local_user.id, self.remote_user.id)]
+        )
+
+        with patch(
+            "bookwyrm.activitystreams.bulk_add_user_statuses_task.delay"
+        ) as mock:
+            activitystreams.update_streams_on_server_block_command(server, False)
+        # every stream they were removed from
+        mock.assert_called_once_with([(self.local_user.id, self.remote_user.id)])
+
+    def test_clear_status_cache(self, *_):
+        """an edited status is loaded again once the edit is saved"""
+        status = models.Comment.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        key = activitystreams.status_cache_key(status.id)
+        cache = LocMemCache("a", {})
+        cache.set(key, status)
+        with patch("bookwyrm.activitystreams.cache", cache):
+            with self.captureOnCommitCallbacks() as callbacks:
+                status.content = "hello"
+                status.save(broadcast=False)
+            # the old version is kept until the edit is committed
+            self.assertIsNotNone(cache.get(key))
+            for callback in callbacks:
+                callback()
+        self.assertIsNone(cache.get(key))
+
+    def test_clear_status_cache_boost(self, *_):
+        """a deleted boost is loaded again, as is the status it boosted"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        with patch("bookwyrm.activitystreams.handle_boost_task.delay"):
+            boost = models.Boost.objects.create(
+                user=self.local_user, boosted_status=status
+            )
+        keys = [
+            activitystreams.status_cache_key(boost.id),
+            activitystreams.status_cache_key(status.id),
+        ]
+        cache = LocMemCache("b", {})
+        cache.set_many({key: "status" for key in keys})
+        with patch("bookwyrm.activitystreams.cache", cache), patch(
+            "bookwyrm.activitystreams.remove_status_task.delay"
+        ), patch(
+            "bookwyrm.activitystreams.add_status_task.delay"
+        ), self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            boost.delete()
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_clear_status_cache_on_mention(self, *_):
+        """mentions are cached with the status"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        key = activitystreams.status_cache_key(status.id)
+        cache = LocMemCache("c", {})
+        cache.set(key, status)
+        with patch(
+            "bookwyrm.activitystreams.cache", cache
+        ), self.captureOnCommitCallbacks(execute=True):
+            status.mention_users.add(self.local_user)
+        self.assertIsNone(cache.get(key))
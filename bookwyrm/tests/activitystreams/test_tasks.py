@@ -75,6 +75,21 @@ class Activitystreams(TestCase):
     def test_remove_status_task(self):
         """remove a status from all streams"""
         with patch(
+            "bookwyrm.activitystreams.ActivityStream.remove_statuses", return_value=[]
+        ) as index_mock, patch(
+            "bookwyrm.activitystreams.ActivityStream.remove_object_from_related_stores"
+        ) as mock:
+            activitystreams.remove_status_task(self.status.id)
+        self.assertEqual(index_mock.call_count, 3)
+        self.assertEqual(index_mock.call_args[0][0], [self.status.id])
+        self.assertFalse(mock.called)
+
+    def test_remove_status_task_not_indexed(self):
+        """work out the streams for statuses that aren't in the index"""
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.remove_statuses",
+            return_value=[self.status.id],
+        ), patch(
             "bookwyrm.activitystreams.ActivityStream.remove_object_from_related_stores"
         ) as mock:
             activitystreams.remove_status_task(self.status.id)
@@ -82,6 +97,38 @@ class Activitystreams(TestCase):
         args = mock.call_args[0]
         self.assertEqual(args[0], self.status)
 
+    def test_remove_status_task_deleted_boost(self):
+        """a deleted boost that isn't in the index is removed from the streams of
+        the audience it had"""
+        boost = {
+            "id": 12345,
+            "user_id": self.local_user.id,
+            "boosted_status_id": self.status.id,
+            "privacy": "public",
+        }
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.remove_statuses",
+            return_value=[boost["id"]],
+        ), patch(
+            "bookwyrm.activitystreams.ActivityStream.remove_object_from_related_stores"
+        ) as mock:
+            activitystreams.remove_status_task(boost["id"], deleted_boost=boost)
+        self.assertEqual(mock.call_count, 3)
+        removed = mock.call_args[0][0]
+        self.assertIsInstance(removed, models.Boost)
+        self.assertEqual(removed.id, boost["id"])
+        self.assertEqual(removed.user, self.local_user)
+
+    def test_remove_statuses(self):
+        """large removals are split into tasks"""
+        with patch("bookwyrm.activitystreams.remove_status_task.delay") as mock, patch(
+            "bookwyrm.activitystreams.settings.FANOUT_CHUNK_SIZE", 2
+        ):
+            activitystreams.remove_statuses(range(5))
+        self.assertEqual(
+            [call[0][0] for call in mock.call_args_list], [[0, 1], [2, 3], [4]]
+        )
+
     def test_add_status_task(self):
         """add a status to all streams"""
         with patch("bookwyrm.activitystreams.ActivityStream.add_status") as mock:
@@ -90,6 +137,18 @@ class Activitystreams(TestCase):
         args = mock.call_args[0]
         self.assertEqual(args[0], self.status)
 
+    def test_add_status_chunk_task(self):
+        """add a status to part of its audience"""
+        with patch("bookwyrm.activitystreams.HomeStream.add_status_to_users") as mock:
+            activitystreams.add_status_chunk_task(
+                "home", self.status.id, [self.another_user.id], 2, increment_unread=True
+            )
+        self.assertEqual(mock.call_count, 1)
+        args = mock.call_args[0]
+        self.assertEqual(args[0], self.status)
+        self.assertEqual(args[1], [self.another_user.id])
+        self.assertEqual(mock.call_args[1], {"increment_unread": True, "chunk": 2})
+
     def test_remove_user_statuses_task(self):
         """remove all statuses by a user from another users' feeds"""
         with patch(
@@ -217,3 +276,133 @@ class Activitystreams(TestCase):
         call_args = mock.call_args
         self.assertEqual(call_args[0][0], status)
         self.assertEqual(call_args[1]["stores"], [f"{self.local_user.id}-home"])
+
+    @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+    @patch("bookwyrm.activitystreams.add_status_task.delay")
+    @patch("bookwyrm.activitystreams.remove_status_task.delay")
+    def test_get_viewer_statuses(self, *_):
+        """everything is removed, in case privacy or follows have changed"""
+        for privacy in ["public", "followers", "direct"]:
+            models.Status.objects.create(
+                content="hi", user=self.remote_user, privacy=privacy
+            )
+        models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="public", deleted=True
+        )
+
+        result = activitystreams.get_viewer_statuses(
+            [
+                (self.local_user.id, self.remote_user.id),
+                (self.another_user.id, self.remote_user.id),
+            ]
+        )
+        self.assertEqual(len(result[self.local_user.id]), 4)
+        self.assertEqual(len(result[self.another_user.id]), 4)
+
+    @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+    @patch("bookwyrm.activitystreams.add_status_task.delay")
+    @patch("bookwyrm.activitystreams.remove_status_task.delay")
+    @patch("bookwyrm.activitystreams.add_user_statuses_task.delay")
+    def test_bulk_add_user_statuses_home(self, *_):
+        """each viewer gets the statuses that fan-out would give them"""
+        public = models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="public"
+        )
+        followers = models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="followers"
+        )
+        mention = models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="followers"
+        )
+        mention.mention_users.add(self.another_user)
+        direct_comment = models.Comment.objects.create(
+            content="hi", user=self.remote_user, privacy="direct", book=self.book
+        )
+        direct_comment.mention_users.add(self.local_user)
+        direct_message = models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="direct"
+        )
+        direct_message.mention_users.add(self.local_user)
+        models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="public", deleted=True
+        )
+        models.UserFollows.objects.create(
+            user_subject=self.local_user, user_object=self.remote_user
+        )
+
+        with patch(
+            "bookwyrm.activitystreams.HomeStream.bulk_add_objects_to_store"
+        ) as mock:
+            activitystreams.HomeStream().bulk_add_user_statuses(
+                [
+                    (self.local_user.id, self.remote_user.id),
+                    (self.another_user.id, self.remote_user.id),
+                ]
+            )
+        added = {call[0][1]: list(call[0][0]) for call in mock.call_args_list}
+        self.assertEqual(
+            added[f"{self.local_user.id}-home"],
+            [direct_comment, mention, followers, public],
+        )
+        self.assertEqual(added[f"{self.another_user.id}-home"], [mention])
+
+    @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+    @patch("bookwyrm.activitystreams.add_status_task.delay")
+    @patch("bookwyrm.activitystreams.remove_status_task.delay")
+    def test_bulk_add_user_statuses_local(self, *_):
+        """remote users' statuses never go in the local stream"""
+        models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.LocalStream.bulk_add_objects_to_store"
+        ) as mock:
+            activitystreams.LocalStream().bulk_add_user_statuses(
+                [(self.local_user.id, self.remote_user.id)]
+            )
+        self.assertEqual(list(mock.call_args[0][0]), [])
+
+    @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+    @patch("bookwyrm.activitystreams.add_status_task.delay")
+    @patch("bookwyrm.activitystreams.remove_user_statuses_task.delay")
+    def test_bulk_add_user_statuses_blocked(self, *_):
+        """nothing is added for blocked users"""
+        models.Status.objects.create(
+            content="hi", user=self.remote_user, privacy="public"
+        )
+        models.UserBlocks.objects.create(
+            user_subject=self.remote_user, user_object=self.local_user
+        )
+        with patch(
+            "bookwyrm.activitystreams.HomeStream.bulk_add_objects_to_store"
+        ) as mock:
+            activitystreams.HomeStream().bulk_add_user_statuses(
+                [(self.local_user.id, self.remote_user.id)]
+            )
+        self.assertEqual(list(mock.call_args[0][0]), [])
+
+    def test_bulk_add_user_statuses_task(self):
+        """each stream adds the statuses for all the pairs"""
+        pairs = [
+            (self.local_user.id, self.remote_user.id),
+            (self.another_user.id, self.remote_user.id),
+        ]
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.bulk_add_user_statuses"
+        ) as mock:
+            activitystreams.bulk_add_user_statuses_task(pairs)
+        self.assertEqual(mock.call_count, 3)
+        self.assertEqual(mock.call_args[0][0], pairs)
+
+    def test_bulk_remove_user_statuses_task(self):
+        """statuses are loaded once for all the pairs"""
+        with patch(
+            "bookwyrm.activitystreams.get_viewer_statuses", return_value={}
+        ) as load_mock, patch(
+            "bookwyrm.activitystreams.HomeStream.bulk_remove_user_statuses"
+        ) as mock:
+            activitystreams.bulk_remove_user_statuses_task(
+                [(self.local_user.id, self.remote_user.id)], stream_list=["home"]
+            )
+        self.assertEqual(load_mock.call_count, 1)
+        self.assertEqual(mock.call_count, 1)
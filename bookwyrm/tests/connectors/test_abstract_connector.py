@@ -1,11 +1,12 @@
 """ testing book data connectors """
 from unittest.mock import patch
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
 import responses
 
 from bookwyrm import models
 from bookwyrm.connectors import abstract_connector, ConnectorException
-from bookwyrm.connectors.abstract_connector import Mapping, get_data
+from bookwyrm.connectors.abstract_connector import Mapping, get_data, get_all_data
 from bookwyrm.settings import DOMAIN
 
 
@@ -166,3 +167,97 @@ class AbstractConnector(TestCase):
 
         with self.assertRaises(ConnectorException):
             get_data("http://127.0.0.1/image/jpg")
+
+    @responses.activate
+    def test_get_data_cached(self):
+        """don't request data again while it's fresh"""
+        responses.add(
+            responses.GET,
+            "https://example.com/book/1",
+            json={"title": "Fresh"},
+            headers={"Cache-Control": "public, max-age=3600"},
+        )
+        with patch(
+            "bookwyrm.connectors.abstract_connector.cache", LocMemCache("a", {})
+        ):
+            for _ in range(2):
+                data = get_data("https://example.com/book/1", use_cache=True)
+                self.assertEqual(data, {"title": "Fresh"})
+            get_data("https://example.com/book/1")
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_data_revalidated(self):
+        """stale data is used again if it hasn't changed"""
+        responses.add(
+            responses.GET,
+            "https://example.com/book/1",
+            json={"title": "Stale"},
+            headers={"ETag": '"abc"', "Cache-Control": "no-cache"},
+        )
+        responses.add(responses.GET, "https://example.com/book/1", status=304)
+        with patch(
+            "bookwyrm.connectors.abstract_connector.cache", LocMemCache("b", {})
+        ):
+            get_data("https://example.com/book/1", use_cache=True)
+            data = get_data("https://example.com/book/1", use_cache=True)
+        self.assertEqual(data, {"title": "Stale"})
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(responses.calls[1].request.headers["If-None-Match"], '"abc"')
+
+    @responses.activate
+    def test_get_data_not_stored(self):
+        """respect no-store, and don't share private responses"""
+        for (i, cache_control) in enumerate(["no-store", "private, max-age=3600"]):
+            url = f"https://example.com/book/{i}"
+            responses.add(
+                responses.GET,
+                url,
+                json={"title": "Secret"},
+                headers={"ETag": '"abc"', "Cache-Control": cache_control},
+            )
+            with patch(
+                "bookwyrm.connectors.abstract_connector.cache", LocMemCache("c", {})
+            ):
+                for _ in range(2):
+                    get_data(url, use_cache=True)
+            self.assertFalse("If-None-Match" in responses.calls[-1].request.headers)
+        self.assertEqual(len(responses.calls), 4)
+
+    @responses.activate
+    def test_get_data_no_cookies(self):
+        """cookies from one server aren't sent back to it, or to anyone else"""
+        responses.add(
+            responses.GET,
+            "https://example.com/book/1",
+            json={},
+            headers={"Set-Cookie": "session=abc; Domain=example.com; Path=/"},
+        )
+        responses.add(responses.GET, "https://example.com/book/2", json={})
+        get_data("https://example.com/book/1")
+        get_data("https://example.com/book/2")
+        self.assertFalse("Cookie" in responses.calls[1].request.headers)
+
+    def test_get_all_data(self):
+        """load json from many urls at once, skipping invalid ones"""
+        with patch(
+            "bookwyrm.connectors.abstract_connector.data_loader.load_all"
+        ) as load_mock:
+            load_mock.return_value = {"https://example.com/a": {"id": "a"}}
+            result = get_all_data(
+                [
+                    "https://example.com/a",
+                    "https://example.com/a",
+                    "http://127.0.0.1/b",
+                ]
+            )
+        self.assertEqual(result, {"https://example.com/a": {"id": "a"}})
+        self.assertEqual(load_mock.call_args[0][0], ["https://example.com/a"])
+
+    def test_get_all_data_none_allowed(self):
+        """nothing to load"""
+        with patch(
+            "bookwyrm.connectors.abstract_connector.data_loader.load_all"
+        ) as load_mock:
+            self.assertEqual(get_all_data(["file://hello.com/image/jpg"]), {})
+        self.assertFalse(load_mock.called)
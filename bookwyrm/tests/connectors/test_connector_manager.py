@@ -1,10 +1,17 @@
 """ interface between the app and various connectors """
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import aiohttp
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
 import responses
 
-from bookwyrm import models
+from bookwyrm import book_search, models
+from bookwyrm.book_search import SearchResult
 from bookwyrm.connectors import connector_manager
 from bookwyrm.connectors.bookwyrm_connector import Connector as BookWyrmConnector
+from bookwyrm.settings import SEARCH_TIMEOUT
 
 
 class ConnectorManager(TestCase):
@@ -20,6 +27,7 @@ class ConnectorManager(TestCase):
         self.edition = models.Edition.objects.create(
             title="Another Edition", parent_work=self.work, isbn_10="1111111111"
         )
+        book_search.update_search_vectors()
 
         self.remote_connector = models.Connector.objects.create(
             identifier="test_connector_remote",
@@ -49,6 +57,121 @@ class ConnectorManager(TestCase):
         self.assertEqual(len(connectors), 1)
         self.assertIsInstance(connectors[0], BookWyrmConnector)
 
+    def test_get_connectors_slow(self):
+        """connectors that are slow to respond are searched last"""
+        models.Connector.objects.create(
+            identifier="test_connector_other",
+            priority=2,
+            connector_file="bookwyrm_connector",
+            base_url="http://other.ciom/",
+            books_url="http://other.ciom/",
+            search_url="http://other.ciom/search/",
+            covers_url="http://covers.other.ciom/",
+        )
+        connector = connector_manager.load_connector(self.remote_connector)
+        with patch("bookwyrm.connectors.connector_manager.cache", LocMemCache("c", {})):
+            connectors = connector_manager.get_connectors()
+            self.assertEqual(connectors[0].identifier, "test_connector_remote")
+
+            connector_manager.record_latency(connector, 30)
+            connectors = connector_manager.get_connectors()
+            self.assertEqual(connectors[0].identifier, "test_connector_other")
+            self.assertEqual(connectors[1].identifier, "test_connector_remote")
+
+    def test_record_latency(self):
+        """keep an average of how long a connector takes to respond"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        with patch("bookwyrm.connectors.connector_manager.cache", LocMemCache("d", {})):
+            connector_manager.record_latency(connector, 1)
+            connector_manager.record_latency(connector, 6)
+            stats = connector_manager.get_search_cache_stats()
+        self.assertEqual(stats["test_connector_remote"]["latency"], 2)
+
+    def test_start_search(self):
+        """connectors are searched in the background and their results collected"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        result = SearchResult(
+            title="Remote Edition", key="http://fake.ciom/book/1", connector=connector
+        )
+        with patch(
+            "bookwyrm.connectors.connector_manager.cache", LocMemCache("e", {})
+        ), patch(
+            "bookwyrm.connectors.connector_manager.connector_search_task.delay"
+        ) as task_mock:
+            search_id = connector_manager.start_search("dune")
+            task_mock.assert_called_once_with(
+                search_id, self.remote_connector.id, "dune", 0.1
+            )
+            results = connector_manager.get_search_results(search_id)
+            self.assertEqual(results, {"results": [], "loading": True})
+
+            with patch(
+                "bookwyrm.connectors.connector_manager.async_connector_search"
+            ) as search_mock:
+                search_mock.return_value = [
+                    {"connector": connector, "results": [result]}
+                ]
+                connector_manager.connector_search_task(*task_mock.call_args[0])
+            results = connector_manager.get_search_results(search_id)
+
+            self.assertFalse(results["loading"])
+            self.assertEqual(results["results"][0]["connector"], self.remote_connector)
+            self.assertEqual(
+                results["results"][0]["results"][0].title, "Remote Edition"
+            )
+            self.assertIsNone(connector_manager.get_search_results("nope"))
+
+    def test_start_search_error(self):
+        """a connector that fails while processing its results is still done"""
+        with patch(
+            "bookwyrm.connectors.connector_manager.cache", LocMemCache("f", {})
+        ), patch(
+            "bookwyrm.connectors.connector_manager.connector_search_task.delay"
+        ) as task_mock:
+            search_id = connector_manager.start_search("dune")
+            with patch(
+                "bookwyrm.connectors.connector_manager.async_connector_search"
+            ) as search_mock:
+                search_mock.side_effect = ValueError
+                with self.assertRaises(ValueError):
+                    connector_manager.connector_search_task(*task_mock.call_args[0])
+            results = connector_manager.get_search_results(search_id)
+
+        self.assertEqual(results, {"results": [], "loading": False})
+
+    def test_get_results_http_error(self):
+        """a connector that responds with an error counts as slow"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        session = MagicMock()
+        response = session.get.return_value.__aenter__.return_value
+        response.ok = False
+        with patch(
+            "bookwyrm.connectors.connector_manager.record_latency"
+        ) as latency_mock:
+            result = asyncio.run(
+                connector_manager.get_results(
+                    session, "http://fake.ciom/search/dune", 0.1, "dune", connector
+                )
+            )
+        self.assertIsNone(result)
+        latency_mock.assert_called_once_with(connector, SEARCH_TIMEOUT)
+
+    def test_get_results_client_error(self):
+        """a connector that can't be reached counts as slow"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        session = MagicMock()
+        session.get.side_effect = aiohttp.ClientConnectionError
+        with patch(
+            "bookwyrm.connectors.connector_manager.record_latency"
+        ) as latency_mock:
+            result = asyncio.run(
+                connector_manager.get_results(
+                    session, "http://fake.ciom/search/dune", 0.1, "dune", connector
+                )
+            )
+        self.assertIsNone(result)
+        latency_mock.assert_called_once_with(connector, SEARCH_TIMEOUT)
+
     def test_search_empty_query(self):
         """don't panic on empty queries"""
         results = connector_manager.search("")
@@ -79,3 +202,49 @@ class ConnectorManager(TestCase):
         """load a connector object from the database entry"""
         connector = connector_manager.load_connector(self.remote_connector)
         self.assertEqual(connector.identifier, "test_connector_remote")
+
+    def test_search_cached(self):
+        """popular searches are only sent to the connector once"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        result = SearchResult(
+            title="Cached Edition", key="http://fake.ciom/book/1", connector=connector
+        )
+        with patch(
+            "bookwyrm.connectors.connector_manager.cache", LocMemCache("a", {})
+        ), patch(
+            "bookwyrm.connectors.connector_manager.async_connector_search"
+        ) as search_mock:
+            search_mock.return_value = [{"connector": connector, "results": [result]}]
+            for query in ["Dune", " dune  "]:
+                results = connector_manager.search(query)
+                self.assertEqual(len(results), 1)
+                self.assertEqual(results[0]["results"][0].title, "Cached Edition")
+                self.assertEqual(
+                    results[0]["results"][0].connector.identifier,
+                    "test_connector_remote",
+                )
+            stats = connector_manager.get_search_cache_stats()
+        self.assertEqual(search_mock.call_count, 1)
+        self.assertEqual(
+            stats["test_connector_remote"],
+            {"hits": 1, "stale_hits": 0, "misses": 1, "latency": None},
+        )
+
+    def test_search_stale(self):
+        """stale results are shown while they're refreshed"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        result = SearchResult(
+            title="Stale Edition", key="http://fake.ciom/book/1", connector=connector
+        )
+        with patch(
+            "bookwyrm.connectors.connector_manager.cache", LocMemCache("b", {})
+        ), patch(
+            "bookwyrm.connectors.connector_manager.refresh_search_task.delay"
+        ) as refresh_mock, patch(
+            "bookwyrm.settings.SEARCH_CACHE_TIMEOUT", -1
+        ):
+            connector_manager.cache_search(connector, "dune", 0.1, [result])
+            for _ in range(2):
+                results = connector_manager.search("dune")
+                self.assertEqual(results[0]["results"][0].title, "Stale Edition")
+        refresh_mock.assert_called_once_with(self.remote_connector.id, "dune", 0.1)
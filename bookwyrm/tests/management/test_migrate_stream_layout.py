@@ -0,0 +1,76 @@
+""" test moving streams between redis layouts """
+from unittest.mock import patch
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.management.commands.migrate_stream_layout import (
+    migrate_stream_layout,
+    migrate_user,
+)
+
+
+@patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+class MigrateStreamLayout(TestCase):
+    """switching between the default and compact layouts"""
+
+    def setUp(self):
+        """we need some stuff"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            self.local_user = models.User.objects.create_user(
+                "mouse", "mouse@mouse.mouse", "password", local=True, localname="mouse"
+            )
+
+    def test_migrate_user_compact(self, _):
+        """unread counts are moved into one hash"""
+        user_id = self.local_user.id
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_unread_count", return_value=2
+        ), patch(
+            "bookwyrm.activitystreams.ActivityStream.get_unread_count_by_status_type",
+            return_value={"review": 2},
+        ), patch(
+            "bookwyrm.management.commands.migrate_stream_layout.r"
+        ) as redis_mock:
+            migrate_user(user_id, True)
+        pipeline = redis_mock.pipeline.return_value
+        self.assertIn(((f"{user_id}-unread", "home", 2),), pipeline.hset.call_args_list)
+        self.assertIn(
+            ((f"{user_id}-unread", "home-review", 2),), pipeline.hset.call_args_list
+        )
+        self.assertFalse(pipeline.set.called)
+        self.assertIn(f"{user_id}-home-unread", pipeline.delete.call_args[0])
+        self.assertIn(f"{user_id}-home-unread-by-type", pipeline.delete.call_args[0])
+        # streams are trimmed to the listpack size
+        self.assertEqual(pipeline.zremrangebyrank.call_args[0][1:], (0, -128))
+        self.assertTrue(pipeline.execute.called)
+
+    def test_migrate_user_default(self, _):
+        """unread counts are moved back into their own keys"""
+        user_id = self.local_user.id
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_unread_count", return_value=2
+        ), patch(
+            "bookwyrm.activitystreams.ActivityStream.get_unread_count_by_status_type",
+            return_value={"review": 2},
+        ), patch(
+            "bookwyrm.management.commands.migrate_stream_layout.r"
+        ) as redis_mock:
+            migrate_user(user_id, False)
+        pipeline = redis_mock.pipeline.return_value
+        self.assertIn(((f"{user_id}-home-unread", 2),), pipeline.set.call_args_list)
+        self.assertIn(
+            ((f"{user_id}-home-unread-by-type", "review", 2),),
+            pipeline.hset.call_args_list,
+        )
+        self.assertEqual(pipeline.delete.call_args[0], (f"{user_id}-unread",))
+
+    def test_migrate_stream_layout(self, _):
+        """every active local user is migrated"""
+        with patch(
+            "bookwyrm.management.commands.migrate_stream_layout.migrate_user"
+        ) as mock:
+            migrate_stream_layout(compact=True)
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0], (self.local_user.id, True))
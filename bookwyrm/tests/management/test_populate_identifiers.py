@@ -0,0 +1,30 @@
+""" test filling in the identifier table """
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.management.commands.populate_identifiers import populate_identifiers
+
+
+class PopulateIdentifiers(TestCase):
+    """backfill the identifier lookup table"""
+
+    def setUp(self):
+        """we need some books and authors"""
+        self.work = models.Work.objects.create(title="Example Work")
+        self.edition = models.Edition.objects.create(
+            title="Example Edition", parent_work=self.work, isbn_13="9781781869192"
+        )
+        self.author = models.Author.objects.create(name="Author", isni="0000 0001")
+
+    def test_populate_identifiers(self):
+        """every book and author gets its identifiers"""
+        models.Identifier.objects.all().delete()
+        populate_identifiers(batch_size=1)
+
+        self.assertTrue(
+            self.edition.identifiers.filter(
+                identifier_type="isbn", value="9781781869192"
+            ).exists()
+        )
+        self.assertTrue(self.work.identifiers.exists())
+        self.assertTrue(self.author.identifiers.filter(value="0000 0001").exists())
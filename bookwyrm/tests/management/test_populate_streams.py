@@ -1,9 +1,13 @@
 """ test populating user streams """
+from collections import Counter
 from unittest.mock import patch
 from django.test import TestCase
 
 from bookwyrm import models
-from bookwyrm.management.commands.populate_streams import populate_streams
+from bookwyrm.management.commands.populate_streams import (
+    bulk_populate_streams,
+    populate_streams,
+)
 
 
 @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
@@ -56,7 +60,114 @@ class Activitystreams(TestCase):
             "bookwyrm.activitystreams.populate_stream_task.delay"
         ) as redis_mock, patch(
             "bookwyrm.lists_stream.populate_lists_task.delay"
-        ) as list_mock:
+        ) as list_mock, patch(
+            "bookwyrm.activitystreams.populate_audience_sets_task.delay"
+        ) as audience_mock:
             populate_streams()
         self.assertEqual(redis_mock.call_count, 6)  # 2 users x 3 streams
         self.assertEqual(list_mock.call_count, 2)  # 2 users
+        self.assertEqual(audience_mock.call_count, 1)
+
+    def test_bulk_populate_streams(self, _):
+        """statuses are added to the streams a batch at a time"""
+        with patch("bookwyrm.activitystreams.add_status_task.delay"):
+            old = models.Comment.objects.create(
+                user=self.local_user, content="hi", book=self.book
+            )
+            new = models.Status.objects.create(user=self.local_user, content="hello")
+            models.Status.objects.create(
+                user=self.local_user, content="hello", privacy="direct"
+            )
+
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.bulk_add_statuses",
+            return_value=Counter({self.local_user.id: 1}),
+        ) as bulk_mock, patch(
+            "bookwyrm.activitystreams.audience_sets.populate"
+        ) as audience_mock, patch(
+            "bookwyrm.lists_stream.populate_lists_task.delay"
+        ) as list_mock, patch(
+            "bookwyrm.management.commands.populate_streams.r"
+        ) as redis_mock:
+            redis_mock.get.return_value = None
+            bulk_populate_streams(batch_size=1)
+
+        self.assertEqual(audience_mock.call_count, 1)
+        self.assertEqual(list_mock.call_count, 2)  # 2 users
+        self.assertEqual(bulk_mock.call_count, 6)  # 2 batches x 3 streams
+        self.assertEqual(bulk_mock.call_args_list[0][0][0], [new])
+        self.assertEqual(bulk_mock.call_args_list[-1][0][0], [old])
+        self.assertEqual(redis_mock.set.call_count, 2)
+        checkpoint = redis_mock.set.call_args[0][1]
+        self.assertEqual(checkpoint, f"{old.published_date.isoformat()}|{old.id}")
+        self.assertTrue(redis_mock.delete.called)
+
+    def test_bulk_populate_streams_resume(self, _):
+        """an interrupted rebuild picks up after the last status it wrote"""
+        with patch("bookwyrm.activitystreams.add_status_task.delay"):
+            old = models.Comment.objects.create(
+                user=self.local_user, content="hi", book=self.book
+            )
+            new = models.Status.objects.create(user=self.local_user, content="hello")
+
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.bulk_add_statuses",
+            return_value=Counter({self.local_user.id: 1}),
+        ) as bulk_mock, patch("bookwyrm.activitystreams.audience_sets.populate"), patch(
+            "bookwyrm.lists_stream.populate_lists_task.delay"
+        ), patch(
+            "bookwyrm.management.commands.populate_streams.r"
+        ) as redis_mock:
+            redis_mock.get.return_value = (
+                f"{new.published_date.isoformat()}|{new.id}".encode("utf-8")
+            )
+            bulk_populate_streams(stream="home")
+
+        self.assertEqual(bulk_mock.call_count, 1)
+        self.assertEqual(bulk_mock.call_args[0][0], [old])
+
+    def test_bulk_populate_streams_full(self, _):
+        """statuses stop being added once every stream has all it keeps"""
+        with patch("bookwyrm.activitystreams.add_status_task.delay"):
+            models.Comment.objects.create(
+                user=self.local_user, content="hi", book=self.book
+            )
+            models.Status.objects.create(user=self.local_user, content="hello")
+
+        full = Counter({self.local_user.id: 200, self.another_user.id: 200})
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.bulk_add_statuses",
+            return_value=full,
+        ) as bulk_mock, patch("bookwyrm.activitystreams.audience_sets.populate"), patch(
+            "bookwyrm.lists_stream.populate_lists_task.delay"
+        ), patch(
+            "bookwyrm.management.commands.populate_streams.r"
+        ) as redis_mock:
+            redis_mock.get.return_value = None
+            bulk_populate_streams(stream="home", batch_size=1)
+
+        # the second batch isn't loaded
+        self.assertEqual(bulk_mock.call_count, 1)
+        self.assertEqual(bulk_mock.call_args[1]["skip_user_ids"], set())
+
+    def test_bulk_populate_streams_skips_full(self, _):
+        """users whose streams are full aren't written to"""
+        with patch("bookwyrm.activitystreams.add_status_task.delay"):
+            models.Comment.objects.create(
+                user=self.local_user, content="hi", book=self.book
+            )
+            models.Status.objects.create(user=self.local_user, content="hello")
+
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.bulk_add_statuses",
+            return_value=Counter({self.local_user.id: 200}),
+        ) as bulk_mock, patch("bookwyrm.activitystreams.audience_sets.populate"), patch(
+            "bookwyrm.lists_stream.populate_lists_task.delay"
+        ), patch(
+            "bookwyrm.management.commands.populate_streams.r"
+        ) as redis_mock:
+            redis_mock.get.return_value = None
+            bulk_populate_streams(stream="home", batch_size=1)
+
+        self.assertEqual(bulk_mock.call_count, 2)
+        self.assertEqual(bulk_mock.call_args[1]["skip_user_ids"], {self.local_user.id})
@@ -0,0 +1,68 @@
+""" test splitting streams into substreams """
+from unittest.mock import patch
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.management.commands.populate_substreams import (
+    populate_substreams,
+    populate_user_substreams,
+)
+
+
+@patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+@patch("bookwyrm.activitystreams.add_status_task.delay")
+class PopulateSubstreams(TestCase):
+    """building substreams from existing streams"""
+
+    def setUp(self):
+        """we need some stuff"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            self.local_user = models.User.objects.create_user(
+                "mouse", "mouse@mouse.mouse", "password", local=True, localname="mouse"
+            )
+        self.book = models.Edition.objects.create(title="test book")
+
+    def test_populate_user_substreams(self, *_):
+        """each status goes into the substream for its type"""
+        comment = models.Comment.objects.create(
+            user=self.local_user, content="hi", book=self.book
+        )
+        with patch("bookwyrm.activitystreams.handle_boost_task.delay"):
+            boost = models.Boost.objects.create(
+                user=self.local_user, boosted_status=comment
+            )
+        user_id = self.local_user.id
+
+        with patch(
+            "bookwyrm.management.commands.populate_substreams.r"
+        ) as redis_mock, self.assertNumQueries(6):
+            redis_mock.zrange.return_value = [
+                (str(comment.id).encode("utf-8"), 1.0),
+                (str(boost.id).encode("utf-8"), 2.0),
+            ]
+            # one query for each stream's statuses, and one for what they boosted
+            count = populate_user_substreams(user_id)
+
+        self.assertEqual(count, 6)
+        pipeline = redis_mock.pipeline.return_value
+        self.assertIn(
+            ((f"{user_id}-home-comment", {comment.id: 1.0}),),
+            pipeline.zadd.call_args_list,
+        )
+        self.assertIn(
+            ((f"{user_id}-home-comment", {boost.id: 2.0}),),
+            pipeline.zadd.call_args_list,
+        )
+        # notes aren't in a substream any more
+        self.assertIn(((f"{user_id}-home-other",),), pipeline.delete.call_args_list)
+        self.assertTrue(pipeline.execute.called)
+
+    def test_populate_substreams(self, *_):
+        """every local user's streams are split"""
+        with patch(
+            "bookwyrm.management.commands.populate_substreams.populate_user_substreams"
+        ) as user_mock:
+            populate_substreams()
+        user_mock.assert_called_once_with(self.local_user.id)
@@ -0,0 +1,31 @@
+""" test rebuilding the search index """
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.management.commands.rebuild_search_index import rebuild_search_index
+
+
+class RebuildSearchIndex(TestCase):
+    """recompute every book's search vector"""
+
+    def setUp(self):
+        """we need some books"""
+        self.work = models.Work.objects.create(title="Example Work")
+        self.edition = models.Edition.objects.create(
+            title="Example Edition", parent_work=self.work
+        )
+
+    def test_rebuild_search_index(self):
+        """every book gets a search vector"""
+        rebuild_search_index(chunk_size=1, workers=1)
+
+        self.work.refresh_from_db()
+        self.edition.refresh_from_db()
+        self.assertEqual(self.work.search_vector, "'exampl':1A 'work':2A")
+        self.assertEqual(self.edition.search_vector, "'edit':2A 'exampl':1A")
+
+    def test_rebuild_search_index_no_books(self):
+        """don't fall over on an empty database"""
+        models.Book.objects.all().delete()
+        rebuild_search_index(workers=1)
+        self.assertFalse(models.Book.objects.exists())
@@ -243,6 +243,27 @@ class ActivitypubMixins(TestCase):
         self.assertEqual(len(recipients), 1)
         self.assertEqual(recipients[0], another_remote_user.inbox)
 
+    def test_get_recipients_cached(self, *_):
+        """followers' inboxes come from the cache when they're there"""
+        MockSelf = namedtuple("Self", ("privacy", "user"))
+        mock_self = MockSelf("public", self.local_user)
+        inboxes = {
+            "bookwyrm": ["https://example.com/inbox"],
+            "other": ["https://other.example/inbox"],
+        }
+        with patch(
+            "bookwyrm.models.activitypub_mixin.cache.get", return_value=inboxes
+        ) as cache_mock, self.assertNumQueries(0):
+            recipients = ActivitypubMixin.get_recipients(mock_self)
+            bookwyrm_recipients = ActivitypubMixin.get_recipients(
+                mock_self, software="bookwyrm"
+            )
+        self.assertEqual(
+            cache_mock.call_args[0][0], f"recipient-inboxes-{self.local_user.id}"
+        )
+        self.assertEqual(len(recipients), 2)
+        self.assertEqual(bookwyrm_recipients, ["https://example.com/inbox"])
+
     # ObjectMixin
     def test_object_save_create(self, *_):
         """should save uneventufully when broadcast is disabled"""
@@ -424,12 +445,15 @@ class ActivitypubMixins(TestCase):
         self.assertEqual(page_2.orderedItems[-1]["content"], "<p>test status 0</p>")
 
     def test_broadcast_task(self, *_):
-        """Should be calling asyncio"""
+        """Should queue deliveries, and a task to send them"""
         recipients = [
             "https://instance.example/user/inbox",
             "https://instance.example/okay/inbox",
         ]
-        with patch("bookwyrm.models.activitypub_mixin.asyncio.run") as mock:
+        with patch("bookwyrm.delivery.enqueue") as enqueue_mock, patch(
+            "bookwyrm.delivery.deliver_task.delay"
+        ) as deliver_mock:
+            enqueue_mock.return_value = ["instance.example"]
             broadcast_task(self.local_user.id, {}, recipients)
-        self.assertTrue(mock.called)
-        self.assertEqual(mock.call_count, 1)
+        enqueue_mock.assert_called_once_with(self.local_user.id, {}, recipients)
+        deliver_mock.assert_called_once_with(["instance.example"])
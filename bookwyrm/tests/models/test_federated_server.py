@@ -35,6 +35,16 @@ class FederatedServer(TestCase):
                 deactivation_reason="self_deletion",
             )
 
+    def test_block_clears_recipients(self):
+        """the server's users no longer receive activities"""
+        with patch(
+            "bookwyrm.models.federated_server.clear_recipients_cache"
+        ) as cache_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.server.block()
+        self.assertEqual(cache_mock.call_count, 1)
+        self.assertEqual(cache_mock.call_args[0][0], [None])
+
     def test_block_unblock(self):
         """block a server and all users on it"""
         self.assertEqual(self.server.status, "federated")
@@ -65,3 +75,30 @@ class FederatedServer(TestCase):
         self.inactive_remote_user.refresh_from_db()
         self.assertFalse(self.inactive_remote_user.is_active)
         self.assertEqual(self.inactive_remote_user.deactivation_reason, "self_deletion")
+
+    @patch("bookwyrm.models.federated_server.r")
+    def test_is_blocked(self, redis_mock):
+        """blocked servers are remembered until the blocklist changes"""
+        redis_mock.get.return_value = b"1"
+        self.assertFalse(models.FederatedServer.is_blocked("https://test.server/u"))
+
+        self.server.block()
+        self.assertTrue(models.FederatedServer.is_blocked("https://test.server/u"))
+        with self.assertNumQueries(0):
+            self.assertTrue(models.FederatedServer.is_blocked("https://test.server/"))
+            self.assertFalse(models.FederatedServer.is_blocked("https://other.server"))
+
+        self.server.unblock()
+        self.assertFalse(models.FederatedServer.is_blocked("https://test.server/u"))
+
+    @patch("bookwyrm.models.federated_server.r")
+    def test_is_blocked_wildcard(self, redis_mock):
+        """a wildcard blocks every subdomain"""
+        redis_mock.get.return_value = b"1"
+        models.FederatedServer.objects.create(
+            server_name="*.example.com", status="blocked"
+        )
+        self.assertTrue(models.FederatedServer.is_blocked("https://a.example.com/u"))
+        self.assertTrue(models.FederatedServer.is_blocked("https://a.b.example.com"))
+        self.assertFalse(models.FederatedServer.is_blocked("https://example.com/u"))
+        self.assertFalse(models.FederatedServer.is_blocked("https://example.org/u"))
@@ -0,0 +1,101 @@
+""" testing the identifier lookup table """
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.models.identifier import (
+    REMOTE_ID,
+    get_identifiers,
+    identifier_values,
+    normalize_isbn,
+    rebuild_identifiers,
+)
+from bookwyrm.settings import DOMAIN
+
+
+class Identifier(TestCase):
+    """every identifier for books and authors, in one place"""
+
+    def setUp(self):
+        """we'll need a book"""
+        self.work = models.Work.objects.create(
+            title="Example Work", remote_id="https://example.com/book/1"
+        )
+        self.edition = models.Edition.objects.create(
+            title="Example Edition",
+            parent_work=self.work,
+            isbn_10="0-22-222222-X",
+            openlibrary_key="OL1M",
+        )
+
+    def test_normalize_isbn(self):
+        """isbn 10s and 13s are stored as isbn 13s"""
+        self.assertEqual(normalize_isbn("178186919X"), "9781781869192")
+        self.assertEqual(normalize_isbn("178-1869-19x"), "9781781869192")
+        self.assertEqual(normalize_isbn("9781781869192"), "9781781869192")
+        self.assertIsNone(normalize_isbn("hello"))
+        self.assertIsNone(normalize_isbn("97817818691921"))
+
+    def test_identifier_values(self):
+        """what to look for when someone searches for an identifier"""
+        self.assertEqual(identifier_values(" OL1M "), {"OL1M"})
+        self.assertEqual(
+            identifier_values("178186919X"), {"178186919X", "9781781869192"}
+        )
+
+    def test_long_identifiers(self):
+        """values too long for the table are stored and looked up truncated"""
+        remote_id = "https://example.com/book/" + "a" * 300
+        work = models.Work(title="Long", origin_id=f" {remote_id} ")
+        self.assertIn((REMOTE_ID, remote_id[:255]), get_identifiers(work))
+        self.assertEqual(identifier_values(remote_id), {remote_id[:255]})
+
+    def test_edition_identifiers(self):
+        """saving a book stores its identifiers"""
+        identifiers = set(
+            self.edition.identifiers.values_list("identifier_type", "value")
+        )
+        self.assertEqual(
+            identifiers,
+            {
+                ("isbn", "9780222222220"),
+                ("openlibrary_key", "OL1M"),
+                ("remote_id", f"https://{DOMAIN}/book/{self.edition.id}"),
+            },
+        )
+        self.assertEqual(identifiers, get_identifiers(self.edition))
+
+    def test_work_identifiers(self):
+        """a book from another server can be found by either remote id"""
+        identifiers = set(self.work.identifiers.values_list("identifier_type", "value"))
+        self.assertEqual(
+            identifiers,
+            {
+                ("remote_id", "https://example.com/book/1"),
+                ("remote_id", f"https://{DOMAIN}/book/{self.work.id}"),
+            },
+        )
+
+    def test_update_identifiers(self):
+        """changed identifiers replace the old ones"""
+        self.edition.openlibrary_key = "OL2M"
+        self.edition.save()
+        self.assertFalse(self.edition.identifiers.filter(value="OL1M").exists())
+        self.assertTrue(self.edition.identifiers.filter(value="OL2M").exists())
+        self.assertEqual(self.edition.identifiers.count(), 3)
+
+    def test_author_identifiers(self):
+        """authors have identifiers too"""
+        author = models.Author.objects.create(name="Author", isni="0000 0001")
+        self.assertTrue(
+            author.identifiers.filter(
+                identifier_type="isni", value="0000 0001"
+            ).exists()
+        )
+        self.assertFalse(models.Identifier.objects.filter(book=None, author=None))
+
+    def test_rebuild_identifiers(self):
+        """replace identifiers for many books at once"""
+        models.Identifier.objects.all().delete()
+        rebuild_identifiers([self.edition])
+        self.assertEqual(self.edition.identifiers.count(), 3)
+        self.assertFalse(self.work.identifiers.exists())
@@ -48,6 +48,23 @@ class Relationship(TestCase):
             f"http://local.com/user/mouse#follows/{relationship.id}",
         )
 
+    def test_user_follows_clears_recipients(self, *_):
+        """following changes who receives a user's activities"""
+        with patch("bookwyrm.models.relationship.clear_recipients_cache") as cache_mock:
+            with self.captureOnCommitCallbacks() as callbacks:
+                relationship = models.UserFollows.objects.create(
+                    user_subject=self.remote_user, user_object=self.local_user
+                )
+                relationship.delete()
+            # nothing is cleared until the change is committed
+            self.assertFalse(cache_mock.called)
+            for callback in callbacks:
+                callback()
+        self.assertEqual(cache_mock.call_count, 2)
+        self.assertEqual(
+            cache_mock.call_args[0][0], [self.remote_user.id, self.local_user.id]
+        )
+
     def test_user_follows_blocks(self, *_):
         """can't follow if you're blocked"""
         with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
@@ -65,6 +65,26 @@ class User(TestCase):
             )
         self.assertEqual(user.username, "rat@example.com")
 
+    def test_remote_user_clears_recipients(self):
+        """the cached inboxes are cleared once a new remote user is saved"""
+        with patch("bookwyrm.models.user.set_remote_server.delay"), patch(
+            "bookwyrm.models.user.clear_recipients_cache"
+        ) as cache_mock:
+            with self.captureOnCommitCallbacks() as callbacks:
+                models.User.objects.create_user(
+                    "rat",
+                    "rat@rat.rat",
+                    "ratword",
+                    local=False,
+                    remote_id="https://example.com/dfjkg",
+                    inbox="https://example.com/dfjkg/inbox",
+                    bookwyrm_user=False,
+                )
+            self.assertFalse(cache_mock.called)
+            for callback in callbacks:
+                callback()
+        cache_mock.assert_called_once_with([None])
+
     def test_user_shelves(self):
         shelves = models.Shelf.objects.filter(user=self.user).all()
         self.assertEqual(len(shelves), 4)
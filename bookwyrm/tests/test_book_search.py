@@ -33,6 +33,7 @@ class BookSearch(TestCase):
             parent_work=self.work,
             isbn_10="022222222X",
         )
+        book_search.update_search_vectors()
 
     def test_search(self):
         """search for a book in the db"""
@@ -87,6 +88,21 @@ class BookSearch(TestCase):
         )
         self.assertEqual(results, self.second_edition)
 
+    def test_search_title_author_one_edition_per_work(self):
+        """the closest edition of each work, best match first"""
+        other_work = models.Work.objects.create(title="Other Work")
+        other_edition = models.Edition.objects.create(
+            title="Edition", parent_work=other_work
+        )
+        book_search.update_search_vectors()
+        results = book_search.search_title_author("Edition", min_confidence=0)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(
+            {result.parent_work for result in results}, {self.work, other_work}
+        )
+        self.assertTrue(other_edition in results)
+        self.assertTrue(results[0].rank >= results[1].rank)
+
     def test_format_search_result(self):
         """format a search result"""
         result = book_search.format_search_result(self.first_edition)
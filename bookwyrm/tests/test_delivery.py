@@ -0,0 +1,303 @@
+""" queueing and sending activities to other servers """
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+from django.test import TestCase
+import redis
+
+from bookwyrm import delivery, models
+
+
+@patch("bookwyrm.delivery.r")
+class Delivery(TestCase):
+    """the outgoing delivery queue"""
+
+    def test_enqueue(self, redis_mock):
+        """a delivery for each inbox, grouped by host"""
+        pipeline = redis_mock.pipeline.return_value
+        hosts = delivery.enqueue(
+            1,
+            "{}",
+            [
+                "https://example.com/user/mouse/inbox",
+                "https://example.com/inbox",
+                "https://other.example/inbox",
+                "https://other.example/inbox",
+                None,
+            ],
+        )
+        self.assertEqual(hosts, ["example.com", "other.example"])
+        self.assertEqual(pipeline.set.call_count, 2)
+        self.assertEqual(pipeline.zadd.call_count, 3)
+
+        activity_id = pipeline.set.call_args_list[0][0][0]
+        pipeline.set.assert_any_call(
+            f"{activity_id}-pending", 3, ex=delivery.ACTIVITY_EXPIRY
+        )
+        queues = [call[0][0] for call in pipeline.zadd.call_args_list]
+        self.assertEqual(queues.count("delivery-example.com"), 2)
+        item = json.loads(list(pipeline.zadd.call_args_list[0][0][1].keys())[0])
+        self.assertEqual(item["sender"], 1)
+        self.assertEqual(item["activity"], activity_id)
+
+    def test_enqueue_no_recipients(self, redis_mock):
+        """nothing is stored if there's nowhere to send it"""
+        self.assertEqual(delivery.enqueue(1, "{}", [None]), [])
+        self.assertFalse(redis_mock.pipeline.called)
+
+    def test_claim(self, redis_mock):
+        """claimed deliveries aren't due again until the lease runs out"""
+        redis_mock.zrangebyscore.return_value = [b"a", b"b"]
+        items = delivery.claim("example.com", 100, 50)
+        self.assertEqual(items, [b"a", b"b"])
+        redis_mock.zadd.assert_called_once_with(
+            "delivery-example.com",
+            {b"a": 100 + delivery.LEASE_TIME, b"b": 100 + delivery.LEASE_TIME},
+            xx=True,
+        )
+
+    def test_claim_empty(self, redis_mock):
+        """nothing due"""
+        redis_mock.zrangebyscore.return_value = []
+        self.assertEqual(delivery.claim("example.com", 100, 50), [])
+        self.assertFalse(redis_mock.zadd.called)
+
+    def test_record_results_sent(self, redis_mock):
+        """a successful delivery is removed and the host is working again"""
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.__len__.return_value = 1
+        pipeline.execute.return_value = [1, 2, 1]
+        item = json.dumps({"activity": "a", "inbox": "https://example.com/inbox"})
+        delivery.record_results("example.com", [(item, delivery.SENT)], 100)
+        pipeline.zrem.assert_called_once_with("delivery-example.com", item)
+        pipeline.decrby.assert_called_once_with("a-pending", 1)
+        pipeline.delete.assert_called_once_with("delivery-example.com-circuit")
+        self.assertFalse(pipeline.zadd.called)
+        # it's still waiting to go to other inboxes
+        self.assertFalse(redis_mock.delete.called)
+
+    def test_record_results_last_delivery(self, redis_mock):
+        """an activity is deleted once it's gone everywhere"""
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.__len__.return_value = 2
+        pipeline.execute.return_value = [1, 1, 0, 1]
+        first = json.dumps({"activity": "a", "inbox": "https://example.com/inbox"})
+        second = json.dumps({"activity": "a", "inbox": "https://example.com/other"})
+        delivery.record_results(
+            "example.com", [(first, delivery.SENT), (second, delivery.FAILED)], 100
+        )
+        self.assertEqual(pipeline.zrem.call_count, 2)
+        pipeline.decrby.assert_called_once_with("a-pending", 2)
+        redis_mock.delete.assert_called_once_with("a", "a-pending")
+
+    def test_record_results_retry(self, redis_mock):
+        """a failed delivery is tried again later, waiting longer each time"""
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.execute.return_value = [1, 1, 1]
+        item = json.dumps(
+            {"activity": "a", "inbox": "https://example.com/inbox", "attempts": 2}
+        )
+        delivery.record_results("example.com", [(item, delivery.RETRY)], 100)
+
+        retry = pipeline.zadd.call_args[0][1]
+        (value, score) = list(retry.items())[0]
+        self.assertEqual(json.loads(value)["attempts"], 3)
+        self.assertEqual(score, 100 + delivery.RETRY_DELAY * 4)
+        pipeline.hincrby.assert_called_once_with(
+            "delivery-example.com-circuit", "failures", 1
+        )
+        self.assertFalse(redis_mock.hincrby.called)
+        # it's still waiting to be sent
+        self.assertFalse(pipeline.decrby.called)
+
+    def test_record_results_gives_up(self, redis_mock):
+        """deliveries are dropped after too many attempts, or a client error"""
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.__len__.return_value = 2
+        pipeline.execute.return_value = [1, 1, 1, 1]
+        item = json.dumps(
+            {
+                "activity": "a",
+                "inbox": "https://example.com/inbox",
+                "attempts": delivery.MAX_ATTEMPTS - 1,
+            }
+        )
+        other = json.dumps({"activity": "a", "inbox": "https://example.com/inbox"})
+        delivery.record_results(
+            "example.com", [(item, delivery.RETRY), (other, delivery.FAILED)], 100
+        )
+        self.assertEqual(pipeline.zrem.call_count, 2)
+        self.assertFalse(pipeline.zadd.called)
+        pipeline.decrby.assert_called_once_with("a-pending", 2)
+
+    def test_record_results_opens_circuit(self, redis_mock):
+        """stop sending to a host that keeps failing"""
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.execute.return_value = [1, 1, delivery.CIRCUIT_FAILURES]
+        redis_mock.hincrby.return_value = 2
+        item = json.dumps({"activity": "a", "inbox": "https://example.com/inbox"})
+        delivery.record_results("example.com", [(item, delivery.RETRY)], 100)
+
+        self.assertEqual(pipeline.zadd.call_count, 1)
+        redis_mock.hincrby.assert_called_once_with(
+            "delivery-example.com-circuit", "opens", 1
+        )
+        pipeline.hset.assert_any_call(
+            "delivery-example.com-circuit",
+            "open_until",
+            100 + delivery.CIRCUIT_COOLDOWN * 2,
+        )
+
+    def test_prepare(self, redis_mock):
+        """load what's needed to send, once for each sender and activity"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            user = models.User.objects.create_user(
+                "mouse", "mouse@mouse.com", "mouseword", local=True, localname="mouse"
+            )
+        items = [
+            json.dumps({"sender": user.id, "activity": "a", "inbox": inbox})
+            for inbox in ["https://example.com/inbox", "https://other.example/inbox"]
+        ]
+        expired = json.dumps({"sender": user.id, "activity": "b", "inbox": ""})
+        redis_mock.mget.side_effect = lambda keys: [
+            b"{}" if key == "a" else None for key in keys
+        ]
+
+        with patch("bookwyrm.delivery.Signer") as signer_mock:
+            (ready, dropped) = delivery.prepare(
+                {"example.com": items[:1] + [expired], "other.example": items[1:]}
+            )
+        self.assertEqual(signer_mock.call_count, 1)
+        self.assertEqual(len(ready), 2)
+        self.assertEqual(ready[0].digest, ready[1].digest)
+        self.assertEqual(ready[1].inbox, "https://other.example/inbox")
+        self.assertEqual(dropped, [("example.com", expired)])
+
+    def test_get_circuit(self, redis_mock):
+        """read when a host can be tried again"""
+        redis_mock.hgetall.return_value = {}
+        self.assertEqual(delivery.get_circuit("example.com"), (0, False))
+        redis_mock.hgetall.return_value = {b"open_until": b"150.5", b"opens": b"1"}
+        self.assertEqual(delivery.get_circuit("example.com"), (150.5, True))
+
+    def test_worker_timeout(self, _):
+        """waiting for a connection to a busy host doesn't count as timing out"""
+        timeout = delivery.DeliveryWorker().pool.timeout
+        self.assertIsNone(timeout.total)
+        self.assertEqual(timeout.sock_connect, delivery.SEND_TIMEOUT)
+        self.assertEqual(timeout.sock_read, delivery.SEND_TIMEOUT)
+
+    @patch("bookwyrm.delivery.ROUND_TIMEOUT", 0.1)
+    def test_worker_round_timeout(self, _):
+        """deliveries that are still going when the round is up are tried again"""
+
+        async def send(session, item):
+            if item.inbox == "https://slow.example/inbox":
+                await asyncio.sleep(10)
+            return delivery.SENT
+
+        worker = delivery.DeliveryWorker()
+        deliveries = [
+            delivery.Delivery(host, b"a", None, "{}", "", f"https://{host}/inbox")
+            for host in ["example.com", "slow.example"]
+        ]
+        with patch.object(worker.pool, "get_session", AsyncMock()), patch.object(
+            worker, "send", side_effect=send
+        ):
+            outcomes = worker.send_all(deliveries)
+        self.assertEqual(outcomes, [delivery.SENT, delivery.RETRY])
+
+    def test_get_worker(self, _):
+        """the worker is created the first time it's needed, and then re-used"""
+        delivery.get_worker.cache_clear()
+        with patch("bookwyrm.delivery.DeliveryWorker") as worker_mock:
+            self.assertEqual(delivery.get_worker(), delivery.get_worker())
+        worker_mock.assert_called_once_with()
+        delivery.get_worker.cache_clear()
+
+    def test_lock_timeout(self, _):
+        """a task's host locks last longer than all of its rounds"""
+        self.assertGreater(
+            delivery.LOCK_TIMEOUT, delivery.MAX_ROUNDS * delivery.ROUND_TIMEOUT
+        )
+        self.assertLess(delivery.ROUND_TIMEOUT, delivery.LEASE_TIME)
+
+    @patch("bookwyrm.delivery.schedule")
+    @patch("bookwyrm.delivery.record_results")
+    @patch("bookwyrm.delivery.DeliveryWorker.send_all")
+    @patch("bookwyrm.delivery.prepare")
+    @patch("bookwyrm.delivery.claim")
+    @patch("bookwyrm.delivery.get_circuit")
+    def test_deliver(self, circuit_mock, claim_mock, prepare_mock, send_mock, *args):
+        """send what's due for each host, skipping hosts that are failing"""
+        (record_mock, schedule_mock, redis_mock) = args
+        redis_mock.set.return_value = True
+        circuit_mock.side_effect = lambda host: (
+            (10**12, True) if host == "down.example" else (0, False)
+        )
+        claim_mock.side_effect = [[b"a"], []]
+        prepare_mock.return_value = (
+            [delivery.Delivery("example.com", b"a", None, "{}", "", "")],
+            [],
+        )
+        send_mock.return_value = [delivery.SENT]
+
+        delivery.deliver(["example.com", "down.example"])
+
+        self.assertEqual(claim_mock.call_count, 2)
+        self.assertEqual(claim_mock.call_args[0][0], "example.com")
+        self.assertEqual(send_mock.call_count, 1)
+        record_mock.assert_called_once()
+        self.assertEqual(
+            record_mock.call_args[0][:2], ("example.com", [(b"a", delivery.SENT)])
+        )
+        self.assertEqual(schedule_mock.call_count, 2)
+        self.assertEqual(redis_mock.delete.call_count, 2)
+
+    @patch("bookwyrm.delivery.schedule")
+    @patch("bookwyrm.delivery.claim")
+    def test_deliver_locked(self, claim_mock, schedule_mock, redis_mock):
+        """only one task sends to a host at a time"""
+        redis_mock.set.return_value = None
+        delivery.deliver(["example.com"])
+        self.assertFalse(claim_mock.called)
+        self.assertFalse(schedule_mock.called)
+
+    @patch("bookwyrm.delivery.deliver_task.apply_async")
+    def test_schedule(self, task_mock, redis_mock):
+        """queue a task for the next delivery that's due"""
+        pipeline = redis_mock.pipeline.return_value.__enter__.return_value
+        pipeline.zrange.return_value = [(b"a", 0)]
+        redis_mock.hgetall.return_value = {}
+        redis_mock.set.return_value = True
+        delivery.schedule("example.com")
+        self.assertEqual(
+            redis_mock.set.call_args[0][0], "delivery-example.com-scheduled"
+        )
+        task_mock.assert_called_once_with(args=(["example.com"],), countdown=0)
+
+    @patch("bookwyrm.delivery.deliver_task.apply_async")
+    def test_schedule_empty(self, task_mock, redis_mock):
+        """a host with nothing waiting is forgotten"""
+        pipeline = redis_mock.pipeline.return_value.__enter__.return_value
+        pipeline.zrange.return_value = []
+        delivery.schedule("example.com")
+        pipeline.watch.assert_called_once_with("delivery-example.com")
+        pipeline.srem.assert_called_once_with(delivery.HOSTS_KEY, "example.com")
+        self.assertTrue(pipeline.execute.called)
+        self.assertFalse(task_mock.called)
+
+    @patch("bookwyrm.delivery.deliver_task.apply_async")
+    def test_schedule_race(self, task_mock, redis_mock):
+        """a host isn't forgotten if something is queued for it while it's checked"""
+        pipeline = redis_mock.pipeline.return_value.__enter__.return_value
+        pipeline.zrange.side_effect = [[], [(b"a", 0)]]
+        pipeline.execute.side_effect = redis.WatchError
+        redis_mock.hgetall.return_value = {}
+        redis_mock.set.return_value = True
+        delivery.schedule("example.com")
+        self.assertEqual(pipeline.execute.call_count, 1)
+        task_mock.assert_called_once_with(args=(["example.com"],), countdown=0)
@@ -1,8 +1,9 @@
 """ django configuration of postgres  """
 from unittest.mock import patch
+from django.db import connection
 from django.test import TestCase
 
-from bookwyrm import models
+from bookwyrm import book_search, models
 
 
 @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
@@ -13,6 +14,11 @@ class PostgresTriggers(TestCase):
         """make sure that search_vector is being set correctly on create"""
         book = models.Edition.objects.create(title="The Long Goodbye")
         book.refresh_from_db()
+        # it's set later, in a batch
+        self.assertIsNone(book.search_vector)
+
+        book_search.update_search_vectors()
+        book.refresh_from_db()
         self.assertEqual(book.search_vector, "'goodby':3A 'long':2A")
 
     def test_search_vector_on_update(self, _):
@@ -20,9 +26,19 @@ class PostgresTriggers(TestCase):
         book = models.Edition.objects.create(title="The Long Goodbye")
         book.title = "The Even Longer Goodbye"
         book.save(broadcast=False)
+        book_search.update_search_vectors()
         book.refresh_from_db()
         self.assertEqual(book.search_vector, "'even':2A 'goodby':4A 'longer':3A")
 
+    def test_search_vector_on_save(self, _):
+        """saving a book doesn't overwrite its search vector with a stale copy"""
+        book = models.Edition.objects.create(title="The Long Goodbye")
+        book_search.update_search_vectors()
+        book.description = "A novel"
+        book.save(broadcast=False)
+        book.refresh_from_db()
+        self.assertEqual(book.search_vector, "'goodby':3A 'long':2A")
+
     def test_search_vector_fields(self, _):
         """use multiple fields to create search vector"""
         author = models.Author.objects.create(name="The Rays")
@@ -33,6 +49,7 @@ class PostgresTriggers(TestCase):
             languages=["irrelevent"],
         )
         book.authors.add(author)
+        book_search.update_search_vectors()
         book.refresh_from_db()
         # pylint: disable=line-too-long
         self.assertEqual(
@@ -49,6 +66,7 @@ class PostgresTriggers(TestCase):
         book.authors.add(author)
         author.name = "Jeremy"
         author.save(broadcast=False)
+        book_search.update_search_vectors()
         book.refresh_from_db()
 
         self.assertEqual(book.search_vector, "'goodby':3A 'jeremy':4C 'long':2A")
@@ -61,10 +79,12 @@ class PostgresTriggers(TestCase):
         )
 
         book.authors.add(author)
+        book_search.update_search_vectors()
         book.refresh_from_db()
         self.assertEqual(book.search_vector, "'goodby':3A 'jeremy':4C 'long':2A")
 
         book.authors.remove(author)
+        book_search.update_search_vectors()
         book.refresh_from_db()
         self.assertEqual(book.search_vector, "'goodby':3A 'long':2A")
 
@@ -73,5 +93,46 @@ class PostgresTriggers(TestCase):
         book = models.Edition.objects.create(
             title="there there",
         )
+        book_search.update_search_vectors()
         book.refresh_from_db()
         self.assertEqual(book.search_vector, "'there':1A,2A")
+
+    def test_update_search_vectors(self, _):
+        """books are updated in batches until none are left"""
+        books = [
+            models.Edition.objects.create(title=f"The Long Goodbye {i}")
+            for i in range(3)
+        ]
+        self.assertEqual(book_search.update_search_vectors(batch_size=2), 3)
+        self.assertEqual(book_search.update_search_vectors(batch_size=2), 0)
+        for book in books:
+            book.refresh_from_db()
+            self.assertIsNotNone(book.search_vector)
+
+    def test_rebuild_search_vectors(self, _):
+        """update every book in a range, whether or not it changed"""
+        book = models.Edition.objects.create(title="The Long Goodbye")
+        models.Edition.objects.filter(id=book.id).update(search_vector=None)
+
+        self.assertEqual(book_search.rebuild_search_vectors(book.id, book.id + 1), 1)
+        book.refresh_from_db()
+        self.assertEqual(book.search_vector, "'goodby':3A 'long':2A")
+
+    def test_trigram_contains(self, _):
+        """partial, case insensitive matches, with like wildcards escaped"""
+        book = models.Edition.objects.create(title="The Long_Goodbye")
+        models.Edition.objects.create(title="The Longer Goodbye")
+
+        books = models.Edition.objects.filter(title__trigram_contains="long_good")
+        self.assertEqual(list(books), [book])
+
+    def test_trigram_contains_uses_index(self, _):
+        """the typeahead queries can be served by the trigram indexes"""
+        with connection.cursor() as cursor:
+            # the tables are too small for the planner to choose an index otherwise
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = models.Edition.objects.filter(title__trigram_contains="goodb").explain()
+        self.assertIn("bookwyrm_book_title_trgm", plan)
+
+        plan = models.Author.objects.filter(name__trigram_contains="chand").explain()
+        self.assertIn("bookwyrm_author_name_trgm", plan)
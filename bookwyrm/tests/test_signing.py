@@ -1,4 +1,5 @@
 """ getting and verifying signatures """
+import datetime
 import time
 from collections import namedtuple
 from urllib.parse import urlsplit
@@ -16,7 +17,13 @@ from django.utils.http import http_date
 from bookwyrm import models
 from bookwyrm.activitypub import Follow
 from bookwyrm.settings import DOMAIN
-from bookwyrm.signatures import create_key_pair, make_signature, make_digest
+from bookwyrm.signatures import (
+    create_key_pair,
+    http_date_age,
+    make_digest,
+    make_signature,
+    Signer,
+)
 
 
 def get_follow_activity(follower, followee):
@@ -98,6 +105,17 @@ class Signature(TestCase):
         response = self.send_test_request(sender=self.mouse)
         self.assertEqual(response.status_code, 200)
 
+    def test_signer(self):
+        """a signer makes the same signatures as make_signature"""
+        signer = Signer(self.fake_remote)
+        now = http_date()
+        digest = make_digest("{}")
+        for inbox in ["https://example.com/inbox", "https://other.example/inbox"]:
+            self.assertEqual(
+                signer.sign("post", inbox, now, digest),
+                make_signature("post", self.fake_remote, inbox, now, digest),
+            )
+
     def test_wrong_signature(self):
         """Messages must be signed by the right actor.
         (cat cannot sign messages on behalf of mouse)"""
@@ -202,3 +220,10 @@ class Signature(TestCase):
                 self.mouse, date=http_date(time.time() - 301)
             )
             self.assertEqual(response.status_code, 401)
+
+    def test_http_date_age_received(self):
+        """a queued request's age is measured from when it was received"""
+        date = "Mon, 17 Oct 2022 09:46:40 GMT"
+        received = datetime.datetime(2022, 10, 17, 9, 47, 40)
+        self.assertEqual(http_date_age(date, now=received), 60)
+        self.assertGreater(http_date_age(date), 300)
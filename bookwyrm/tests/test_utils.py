@@ -3,6 +3,7 @@ import re
 from django.test import TestCase
 
 from bookwyrm.utils import regex
+from bookwyrm.utils.http import PooledSession
 from bookwyrm.utils.validate import validate_url_domain
 
 
@@ -29,3 +30,16 @@ class TestUtils(TestCase):
     def test_default_url_domain(self):
         """Check with a default URL"""
         self.assertEqual(validate_url_domain("/"), "/")
+
+    def test_pooled_session(self):
+        """the session and its connections are kept between calls"""
+        pool = PooledSession(2)
+
+        async def get_session():
+            return await pool.get_session()
+
+        session = pool.run(get_session())
+        self.assertEqual(pool.run(get_session()), session)
+        self.assertEqual(session.connector.limit_per_host, 2)
+        pool.run(session.close())
+        self.assertNotEqual(pool.run(get_session()), session)
@@ -149,6 +149,19 @@ class ReportViews(TestCase):
         self.assertFalse(self.rat.is_active)
         self.assertEqual(self.rat.deactivation_reason, "moderator_deletion")
 
+    @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+    def test_delete_user_statuses(self, *_):
+        """a deleted user's statuses are removed from feeds"""
+        with patch("bookwyrm.activitystreams.add_status_task.delay"):
+            status = models.Status.objects.create(user=self.rat, content="hi")
+        request = self.factory.post("", {"password": "password"})
+        request.user = self.local_user
+
+        with patch("bookwyrm.activitystreams.remove_status_task.delay") as mock:
+            views.moderator_delete_user(request, self.rat.id)
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0][0], [status.id])
+
     def test_delete_user_error(self, *_):
         """toggle whether a user is able to log in"""
         self.assertTrue(self.rat.is_active)
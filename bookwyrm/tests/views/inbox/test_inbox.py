@@ -1,12 +1,15 @@
 """ tests incoming activities"""
+import datetime
 import json
 import pathlib
+import time
 from unittest.mock import patch
 
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseNotAllowed, HttpResponseNotFound
 from django.test import TestCase, Client
 from django.test.client import RequestFactory
+from django.utils.http import http_date
 
 from bookwyrm import models, views
 
@@ -51,6 +54,8 @@ class Inbox(TestCase):
             "cc": ["https://example.com/user/mouse/followers"],
             "object": {},
         }
+        # signed by the actor, but not checked until it's verified
+        self.signature = 'keyId=hi#main-key,headers="date",signature=aGk='
         models.SiteSettings.objects.create()
 
     def test_inbox_invalid_get(self):
@@ -126,6 +131,209 @@ class Inbox(TestCase):
                 )
         self.assertEqual(result.status_code, 200)
 
+    @patch("bookwyrm.settings.INBOX_FAST_ACCEPT", True)
+    @patch("bookwyrm.views.inbox.verify_requests_task.apply_async")
+    @patch("bookwyrm.views.inbox.r")
+    def test_inbox_fast_accept(self, redis_mock, task_mock):
+        """queue the request to be verified later"""
+        redis_mock.set.return_value = True
+        redis_mock.llen.return_value = 0
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid:
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                HTTP_DATE=http_date(),
+                HTTP_SIGNATURE=self.signature,
+            )
+        self.assertEqual(result.status_code, 202)
+        self.assertFalse(mock_valid.called)
+        self.assertEqual(redis_mock.lpush.call_args[0][0], "inbox-medium_priority")
+        queued = json.loads(redis_mock.lpush.call_args[0][1])
+        self.assertEqual(queued["path"], "/inbox")
+        self.assertEqual(json.loads(queued["body"]), self.create_json)
+        self.assertAlmostEqual(queued["received"], time.time(), delta=60)
+        task_mock.assert_called_once_with(
+            args=("medium_priority",), queue="medium_priority"
+        )
+
+    @patch("bookwyrm.settings.INBOX_FAST_ACCEPT", True)
+    @patch("bookwyrm.views.inbox.verify_requests_task.apply_async")
+    @patch("bookwyrm.views.inbox.r")
+    def test_inbox_fast_accept_too_old(self, redis_mock, task_mock):
+        """don't queue requests that are already too old to verify"""
+        for date in [None, "yesterday", http_date(time.time() - 60 * 60)]:
+            headers = {"HTTP_DATE": date} if date else {}
+            headers["HTTP_SIGNATURE"] = self.signature
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                **headers,
+            )
+            self.assertEqual(result.status_code, 401)
+        self.assertFalse(redis_mock.lpush.called)
+        self.assertFalse(task_mock.called)
+
+    @patch("bookwyrm.settings.INBOX_FAST_ACCEPT", True)
+    @patch("bookwyrm.views.inbox.verify_requests_task.apply_async")
+    @patch("bookwyrm.views.inbox.r")
+    def test_inbox_fast_accept_unsigned(self, redis_mock, task_mock):
+        """don't queue requests that aren't signed by their actor"""
+        other_signature = self.signature.replace("keyId=hi", "keyId=bye")
+        for signature in [None, "nonsense", other_signature]:
+            headers = {"HTTP_SIGNATURE": signature} if signature else {}
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                HTTP_DATE=http_date(),
+                **headers,
+            )
+            self.assertEqual(result.status_code, 401)
+        self.assertFalse(redis_mock.lpush.called)
+        self.assertFalse(task_mock.called)
+
+    @patch("bookwyrm.settings.INBOX_FAST_ACCEPT", True)
+    @patch("bookwyrm.settings.INBOX_QUEUE_MAX_LENGTH", 10)
+    @patch("bookwyrm.views.inbox.verify_requests_task.apply_async")
+    @patch("bookwyrm.views.inbox.r")
+    def test_inbox_fast_accept_full(self, redis_mock, task_mock):
+        """the sender is asked to try again later when the queue is full"""
+        redis_mock.llen.return_value = 10
+        result = self.client.post(
+            "/inbox",
+            json.dumps(self.create_json),
+            content_type="application/json",
+            HTTP_DATE=http_date(),
+            HTTP_SIGNATURE=self.signature,
+        )
+        self.assertEqual(result.status_code, 503)
+        self.assertFalse(redis_mock.lpush.called)
+        self.assertFalse(task_mock.called)
+
+    @patch("bookwyrm.views.inbox.r")
+    def test_verify_requests_task(self, redis_mock):
+        """handle the queued requests that have valid signatures"""
+        queued = {
+            "path": "/inbox",
+            "headers": {"Signature": "hi"},
+            "body": json.dumps(self.create_json),
+            "received": 1666000000,
+        }
+        redis_mock.zrangebyscore.return_value = []
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.execute.side_effect = [
+            [json.dumps(queued)] * 2 + [None] * 98,
+            [1, 1],
+        ]
+
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid, patch(
+            "bookwyrm.views.inbox.activity_task.apply_async"
+        ) as task_mock:
+            mock_valid.side_effect = [True, False]
+            views.inbox.verify_requests_task("high_priority")
+
+        request = mock_valid.call_args[0][0]
+        self.assertEqual(request.headers["signature"], "hi")
+        self.assertEqual(json.loads(request.body), self.create_json)
+        self.assertEqual(
+            mock_valid.call_args[1]["received"],
+            datetime.datetime(2022, 10, 17, 9, 46, 40),
+        )
+        task_mock.assert_called_once_with(
+            args=(self.create_json,), queue="high_priority"
+        )
+        # the batch is moved to its own list while it's checked, and then removed
+        batch_key = pipeline.rpoplpush.call_args[0][1]
+        self.assertEqual(pipeline.rpoplpush.call_args[0][0], "inbox-high_priority")
+        pipeline.delete.assert_called_once_with(batch_key)
+        pipeline.zrem.assert_called_once_with(
+            "inbox-high_priority-processing", batch_key
+        )
+
+    @patch("bookwyrm.views.inbox.r")
+    def test_verify_requests_bad_request(self, redis_mock):
+        """one broken request doesn't stop the rest of the batch"""
+        queued = {
+            "path": "/inbox",
+            "headers": {"Signature": "hi"},
+            "body": json.dumps(self.create_json),
+            "received": 1666000000,
+        }
+        batch = [
+            "not json",
+            json.dumps({"path": "/inbox"}),
+            json.dumps({**queued, "headers": {}}),
+            json.dumps(queued),
+        ]
+        with patch(
+            "bookwyrm.views.inbox.activity_task.apply_async"
+        ) as task_mock, patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid:
+            mock_valid.side_effect = [KeyError("signature"), True]
+            views.inbox.verify_requests(batch, "high_priority", "batch")
+        self.assertEqual(mock_valid.call_count, 2)
+        task_mock.assert_called_once_with(
+            args=(self.create_json,), queue="high_priority"
+        )
+        # each request is done with, whether or not it could be read
+        self.assertEqual(
+            [call[0] for call in redis_mock.lrem.call_args_list],
+            [("batch", 1, item) for item in batch],
+        )
+
+    @patch("bookwyrm.views.inbox.r")
+    def test_verify_requests_error(self, redis_mock):
+        """a request whose key can't be looked up is dropped, and the rest of the
+        batch is handled once"""
+        batch = [
+            json.dumps(
+                {
+                    "path": "/inbox",
+                    "headers": {"Signature": "hi"},
+                    "body": json.dumps({**self.create_json, "id": activity_id}),
+                    "received": 1666000000,
+                }
+            )
+            for activity_id in ["first", "broken", "last"]
+        ]
+        with patch(
+            "bookwyrm.views.inbox.activity_task.apply_async"
+        ) as task_mock, patch(
+            "bookwyrm.views.inbox.Signature"
+        ) as signature_mock, patch(
+            "bookwyrm.views.inbox.get_public_keys", return_value={}
+        ), patch(
+            "bookwyrm.views.inbox.get_public_key"
+        ) as key_mock:
+            signature_mock.parse.return_value.key_id = "hi#main-key"
+            key_mock.side_effect = ["key", ConnectionError("no"), "key"]
+            views.inbox.verify_requests(batch, "high_priority", "batch")
+
+        self.assertEqual(
+            [call[1]["args"][0]["id"] for call in task_mock.call_args_list],
+            ["first", "last"],
+        )
+        self.assertEqual(
+            [call[0] for call in redis_mock.lrem.call_args_list],
+            [("batch", 1, item) for item in batch],
+        )
+
+    @patch("bookwyrm.views.inbox.r")
+    def test_recover_requests(self, redis_mock):
+        """requests from batches that were never finished are queued again"""
+        redis_mock.zrangebyscore.return_value = [b"inbox-high_priority-processing-a"]
+        redis_mock.rpoplpush.side_effect = ["request", "request", None]
+        views.inbox.recover_requests("high_priority")
+
+        self.assertEqual(redis_mock.rpoplpush.call_count, 3)
+        redis_mock.rpoplpush.assert_called_with(
+            b"inbox-high_priority-processing-a", "inbox-high_priority"
+        )
+        redis_mock.zrem.assert_called_once_with(
+            "inbox-high_priority-processing", b"inbox-high_priority-processing-a"
+        )
+
     def test_is_blocked_user_agent(self):
         """check for blocked servers"""
         request = self.factory.post(
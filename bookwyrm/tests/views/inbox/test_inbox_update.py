@@ -135,7 +135,7 @@ class InboxUpdate(TestCase):
         del bookdata["authors"]
         self.assertEqual(book.title, "Test Book")
 
-        with patch("bookwyrm.activitypub.base_activity.set_related_field.delay"):
+        with patch("bookwyrm.activitypub.base_activity.set_related_fields.delay"):
             views.inbox.activity_task(
                 {
                     "type": "Update",
@@ -172,7 +172,7 @@ class InboxUpdate(TestCase):
         self.assertFalse(book.file_links.exists())
 
         with patch(
-            "bookwyrm.activitypub.base_activity.set_related_field.delay"
+            "bookwyrm.activitypub.base_activity.set_related_fields.delay"
         ) as mock:
             views.inbox.activity_task(
                 {
@@ -189,7 +189,7 @@ class InboxUpdate(TestCase):
         self.assertEqual(args[1], "Edition")
         self.assertEqual(args[2], "book")
         self.assertEqual(args[3], book.remote_id)
-        self.assertEqual(args[4], link_data)
+        self.assertEqual(args[4], [link_data])
         # idk how to test that related name works, because of the transaction
 
     def test_update_work(self):
@@ -203,7 +203,7 @@ class InboxUpdate(TestCase):
 
         del bookdata["authors"]
         self.assertEqual(book.title, "Test Book")
-        with patch("bookwyrm.activitypub.base_activity.set_related_field.delay"):
+        with patch("bookwyrm.activitypub.base_activity.set_related_fields.delay"):
             views.inbox.activity_task(
                 {
                     "type": "Update",
@@ -231,7 +231,7 @@ class InboxUpdate(TestCase):
         activity = self.update_json
         activity["object"] = status_data
 
-        with patch("bookwyrm.activitypub.base_activity.set_related_field.delay"):
+        with patch("bookwyrm.activitypub.base_activity.set_related_fields.delay"):
             views.inbox.activity_task(activity)
 
         status.refresh_from_db()
@@ -34,7 +34,7 @@ class DiscoverViews(TestCase):
         request = self.factory.get("")
         request.user = self.local_user
         with patch(
-            "bookwyrm.activitystreams.ActivityStream.get_activity_stream"
+            "bookwyrm.activitystreams.ActivityStream.get_stream_statuses"
         ) as mock:
             result = view(request)
         self.assertEqual(mock.call_count, 1)
@@ -61,7 +61,7 @@ class DiscoverViews(TestCase):
         models.Status.objects.create(user=self.local_user, content="beep")
 
         with patch(
-            "bookwyrm.activitystreams.ActivityStream.get_activity_stream"
+            "bookwyrm.activitystreams.ActivityStream.get_stream_statuses"
         ) as mock:
             mock.return_value = models.Status.objects.all()
             result = view(request)
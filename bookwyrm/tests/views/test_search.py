@@ -3,12 +3,12 @@ import json
 from unittest.mock import patch
 
 from django.contrib.auth.models import AnonymousUser
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.template.response import TemplateResponse
 from django.test import TestCase
 from django.test.client import RequestFactory
 
-from bookwyrm import models, views
+from bookwyrm import book_search, models, views
 from bookwyrm.book_search import SearchResult
 from bookwyrm.settings import DOMAIN
 from bookwyrm.tests.validate_html import validate_html
@@ -37,6 +37,7 @@ class Views(TestCase):
             remote_id="https://example.com/book/1",
             parent_work=self.work,
         )
+        book_search.update_search_vectors()
         models.SiteSettings.objects.create()
 
     def test_search_json_response(self):
@@ -53,6 +54,31 @@ class Views(TestCase):
         self.assertEqual(data[0]["title"], "Test Book")
         self.assertEqual(data[0]["key"], f"https://{DOMAIN}/book/{self.book.id}")
 
+    def test_book_typeahead(self):
+        """suggest books and authors from part of a title or name"""
+        author = models.Author.objects.create(name="Test Author")
+        self.book.authors.add(author)
+        request = self.factory.get("", {"q": "test bo"})
+        response = views.book_typeahead(request)
+        self.assertIsInstance(response, JsonResponse)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data["books"]), 1)
+        self.assertEqual(data["books"][0]["id"], self.book.id)
+        self.assertEqual(data["books"][0]["author"], "Test Author")
+        self.assertEqual(data["authors"], [])
+
+        request = self.factory.get("", {"q": "author"})
+        data = json.loads(views.book_typeahead(request).content)
+        self.assertEqual(data["books"], [])
+        self.assertEqual(data["authors"][0]["name"], "Test Author")
+
+    def test_book_typeahead_short_query(self):
+        """nothing is suggested until there's enough to search for"""
+        request = self.factory.get("", {"q": " t "})
+        data = json.loads(views.book_typeahead(request).content)
+        self.assertEqual(data, {"books": [], "authors": []})
+
     def test_search_no_query(self):
         """just the search page"""
         view = views.Search.as_view()
@@ -82,10 +108,16 @@ class Views(TestCase):
         request.user = self.local_user
         with patch("bookwyrm.views.search.is_api_request") as is_api:
             is_api.return_value = False
-            with patch("bookwyrm.connectors.connector_manager.search") as remote_search:
-                remote_search.return_value = [
-                    {"results": [mock_result], "connector": connector}
-                ]
+            with patch(
+                "bookwyrm.connectors.connector_manager.start_search"
+            ) as start_search, patch(
+                "bookwyrm.connectors.connector_manager.get_search_results"
+            ) as get_results:
+                start_search.return_value = "abc123"
+                get_results.return_value = {
+                    "results": [{"results": [mock_result], "connector": connector}],
+                    "loading": True,
+                }
                 response = view(request)
 
         self.assertIsInstance(response, TemplateResponse)
@@ -96,21 +128,12 @@ class Views(TestCase):
 
         connector_results = response.context_data["remote_results"]
         self.assertEqual(connector_results[0]["results"][0].title, "Mock Book")
+        self.assertEqual(response.context_data["search_id"], "abc123")
+        self.assertTrue(response.context_data["remote_loading"])
 
     def test_search_book_anonymous(self):
         """Don't search remote for logged out user"""
         view = views.Search.as_view()
-
-        connector = models.Connector.objects.create(
-            identifier="example.com",
-            connector_file="openlibrary",
-            base_url="https://example.com",
-            books_url="https://example.com/books",
-            covers_url="https://example.com/covers",
-            search_url="https://example.com/search?q=",
-        )
-        mock_result = SearchResult(title="Mock Book", connector=connector, key="hello")
-
         request = self.factory.get("", {"q": "Test Book", "remote": True})
 
         anonymous_user = AnonymousUser
@@ -118,10 +141,9 @@ class Views(TestCase):
         request.user = anonymous_user
         with patch("bookwyrm.views.search.is_api_request") as is_api:
             is_api.return_value = False
-            with patch("bookwyrm.connectors.connector_manager.search") as remote_search:
-                remote_search.return_value = [
-                    {"results": [mock_result], "connector": connector}
-                ]
+            with patch(
+                "bookwyrm.connectors.connector_manager.start_search"
+            ) as start_search:
                 response = view(request)
 
         self.assertIsInstance(response, TemplateResponse)
@@ -132,6 +154,44 @@ class Views(TestCase):
 
         connector_results = response.context_data.get("remote_results")
         self.assertIsNone(connector_results)
+        self.assertFalse(start_search.called)
+
+    def test_remote_search_results(self):
+        """collect results from connectors as they respond"""
+        connector = models.Connector.objects.create(
+            identifier="example.com",
+            connector_file="openlibrary",
+            base_url="https://example.com",
+            books_url="https://example.com/books",
+            covers_url="https://example.com/covers",
+            search_url="https://example.com/search?q=",
+        )
+        mock_result = SearchResult(title="Mock Book", connector=connector, key="hello")
+
+        request = self.factory.get("")
+        request.user = self.local_user
+        with patch(
+            "bookwyrm.connectors.connector_manager.get_search_results"
+        ) as get_results:
+            get_results.return_value = {
+                "results": [{"results": [mock_result], "connector": connector}],
+                "loading": False,
+            }
+            response = views.remote_search_results(request, "abc123")
+        get_results.assert_called_once_with("abc123")
+
+        self.assertIsInstance(response, JsonResponse)
+        data = json.loads(response.content)
+        self.assertFalse(data["loading"])
+        self.assertEqual(data["results"][0]["connector"], "example.com")
+        self.assertIn("Mock Book", data["results"][0]["html"])
+
+        with patch(
+            "bookwyrm.connectors.connector_manager.get_search_results"
+        ) as get_results:
+            get_results.return_value = None
+            with self.assertRaises(Http404):
+                views.remote_search_results(request, "abc123")
 
     def test_search_users(self):
         """searches remote connectors"""
@@ -383,6 +383,14 @@ urlpatterns = [
         name="direct-messages-user",
     ),
     # search
+    re_path(
+        r"^search/typeahead.json/?$", views.book_typeahead, name="search-typeahead"
+    ),
+    re_path(
+        r"^search/remote/(?P<search_id>[0-9a-f]+).json/?$",
+        views.remote_search_results,
+        name="search-remote-results",
+    ),
     re_path(r"^search.json/?$", views.Search.as_view(), name="search"),
     re_path(r"^search/?$", views.Search.as_view(), name="search"),
     # imports
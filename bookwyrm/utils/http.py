@@ -0,0 +1,33 @@
+""" sending lots of http requests at once from synchronous code """
+import asyncio
+
+import aiohttp
+
+# what to ask for when loading json or activitypub data
+# pylint: disable=line-too-long
+JSON_ACCEPT = 'application/json, application/activity+json, application/ld+json; profile="https://www.w3.org/ns/activitystreams"; charset=utf-8'
+
+
+class PooledSession:
+    """an event loop and aiohttp session that are kept between calls, so that
+    connections to each host can be re-used"""
+
+    def __init__(self, limit_per_host, timeout=None):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.loop = None
+        self.session = None
+
+    def run(self, coroutine):
+        """run a coroutine to completion on the shared event loop"""
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(coroutine)
+
+    async def get_session(self):
+        """the shared session, which limits how many connections each host gets"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host)
+            kwargs = {"timeout": self.timeout} if self.timeout else {}
+            self.session = aiohttp.ClientSession(connector=connector, **kwargs)
+        return self.session
@@ -144,7 +144,7 @@ from .rss_feed import (
     RssQuotesOnlyFeed,
     RssCommentsOnlyFeed,
 )
-from .search import Search
+from .search import Search, book_typeahead, remote_search_results
 from .setup import InstanceConfig, CreateAdmin
 from .status import CreateStatus, EditStatus, DeleteStatus, update_progress
 from .status import edit_readthrough
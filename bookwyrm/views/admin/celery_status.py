@@ -39,6 +39,8 @@ class CeleryStatus(View):
                 "medium_priority": r.llen("medium_priority"),
                 "high_priority": r.llen("high_priority"),
                 "imports": r.llen("imports"),
+                "search": r.llen("search"),
+                "delivery": r.llen("delivery"),
             }
         # pylint: disable=broad-except
         except Exception as err:
@@ -16,7 +16,10 @@ from csp.decorators import csp_update
 
 from bookwyrm import models, settings
 from bookwyrm.connectors.abstract_connector import get_data
-from bookwyrm.connectors.connector_manager import ConnectorException
+from bookwyrm.connectors.connector_manager import (
+    ConnectorException,
+    get_search_cache_stats,
+)
 from bookwyrm.utils import regex
 
 
@@ -41,6 +44,8 @@ class Dashboard(View):
             r"[\s\@]", settings.EMAIL_SENDER_DOMAIN
         ) or not re.match(regex.DOMAIN, settings.EMAIL_SENDER_DOMAIN)
 
+        data["search_cache_stats"] = get_search_cache_stats()
+
         data["email_config_error"] = email_config_error
         # pylint: disable=line-too-long
         data[
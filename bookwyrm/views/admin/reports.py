@@ -7,7 +7,7 @@ from django.template.response import TemplateResponse
 from django.utils.decorators import method_decorator
 from django.views import View
 
-from bookwyrm import forms, models
+from bookwyrm import activitystreams, forms, models
 from bookwyrm.settings import PAGE_LENGTH
 
 
@@ -123,6 +123,8 @@ def moderator_delete_user(request, user_id):
     if form.is_valid() and moderator.check_password(form.cleaned_data["password"]):
         user.deactivation_reason = "moderator_deletion"
         user.delete()
+        # take their statuses out of everyone's feeds
+        activitystreams.remove_statuses(user.status_set.values_list("id", flat=True))
         return redirect("settings-user", user.id)
 
     form.errors["password"] = ["Invalid password"]
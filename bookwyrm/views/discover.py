@@ -19,7 +19,7 @@ class Discover(View):
         # all activities in the "federated" feed associated with a book
         activities = (
             activitystreams.streams["local"]
-            .get_activity_stream(request.user)
+            .get_stream_statuses(request.user)
             .filter(
                 Q(comment__isnull=False)
                 | Q(review__isnull=False)
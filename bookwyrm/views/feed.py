@@ -14,7 +14,7 @@ from bookwyrm.models.user import FeedFilterChoices
 from bookwyrm.activitypub import ActivitypubResponse
 from bookwyrm.settings import PAGE_LENGTH, STREAMS
 from bookwyrm.suggested_users import suggested_users
-from .helpers import filter_stream_by_status_type, get_user_from_username
+from .helpers import get_user_from_username
 from .helpers import is_api_request, is_bookwyrm_request, maybe_redirect_local_path
 from .annual_summary import get_annual_summary_year
 
@@ -41,14 +41,10 @@ class Feed(View):
         tab = [s for s in STREAMS if s["key"] == tab]
         tab = tab[0] if tab else STREAMS[0]
 
-        activities = activitystreams.streams[tab["key"]].get_activity_stream(
-            request.user
+        activities = activitystreams.streams[tab["key"]].get_stream_statuses(
+            request.user, allowed_types=request.user.feed_status_types
         )
-        filtered_activities = filter_stream_by_status_type(
-            activities,
-            allowed_types=request.user.feed_status_types,
-        )
-        paginated = Paginator(filtered_activities, PAGE_LENGTH)
+        paginated = Paginator(activities, PAGE_LENGTH)
 
         suggestions = suggested_users.get_suggestions(request.user)
 
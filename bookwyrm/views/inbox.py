@@ -1,11 +1,17 @@
 """ incoming activities """
+from collections import namedtuple
+import datetime
 import json
 import re
 import logging
+import time
+from uuid import uuid4
 
 from urllib.parse import urldefrag
 import requests
+from requests.structures import CaseInsensitiveDict
 
+from django.core.cache import cache
 from django.http import HttpResponse, Http404
 from django.core.exceptions import BadRequest, PermissionDenied
 from django.shortcuts import get_object_or_404
@@ -13,13 +19,25 @@ from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
-from bookwyrm import activitypub, models
+from bookwyrm import activitypub, models, settings
+from bookwyrm.redis_store import r
 from bookwyrm.tasks import app, MEDIUM, HIGH
-from bookwyrm.signatures import Signature
+from bookwyrm.signatures import MAX_SIGNATURE_AGE, Signature, http_date_age
 from bookwyrm.utils import regex
 
 logger = logging.getLogger(__name__)
 
+# how many queued activities to verify at a time
+VERIFY_BATCH_SIZE = 100
+# how long a batch can take to verify before it's assumed its worker stopped, and
+# its requests are queued again, in seconds
+VERIFY_TIMEOUT = 60 * 10
+# how long to remember remote users' public keys, in seconds
+PUBLIC_KEY_CACHE_TIMEOUT = 60 * 60
+
+# an incoming request that's waiting to be verified
+QueuedRequest = namedtuple("QueuedRequest", ("path", "headers", "body"))
+
 
 @method_decorator(csrf_exempt, name="dispatch")
 # pylint: disable=no-self-use
@@ -51,8 +69,25 @@ class Inbox(View):
         ):
             raise Http404()
 
-        # verify the signature
-        if not has_valid_signature(request, activity_json):
+        # Make activities relating to follow/unfollow a high priority
+        high = ["Follow", "Accept", "Reject", "Block", "Unblock", "Undo"]
+        priority = HIGH if activity_json["type"] in high else MEDIUM
+
+        if settings.INBOX_FAST_ACCEPT:
+            # a request that's already too old to verify, or that isn't even signed
+            # by its actor, isn't worth queueing
+            if not is_recent(request) or not is_signed_by_actor(request, activity_json):
+                if activity_json["type"] == "Delete":
+                    return HttpResponse()
+                return HttpResponse(status=401)
+            # the signature is checked later, so this doesn't hold up the worker
+            if not queue_request(request, priority):
+                # the workers are behind, so the sender should try again later
+                return HttpResponse(status=503, headers={"Retry-After": "60"})
+            return HttpResponse(status=202)
+
+        # verify the signature, without waiting on another worker's key lookup
+        if not has_valid_signature(request, activity_json, wait=False):
             if activity_json["type"] == "Delete":
                 # Pretend that unauth'd deletes succeed. Auth may be failing
                 # because the resource or owner of the resource might have
@@ -60,10 +95,6 @@ class Inbox(View):
                 return HttpResponse()
             return HttpResponse(status=401)
 
-        # Make activities relating to follow/unfollow a high priority
-        high = ["Follow", "Accept", "Reject", "Block", "Unblock", "Undo"]
-
-        priority = HIGH if activity_json["type"] in high else MEDIUM
         activity_task.apply_async(args=(activity_json,), queue=priority)
         return HttpResponse()
 
@@ -113,8 +144,183 @@ def activity_task(activity_json):
     activity.action()
 
 
-def has_valid_signature(request, activity):
-    """verify incoming signature"""
+def queue_id(priority):
+    """the redis key for requests waiting to be verified"""
+    return f"inbox-{priority}"
+
+
+def is_recent(request):
+    """whether a request's date is recent enough for its signature to be valid"""
+    try:
+        return http_date_age(request.headers["date"]) <= MAX_SIGNATURE_AGE
+    except (KeyError, ValueError):
+        return False
+
+
+def is_signed_by_actor(request, activity_json):
+    """whether a request has a signature header from the activity's actor. This
+    doesn't look up any keys, so the signature still needs to be verified"""
+    try:
+        signature = Signature.parse(request)
+    except (KeyError, ValueError):
+        return False
+    return urldefrag(signature.key_id).url == activity_json.get("actor")
+
+
+def queue_request(request, priority):
+    """store a request for a worker to verify and handle. Returns False if the
+    queue is full"""
+    if r.llen(queue_id(priority)) >= settings.INBOX_QUEUE_MAX_LENGTH:
+        logger.warning("Inbox queue %s is full, turning requests away", priority)
+        return False
+    # new requests go on the left and are taken from the right
+    r.lpush(
+        queue_id(priority),
+        json.dumps(
+            {
+                "path": request.path,
+                "headers": dict(request.headers),
+                "body": request.body.decode("utf-8"),
+                # the signature's age is measured from when it arrived here
+                "received": time.time(),
+            }
+        ),
+    )
+    # there only needs to be one task waiting to verify requests
+    if r.set(f"{queue_id(priority)}-scheduled", 1, nx=True, ex=60):
+        verify_requests_task.apply_async(args=(priority,), queue=priority)
+    return True
+
+
+@app.task(queue=MEDIUM)
+def verify_requests_task(priority):
+    """check the signatures on queued requests, and handle the ones that pass"""
+    key = queue_id(priority)
+    # anything queued after this will schedule another task
+    r.delete(f"{key}-scheduled")
+    recover_requests(priority)
+    while True:
+        # requests are moved to a list for this batch while they're checked, so
+        # they can be recovered if the worker stops
+        batch_key = f"{key}-processing-{uuid4().hex}"
+        r.zadd(f"{key}-processing", {batch_key: time.time()})
+        pipeline = r.pipeline()
+        for _ in range(VERIFY_BATCH_SIZE):
+            pipeline.rpoplpush(key, batch_key)
+        batch = [item for item in pipeline.execute() if item is not None]
+
+        verify_requests(batch, priority, batch_key)
+
+        pipeline = r.pipeline()
+        pipeline.delete(batch_key)
+        pipeline.zrem(f"{key}-processing", batch_key)
+        pipeline.execute()
+        if len(batch) < VERIFY_BATCH_SIZE:
+            break
+
+
+def recover_requests(priority):
+    """queue the requests again from batches whose workers stopped before they
+    finished"""
+    key = queue_id(priority)
+    for batch_key in r.zrangebyscore(
+        f"{key}-processing", 0, time.time() - VERIFY_TIMEOUT
+    ):
+        while r.rpoplpush(batch_key, key) is not None:
+            pass
+        r.zrem(f"{key}-processing", batch_key)
+
+
+def read_request(item):
+    """a queued request, its activity, and when it was received"""
+    data = json.loads(item)
+    request = QueuedRequest(
+        data["path"],
+        CaseInsensitiveDict(data["headers"]),
+        data["body"].encode("utf-8"),
+    )
+    received = datetime.datetime.utcfromtimestamp(data["received"])
+    return (request, json.loads(request.body), received)
+
+
+def verify_requests(batch, priority, batch_key):
+    """queue the activities in a batch that have valid signatures. Each request
+    is removed from the batch once it's been handled, so that if the worker
+    stops, only the rest are queued again"""
+    queued = []
+    for item in batch:
+        try:
+            queued.append((item, *read_request(item)))
+        except (KeyError, TypeError, ValueError) as err:
+            logger.info("Unable to read queued request: %s", err)
+            r.lrem(batch_key, 1, item)
+
+    # each remote user's key is looked up once for the whole batch
+    public_keys = get_public_keys(
+        {
+            activity_json.get("actor")
+            for (_, _, activity_json, _) in queued
+            if isinstance(activity_json, dict)
+        }
+    )
+    for (item, request, activity_json, received) in queued:
+        try:
+            verify_request(request, activity_json, received, public_keys, priority)
+        except (AttributeError, KeyError, TypeError, ValueError) as err:
+            logger.info("Unable to verify queued request: %s", err)
+        except Exception as err:  # pylint: disable=broad-except
+            # one request that can't be checked doesn't stop the rest of the batch,
+            # and isn't tried again
+            logger.exception("Unable to verify queued request: %s", err)
+        r.lrem(batch_key, 1, item)
+
+
+def verify_request(request, activity_json, received, public_keys, priority):
+    """queue an activity if its signature is valid"""
+    valid = has_valid_signature(
+        request, activity_json, received=received, public_keys=public_keys
+    )
+    if not valid:
+        logger.info("Invalid signature for activity %s", activity_json.get("id"))
+        return
+    activity_task.apply_async(args=(activity_json,), queue=priority)
+
+
+def public_key_cache_key(actor):
+    """the cache key for a remote user's public key"""
+    return f"public-key-{actor}"
+
+
+def get_public_keys(actors):
+    """the cached public keys of a set of remote users, by actor"""
+    actors = [actor for actor in actors if isinstance(actor, str)]
+    keys = cache.get_many([public_key_cache_key(actor) for actor in actors])
+    return {
+        actor: keys[public_key_cache_key(actor)]
+        for actor in actors
+        if public_key_cache_key(actor) in keys
+    }
+
+
+def get_public_key(actor, refresh=False, wait=True):
+    """a remote user's public key, remembered so that a burst of activities from
+    one user only looks it up once"""
+    key = public_key_cache_key(actor)
+    public_key = None if refresh else cache.get(key)
+    if public_key is None:
+        remote_user = activitypub.resolve_remote_id(
+            actor, model=models.User, refresh=refresh, wait=wait
+        )
+        if not remote_user:
+            return None
+        public_key = remote_user.key_pair.public_key
+        cache.set(key, public_key, PUBLIC_KEY_CACHE_TIMEOUT)
+    return public_key
+
+
+def has_valid_signature(request, activity, received=None, public_keys=None, wait=True):
+    """verify incoming signature, using the public keys already looked up for a
+    batch if there are any"""
     try:
         signature = Signature.parse(request)
 
@@ -122,20 +328,20 @@ def has_valid_signature(request, activity):
         if key_actor != activity.get("actor"):
             raise ValueError("Wrong actor created signature.")
 
-        remote_user = activitypub.resolve_remote_id(key_actor, model=models.User)
-        if not remote_user:
+        public_key = (public_keys or {}).get(key_actor) or get_public_key(
+            key_actor, wait=wait
+        )
+        if not public_key:
             return False
 
         try:
-            signature.verify(remote_user.key_pair.public_key, request)
+            signature.verify(public_key, request, received=received)
         except ValueError:
-            old_key = remote_user.key_pair.public_key
-            remote_user = activitypub.resolve_remote_id(
-                remote_user.remote_id, model=models.User, refresh=True
-            )
-            if remote_user.key_pair.public_key == old_key:
+            old_key = public_key
+            public_key = get_public_key(key_actor, refresh=True, wait=wait)
+            if public_key == old_key:
                 raise  # Key unchanged.
-            signature.verify(remote_user.key_pair.public_key, request)
+            signature.verify(public_key, request, received=received)
     except (ValueError, requests.exceptions.HTTPError):
         return False
     return True
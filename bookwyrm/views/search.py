@@ -1,10 +1,12 @@
 """ search views"""
 import re
 
+from django.contrib.auth.decorators import login_required
 from django.contrib.postgres.search import TrigramSimilarity
 from django.core.paginator import Paginator
 from django.db.models.functions import Greatest
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.views import View
 
@@ -12,7 +14,7 @@ from csp.decorators import csp_update
 
 from bookwyrm import models
 from bookwyrm.connectors import connector_manager
-from bookwyrm.book_search import search, format_search_result
+from bookwyrm.book_search import search, format_search_result, typeahead
 from bookwyrm.settings import PAGE_LENGTH
 from bookwyrm.utils import regex
 from .helpers import is_api_request
@@ -60,6 +62,11 @@ def api_book_search(request):
     )
 
 
+def book_typeahead(request):
+    """suggest books and authors as someone types"""
+    return JsonResponse(typeahead(request.GET.get("q")))
+
+
 def book_search(request):
     """the real business is elsewhere"""
     query = request.GET.get("q")
@@ -83,13 +90,42 @@ def book_search(request):
     }
     # if a logged in user requested remote results or got no local results, try remote
     if request.user.is_authenticated and (not local_results or search_remote):
-        data["remote_results"] = connector_manager.search(
-            query, min_confidence=min_confidence
-        )
+        # the connectors are searched in the background, and the page collects their
+        # results as they come in
+        search_id = connector_manager.start_search(query, min_confidence=min_confidence)
+        remote_results = connector_manager.get_search_results(search_id)
+        data["search_id"] = search_id
+        data["remote_results"] = remote_results["results"]
+        data["remote_loading"] = remote_results["loading"]
         data["remote"] = True
     return TemplateResponse(request, "search/book.html", data)
 
 
+@login_required
+def remote_search_results(request, search_id):
+    """the results from connectors that have responded to a search so far"""
+    remote_results = connector_manager.get_search_results(search_id)
+    if remote_results is None:
+        raise Http404()
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "connector": result_set["connector"].identifier,
+                    "html": render_to_string(
+                        "search/remote_results.html",
+                        {"result_set": result_set},
+                        request=request,
+                    ),
+                }
+                for result_set in remote_results["results"]
+                if result_set["results"]
+            ],
+            "loading": remote_results["loading"],
+        }
+    )
+
+
 def user_search(request):
     """cool kids members only user search"""
     viewer = request.user
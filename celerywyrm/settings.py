@@ -24,6 +24,16 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "update-search-vectors": {
+        "task": "bookwyrm.book_search.update_search_vectors_task",
+        "schedule": SEARCH_VECTOR_UPDATE_INTERVAL,
+    },
+    "deliver-all": {
+        "task": "bookwyrm.delivery.deliver_all_task",
+        "schedule": DELIVERY_SWEEP_INTERVAL,
+    },
+}
 CELERY_TIMEZONE = env("TIME_ZONE", "UTC")
 
 FLOWER_PORT = env("FLOWER_PORT")
@@ -0,0 +1 @@
+./bw-dev runweb python manage.py populate_substreams